@@ -0,0 +1,371 @@
+# async_host.py
+
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import redis
+import redis.asyncio
+from factory_redis import FactoryRedis
+from line_redis import LineRedis
+from warehouse_redis import WarehouseRedis
+from product_stock_redis import ProductStockRedis
+from supplier_redis import SupplierRedis
+from order_streams import ensure_group, SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP
+from metrics import start_metrics_server
+from snapshot_aggregator import STOCK_FLUSH_CHANNEL
+from checkpoint import save_entity_states, load_entity_states, discard_entity_states
+from tick_coordinator import (
+    tick_channel,
+    register_participant,
+    ack_tick,
+    parse_tick,
+    announce_day,
+    process_participant_name,
+    TICK_SAVE,
+    TICK_REGISTER
+)
+from utils import (
+    print_update,
+    ERROR,
+    TIME_SLEEP,
+    DAYS_MAX,
+    REDIS_HOST,
+    REDIS_PORT,
+    WIRE_FORMAT,
+    ORDER_TRANSPORT,
+    PLANT_FACTORIES,
+    DAY_CLOCK,
+    ASYNC_HOST_THREADS
+)
+
+READY_CHANNEL = "control:warehouse_ready"
+
+USAGE = """Uso: python3 async_host.py [entidade ...]
+Entidades:
+  supplier | warehouse | product_stock
+  warehouse:[worker_id]                 (worker extra do almoxarifado; só com ORDER_TRANSPORT = 'stream')
+  factory:[empurrada|puxada]:[factory_id]:[lines_number]
+  line:[factory_id]:[line_id]
+  lines:[factory_id]:[lines_number]     (linhas 1..N da fábrica)
+  lines:[factory_id]:[first]-[last]     (linhas first..last da fábrica)
+  all                                   (a planta inteira de PLANT_FACTORIES)"""
+
+ALL_ENTITIES = [
+    'supplier', 'warehouse', 'product_stock',
+    *(f'factory:{fabric_type}:{factory_id}:{lines_n}' for fabric_type, factory_id, lines_n in PLANT_FACTORIES),
+    *(f'lines:{factory_id}:{lines_n}' for _, factory_id, lines_n in PLANT_FACTORIES),
+]
+
+
+class _EntityLane:
+    """
+    Fila de execução de uma entidade: as chamadas (handlers e rotinas diárias,
+    que falam com o Redis pelo cliente síncrono) rodam no executor, uma de cada
+    vez e na ordem em que foram enfileiradas, sem bloquear o event loop.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+        self.queue = asyncio.Queue()
+        self.task = None
+
+    def submit(self, fn, *args):
+        """Enfileira fn(*args) e devolve o future do resultado."""
+        if self.task is None:
+            self.task = asyncio.create_task(self._work())
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, args, future))
+        return future
+
+    async def run(self, fn, *args):
+        return await self.submit(fn, *args)
+
+    async def drain(self):
+        """Espera terminar tudo o que já foi enfileirado."""
+        await self.queue.join()
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            fn, args, future = await self.queue.get()
+            try:
+                result = await loop.run_in_executor(self.executor, fn, *args)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            self.queue.task_done()
+
+
+class AsyncPlantHost:
+    """
+    Hospeda qualquer subconjunto das entidades em um único processo e um único
+    event loop. Todas as assinaturas passam por uma só conexão pubsub
+    (redis.asyncio) e as mensagens são roteadas pelo canal para o
+    handle_message de cada entidade. As entidades são síncronas (as mesmas dos
+    processos separados) e cada comando delas é um round trip bloqueante, que
+    pararia o loop inteiro: por isso handlers e rotinas diárias rodam em um
+    pool de ASYNC_HOST_THREADS threads, com um cliente sobre um pool de
+    conexões compartilhado. Cada entidade tem sua fila (_EntityLane), que
+    executa as chamadas dela uma de cada vez e na ordem de chegada, enquanto
+    as de entidades diferentes correm em paralelo. No relógio lockstep o host é
+    um participante por fase: os ticks chegam pela mesma conexão pubsub e, para
+    a execução ser reprodutível, cada tick espera as mensagens já recebidas
+    serem tratadas e roda as rotinas da fase uma entidade por vez, na ordem em
+    que foram adicionadas, antes da confirmação.
+    """
+
+    def __init__(self, host=REDIS_HOST, port=REDIS_PORT):
+        # Com mensagens binárias (ver codec.py) as respostas ficam em bytes
+        decode = WIRE_FORMAT == 'text'
+        self.pool = redis.ConnectionPool(host=host, port=port, decode_responses=decode)
+        self.r = redis.Redis(connection_pool=self.pool)
+        self.ar = redis.asyncio.Redis(host=host, port=port, decode_responses=decode)
+        self.entity_name = 'async-host'
+        self.executor = ThreadPoolExecutor(ASYNC_HOST_THREADS, thread_name_prefix='async-host')
+        self.lanes = {}
+        # canal -> [(fila da entidade, handler)]
+        self.handlers = {}
+        # (entidade, rotinas do dia, espera o almoxarifado, fase do relógio lockstep)
+        self.daily_tasks = []
+        self.participant = process_participant_name('async-host')
+        # Todas as entidades do processo, expostas juntas no endpoint de métricas
+        self.entities = []
+        self.warehouse = None
+        self.supplier = None
+        self.warehouse_ready = asyncio.Event()
+
+    def _lane(self, entity_name):
+        lane = self.lanes.get(entity_name)
+        if lane is None:
+            lane = self.lanes[entity_name] = _EntityLane(self.executor)
+        return lane
+
+    def _route(self, entity):
+        self.entities.append(entity)
+        self.handlers.setdefault(entity.channel, []).append((self._lane(entity.entity_name), entity.handle_message))
+
+    def add_entity(self, spec):
+        """Cria a(s) entidade(s) descrita(s) por `spec` (ver USAGE) e registra suas rotinas."""
+        kind, *args = spec.split(':')
+        if kind == 'supplier':
+            self.supplier = SupplierRedis(self.r)
+            if ORDER_TRANSPORT == 'stream':
+                ensure_group(self.r, SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP)
+                self.entities.append(self.supplier)
+            else:
+                self._route(self.supplier)
+            if DAY_CLOCK == 'lockstep':
+                # Sem a task de consumo: os pedidos do stream são atendidos no tick da última fase
+                steps = [self.supplier.process_order_backlog] if ORDER_TRANSPORT == 'stream' else []
+                self.daily_tasks.append((self.supplier.entity_name, steps, False, 'supplier'))
+        elif kind == 'warehouse' and args and int(args[0]) > 0:
+            if ORDER_TRANSPORT != 'stream':
+                raise ValueError(f"Workers extras do almoxarifado exigem ORDER_TRANSPORT = 'stream': '{spec}'")
+            worker = WarehouseRedis(self.r, int(args[0]))
+            self.entities.append(worker)
+            self.daily_tasks.append((worker.entity_name, [worker.process_order_queue], False, 'warehouse'))
+        elif kind == 'warehouse':
+            self.warehouse = WarehouseRedis(self.r)
+            self._route(self.warehouse)
+            self.daily_tasks.append((self.warehouse.entity_name, [
+                self.warehouse.process_order_queue,
+                self.warehouse.check_and_order_parts_from_supplier,
+                self.warehouse.log_order_queue_depth,
+            ], False, 'warehouse'))
+        elif kind == 'product_stock':
+            ps = ProductStockRedis(self.r)
+            self._route(ps)
+            self.daily_tasks.append((ps.entity_name, [ps.simulate_daily_customer_orders], False, 'product_stock'))
+        elif kind == 'factory':
+            fabric_type, factory_id, lines_n = args
+            fac = FactoryRedis(fabric_type, factory_id, int(lines_n), self.r)
+            self._route(fac)
+            self.daily_tasks.append((fac.entity_name, [fac.order_daily_batch], False, 'factory'))
+        elif kind == 'line':
+            self._add_line(args[1], args[0])
+        elif kind == 'lines':
+            factory_id, lines = args
+            first, _, last = lines.rpartition('-')
+            for line_id in range(int(first or 1), int(last) + 1):
+                self._add_line(line_id, factory_id)
+        elif kind == 'all':
+            for default_spec in ALL_ENTITIES:
+                self.add_entity(default_spec)
+        else:
+            raise ValueError(f"Entidade desconhecida: '{spec}'")
+
+    def _add_line(self, line_id, factory_id):
+        line = LineRedis(line_id, factory_id, self.r)
+        self._route(line)
+        if line.stock_cache == 'write_behind':
+            self.handlers.setdefault(STOCK_FLUSH_CHANNEL, []).append(
+                (self._lane(line.entity_name), lambda data, line=line: line.flush_stock()))
+        # As linhas só começam depois do sinal de prontidão do almoxarifado
+        self.daily_tasks.append((line.entity_name, [line.check_and_order_parts], True, 'line'))
+
+    def _stateful_entities(self, phase=None):
+        """Entidades com estado em memória para os checkpoints (o fornecedor não tem), todas ou as da fase."""
+        names = {name for name, _, _, task_phase in self.daily_tasks if phase in (None, task_phase)}
+        return [entity for entity in self.entities
+                if entity is not self.supplier and (phase is None or entity.entity_name in names)]
+
+    def _phases(self):
+        return list(dict.fromkeys(phase for *_, phase in self.daily_tasks))
+
+    async def _dispatch(self, subscribed):
+        pubsub = self.ar.pubsub()
+        tick_channels = {tick_channel(phase): phase for phase in self._phases()} if DAY_CLOCK == 'lockstep' else {}
+        await pubsub.subscribe(READY_CHANNEL, *tick_channels, *self.handlers)
+        print_update(f"Ouvindo {len(self.handlers)} canais em uma única conexão pubsub...", self.entity_name)
+        subscribed.set()
+
+        async for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            channel = message['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            data = message['data']
+
+            if channel == READY_CHANNEL:
+                if data in ("READY", b"READY"):
+                    self.warehouse_ready.set()
+                continue
+            if channel in tick_channels:
+                # Aguardado aqui: as mensagens seguintes só são entregues depois do tick
+                if not await self._run_tick(tick_channels[channel], data):
+                    print_update("Simulação terminada.", self.entity_name)
+                    return
+                continue
+
+            for lane, handler in self.handlers.get(channel, ()):
+                lane.submit(self._handle, channel, handler, data)
+
+    def _handle(self, channel, handler, data):
+        try:
+            handler(data)
+        except Exception as e:
+            # Uma mensagem com problema não pode derrubar as outras entidades do processo
+            print_update(f"Erro ao tratar mensagem do canal {channel}: {e!r}", self.entity_name, ERROR)
+
+    @staticmethod
+    def _run_steps(steps):
+        for step in steps:
+            step()
+
+    async def _consume_supplier_orders(self):
+        """Equivalente assíncrono de SupplierRedis.consume_orders: XREADGROUP bloqueante sem travar o loop."""
+        name = self.supplier.entity_name
+        lane = self._lane(name)
+        print_update(f"Consumindo o stream '{SUPPLIER_ORDERS_STREAM}' por pedidos do almoxarifado...", name)
+        # Primeiro os pedidos lidos e não confirmados antes de uma queda; depois os novos.
+        start_id = '0'
+        while True:
+            response = await self.ar.xreadgroup(SUPPLIER_GROUP, name, {SUPPLIER_ORDERS_STREAM: start_id}, count=10, block=1000)
+            entries = [entry for _, stream_entries in response or [] for entry in stream_entries]
+            if start_id == '0' and not entries:
+                start_id = '>'
+            for entry_id, fields in entries:
+                data = fields.get('data', fields.get(b'data')) if fields else None
+                try:
+                    if data is not None:
+                        await lane.run(self.supplier.handle_message, data)
+                except Exception as e:
+                    print_update(f"Erro ao tratar pedido {entry_id!r}: {e!r}", self.entity_name, ERROR)
+                await self.ar.xack(SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP, entry_id)
+
+    async def _run_tick(self, phase, data):
+        """Roda as rotinas da fase do tick e confirma ao coordenador; False no fim da simulação."""
+        if data in (TICK_REGISTER, TICK_REGISTER.encode()):
+            await asyncio.to_thread(register_participant, self.r, self.participant, phase)
+            return True
+        # Como no host de uma thread só: as mensagens recebidas antes do tick são tratadas antes dele
+        await asyncio.gather(*(lane.drain() for lane in self.lanes.values()))
+        if data in (TICK_SAVE, TICK_SAVE.encode()):
+            await asyncio.to_thread(save_entity_states, self.r, self._stateful_entities(phase))
+            await asyncio.to_thread(ack_tick, self.r, self.participant, phase, TICK_SAVE)
+            return True
+        day = parse_tick(data)
+        if day is None:
+            return False
+        # Uma entidade por vez: a ordem dos pedidos nos streams (e o resultado) não depende das threads
+        for name, steps, _, task_phase in self.daily_tasks:
+            if task_phase == phase:
+                await self._lane(name).run(self._run_steps, steps)
+        await asyncio.to_thread(ack_tick, self.r, self.participant, phase, day)
+        return True
+
+    async def _every_day(self, entity_name, steps, wait_for_warehouse, phase):
+        if wait_for_warehouse:
+            print_update("Aguardando sinal de prontidão do almoxarifado...", entity_name)
+            await self.warehouse_ready.wait()
+            print_update("Sinal recebido! Iniciando ciclo de operações.", entity_name)
+
+        lane = self._lane(entity_name)
+        for day in range(1, DAYS_MAX + 1):
+            print_update(f"--- Dia {day} ---", entity_name)
+            await lane.run(self._run_steps, steps)
+            if self.warehouse is not None and entity_name == self.warehouse.entity_name:
+                # Fim do dia do almoxarifado: o histórico de estoque registra o dia (ver stock_history.py)
+                await lane.run(announce_day, self.r, day)
+                if day == 1:
+                    # Sem coordenador: passado o primeiro dia, todas já carregaram o estado do checkpoint
+                    await lane.run(discard_entity_states, self.r)
+            await asyncio.sleep(TIME_SLEEP)
+        print_update("Simulação terminada.", entity_name)
+
+    async def run(self):
+        restored = await asyncio.to_thread(load_entity_states, self.r, self._stateful_entities())
+        if restored:
+            print_update(f"{restored} entidades restauradas do checkpoint.", self.entity_name)
+        start_metrics_server(self.entities, self.r)
+        subscribed = asyncio.Event()
+        dispatcher = asyncio.create_task(self._dispatch(subscribed))
+        await subscribed.wait()
+        if DAY_CLOCK == 'lockstep':
+            for phase in self._phases():
+                await asyncio.to_thread(register_participant, self.r, self.participant, phase)
+            print_update(f"Participante do relógio lockstep nas fases {self._phases()}.", self.entity_name)
+            await dispatcher
+            return
+        # O almoxarifado já pode ter avisado antes desta assinatura (ex.: hosts de linhas iniciados depois)
+        if await asyncio.to_thread(self.r.get, READY_CHANNEL) is not None:
+            self.warehouse_ready.set()
+        if self.supplier is not None and ORDER_TRANSPORT == 'stream':
+            # Referência guardada: o loop só mantém referências fracas às tasks
+            self.supplier_task = asyncio.create_task(self._consume_supplier_orders())
+
+        if self.warehouse is not None:
+            await self.ar.set(READY_CHANNEL, "READY")
+            await self.ar.publish(READY_CHANNEL, "READY")
+            print_update("Sinal de 'PRONTO' enviado para as linhas.", self.warehouse.entity_name)
+
+        await asyncio.gather(*(self._every_day(*task) for task in self.daily_tasks))
+        # Assim como os processos separados, o host continua atendendo mensagens após o último dia.
+        await dispatcher
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(USAGE)
+        sys.exit(1)
+
+    try:
+        host = AsyncPlantHost()
+        host.r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+
+    try:
+        for spec in sys.argv[1:]:
+            host.add_entity(spec)
+    except ValueError as e:
+        print(f"{e}\n{USAGE}")
+        sys.exit(1)
+
+    asyncio.run(host.run())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# async_log.py
+
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+# Níveis de log (os mesmos valores do módulo logging da biblioteca padrão)
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+_STOP = object()
+
+
+class AsyncLogWriter:
+    """
+    Escritor de logs em segundo plano. Quem loga só enfileira o registro
+    (SimpleQueue.put nunca bloqueia); uma thread própria agrupa os registros
+    em lotes, escreve um arquivo por entidade com rotação por tamanho e faz
+    um único flush por lote.
+    """
+
+    def __init__(self, directory='output', fmt='text', max_bytes=10 * 1024 * 1024,
+                 backup_count=3, flush_interval=0.5, batch_size=1000, console=True):
+        self.directory = directory
+        self.fmt = fmt
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.console = console
+        self._queue = queue.SimpleQueue()
+        self._files = {}
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='async-log-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, entity_name, level, msg):
+        """Enfileira um registro; não faz nenhuma E/S na thread chamadora."""
+        self._queue.put((time.time(), entity_name, level, msg))
+
+    def flush(self, timeout=5.0):
+        """Espera a thread escritora gravar tudo o que foi enfileirado até agora."""
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout=5.0)
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            batch, waiters, stop = [], [], False
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                for f in self._files.values():
+                    f.close()
+                self._files.clear()
+                return
+
+    def _format(self, record):
+        ts, entity_name, level, msg = record
+        if self.fmt == 'json':
+            return json.dumps({
+                'ts': round(ts, 6),
+                'level': LEVEL_NAMES.get(level, str(level)),
+                'entity': entity_name,
+                'msg': msg,
+            }, ensure_ascii=False) + "\n"
+        return (
+            "\n"
+            "===============================================================================\n"
+            f"[{entity_name.upper()}] {msg}\n"
+            "===============================================================================\n"
+        )
+
+    def _write_batch(self, batch):
+        by_entity = {}
+        for record in batch:
+            by_entity.setdefault(record[1], []).append(self._format(record))
+
+        if self.console:
+            sys.stdout.write("".join(text for lines in by_entity.values() for text in lines))
+            sys.stdout.flush()
+
+        for entity_name, lines in by_entity.items():
+            f = self._open(entity_name)
+            f.write("".join(lines))
+            f.flush()
+            if f.tell() >= self.max_bytes:
+                self._rotate(entity_name)
+
+    def _path(self, entity_name):
+        extension = 'jsonl' if self.fmt == 'json' else 'txt'
+        return os.path.join(self.directory, f"{entity_name}.{extension}")
+
+    def _open(self, entity_name):
+        f = self._files.get(entity_name)
+        if f is None:
+            f = open(self._path(entity_name), 'a', encoding='utf-8')
+            self._files[entity_name] = f
+        return f
+
+    def _rotate(self, entity_name):
+        """entidade.txt -> entidade.txt.1 -> ... -> entidade.txt.N (o mais antigo é descartado)."""
+        self._files.pop(entity_name).close()
+        path = self._path(entity_name)
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
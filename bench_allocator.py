@@ -0,0 +1,58 @@
+# bench_allocator.py
+
+import sys
+import time
+import redis
+import utils
+from memory_redis import InMemoryRedis
+from stock_storage import make_stock_storage
+from warehouse_redis import WarehouseRedis
+from codec import encode_message
+from utils import PARTS_TO_SEND_AMOUNT_WAREHOUSE, NUM_PARTS, REDIS_HOST, REDIS_PORT, WIRE_FORMAT
+
+LINE_COUNTS = [13, 100, 1000]
+MODES = [None, 'fifo', 'fair', 'red']
+
+
+def fill_queue(wh, lines):
+    """Um pedido de todas as peças por linha, como o check_and_order_parts manda."""
+    flags = [1] * NUM_PARTS
+    for line_id in range(1, lines + 1):
+        wh.handle_message(encode_message("send_parts", line_id, 1, parts=flags))
+
+def measure(r, lines, policy):
+    """Tempo para esvaziar uma fila de `lines` pedidos com estoque suficiente para todos."""
+    storage = make_stock_storage(r)
+    storage.set_all('warehouse', [PARTS_TO_SEND_AMOUNT_WAREHOUSE * lines] * NUM_PARTS)
+    wh = WarehouseRedis(r, order_transport='pubsub', allocation_policy=policy)
+    fill_queue(wh, lines)
+
+    start = time.perf_counter()
+    ticks = 0
+    while wh.order_queue:
+        wh.process_order_queue()
+        ticks += 1
+    return time.perf_counter() - start, ticks
+
+def main():
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'memoria'
+    if backend not in ('memoria', 'redis'):
+        print("Uso: python3 bench_allocator.py [memoria|redis]")
+        sys.exit(1)
+
+    utils.set_output_enabled(False)
+    if backend == 'redis':
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=(WIRE_FORMAT == 'text'))
+    else:
+        r = InMemoryRedis()
+
+    header = f"{'linhas':>7} {'política':<8} {'dias':>6} {'tempo ms':>10} {'pedidos/s':>11}"
+    print(header)
+    print('-' * len(header))
+    for lines in LINE_COUNTS:
+        for policy in MODES:
+            seconds, ticks = measure(r, lines, policy)
+            print(f"{lines:>7} {policy or 'um/dia':<8} {ticks:>6} {seconds * 1000:>10.1f} {lines / seconds:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# bench_codec.py
+
+import sys
+import timeit
+from codec import encode_message, decode_message
+from utils import (
+    PARTS_TO_SEND_AMOUNT_SUPPLIER,
+    PARTS_TO_SEND_AMOUNT_WAREHOUSE,
+    NUM_PARTS
+)
+
+# Mensagens representativas do tráfego da planta: (descrição, comando, args, lista)
+SAMPLE_MESSAGES = [
+    ("pedido da linha (flags)", "send_parts", ("3", "2"), [1] * NUM_PARTS),
+    ("remessa do almoxarifado", "receive_parts", (), [PARTS_TO_SEND_AMOUNT_WAREHOUSE] * NUM_PARTS),
+    ("remessa do fornecedor (esparsa)", "receive_parts", (),
+     [PARTS_TO_SEND_AMOUNT_SUPPLIER if i % 10 == 0 else 0 for i in range(NUM_PARTS)]),
+    ("ordem de produção", "receive_order", ("2", "48"), None),
+    ("produtos prontos", "receive_products", ("2", "3", "2", "48"), None),
+    ("estoque de produtos", "update_factory", (), [812, 954, 1003, 640, 1175]),
+]
+
+
+def measure(command, args, parts, wire_format, number):
+    payload = encode_message(command, *args, parts=parts, wire_format=wire_format)
+    encode_s = timeit.timeit(lambda: encode_message(command, *args, parts=parts, wire_format=wire_format), number=number)
+    decode_s = timeit.timeit(lambda: decode_message(payload), number=number)
+    size = len(payload.encode('utf-8') if isinstance(payload, str) else payload)
+    return encode_s / number * 1e6, decode_s / number * 1e6, size
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    header = f"{'mensagem':<34} {'formato':<7} {'encode µs':>10} {'decode µs':>10} {'bytes':>7}"
+    print(header)
+    print('-' * len(header))
+    for description, command, args, parts in SAMPLE_MESSAGES:
+        for wire_format in ('text', 'binary'):
+            encode_us, decode_us, size = measure(command, args, parts, wire_format, number)
+            print(f"{description:<34} {wire_format:<7} {encode_us:>10.2f} {decode_us:>10.2f} {size:>7}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+# bench_plant.py
+
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict, deque
+import numpy as np
+import redis
+import utils
+from codec import encode_message
+from init_redis import populate_initial_stock
+from line_redis import LineRedis
+from warehouse_redis import WarehouseRedis
+from product_stock_redis import ProductStockRedis
+from supplier_redis import SupplierRedis
+from order_streams import OrderStream, SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP
+from stock_storage import make_stock_storage
+from utils import (
+    REDIS_HOST,
+    REDIS_PORT,
+    NUM_PARTS,
+    NUM_PRODUCTS,
+    BATCH_SIZE,
+    WIRE_FORMAT,
+    ORDER_TRANSPORT
+)
+
+# Cargas padrão: número de linhas x ordens de produção por segundo (total da planta)
+DEFAULT_LINE_COUNTS = [13, 100]
+DEFAULT_RATES = [50, 200, 800]
+DEFAULT_SECONDS = 10
+# "Dia" acelerado: intervalo entre as rotinas periódicas das entidades durante o benchmark
+BENCH_TICK = 0.1
+# Tempo extra depois da carga para as filas esvaziarem antes de medir
+DRAIN_SECONDS = 2.0
+# Abaixo desta fração da taxa oferecida a planta é considerada saturada
+SATURATION_RATIO = 0.95
+# Estoque inicial das linhas, para que as primeiras ordens não quebrem por falta de peças
+INITIAL_LINE_STOCK = BATCH_SIZE * 20
+
+USAGE = """Uso: python3 bench_plant.py [linhas,...] [ordens_por_s,...] [segundos] [arquivo.json]
+       python3 bench_plant.py comparar [antes.json] [depois.json]"""
+
+
+def _hop(name):
+    """Agrupa canais/streams por tipo: 'channel:line:1:3' -> 'channel:line'."""
+    parts = name.split(':')
+    return ':'.join(parts[:2])
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class _CountingPipeline:
+    def __init__(self, client, pipe):
+        self._client = client
+        self._pipe = pipe
+
+    def __getattr__(self, name):
+        attr = getattr(self._pipe, name)
+        if name == 'publish':
+            def publish(channel, message):
+                self._client.sent.append((channel, hash(message), time.time()))
+                attr(channel, message)
+                return self
+            return publish
+        return attr
+
+    def execute(self, *args, **kwargs):
+        self._client.round_trips += 1
+        return self._pipe.execute(*args, **kwargs)
+
+
+class InstrumentedRedis:
+    """
+    Cliente Redis que conta round trips e anota cada mensagem publicada ou
+    adicionada a um stream (canal, hash do payload, instante), para medir a
+    latência de cada salto casando envios e recebimentos depois da carga.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.round_trips = 0
+        self.sent = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        if name == 'pipeline':
+            return lambda *a, **k: _CountingPipeline(self, attr(*a, **k))
+        if name == 'pubsub':
+            return attr
+
+        def call(*args, **kwargs):
+            self.round_trips += 1
+            return attr(*args, **kwargs)
+        return call
+
+    def publish(self, channel, message):
+        self.sent.append((channel, hash(message), time.time()))
+        self.round_trips += 1
+        return self._client.publish(channel, message)
+
+    def xadd(self, stream, fields, **kwargs):
+        self.sent.append((stream, hash(fields['data']), time.time()))
+        self.round_trips += 1
+        return self._client.xadd(stream, fields, **kwargs)
+
+    def register_script(self, script):
+        run = self._client.register_script(script)
+
+        def call(*args, **kwargs):
+            self.round_trips += 1
+            return run(*args, **kwargs)
+        return call
+
+
+def _connect(host, port):
+    return redis.Redis(host=host, port=port, decode_responses=(WIRE_FORMAT == 'text'))
+
+def _build_entities(role, r, lines):
+    """Entidades de um processo de teste e suas rotinas periódicas."""
+    if role == 'lines':
+        entities = [LineRedis(line_id, factory_id, r) for factory_id, line_id in lines]
+        return entities, [line.check_and_order_parts for line in entities]
+    if role == 'warehouse':
+        wh = WarehouseRedis(r)
+        return [wh], [wh.process_order_queue, wh.check_and_order_parts_from_supplier]
+    if role == 'product_stock':
+        ps = ProductStockRedis(r, rng=random.Random(1))
+        return [ps], []
+    if role == 'supplier':
+        return [SupplierRedis(r)], []
+    raise ValueError(f"Papel desconhecido: '{role}'")
+
+def run_worker(role, lines, host, port, ready, stop, results, connect=_connect):
+    """
+    Um processo da planta sob teste: as entidades do papel, uma única conexão
+    pubsub para todos os canais e as rotinas periódicas a cada BENCH_TICK.
+    """
+    utils.set_output_enabled(False)
+    r = InstrumentedRedis(connect(host, port))
+    entities, periodic = _build_entities(role, r, lines)
+    handlers = {entity.channel: entity.handle_message for entity in entities}
+
+    # Com ORDER_TRANSPORT = 'stream' o fornecedor lê seus pedidos do stream
+    supplier_orders = None
+    if role == 'supplier' and ORDER_TRANSPORT == 'stream':
+        supplier_orders = OrderStream(r, SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP, 'supplier')
+    # E o almoxarifado lê os pedidos das linhas do stream; o recebimento é anotado na leitura
+    received = []
+    if role == 'warehouse' and entities[0].line_orders is not None:
+        orders = entities[0].line_orders
+        read_backlog = orders.read_backlog
+
+        def traced_read_backlog(*args, **kwargs):
+            entries = read_backlog(*args, **kwargs)
+            now = time.time()
+            received.extend((orders.stream, hash(data), now) for _, data in entries)
+            return entries
+        orders.read_backlog = traced_read_backlog
+
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(*handlers)
+    cpu_start = time.process_time()
+    handled, service = 0, 0.0
+    ready.release()
+
+    next_tick = time.time()
+    while not stop.is_set():
+        message = pubsub.get_message(timeout=0.005)
+        if message is not None and message['type'] == 'message':
+            start = time.time()
+            channel = _text(message['channel'])
+            received.append((channel, hash(message['data']), start))
+            handlers[channel](message['data'])
+            service += time.time() - start
+            handled += 1
+
+        if supplier_orders is not None:
+            for entry_id, data in supplier_orders.read(count=10):
+                received.append((SUPPLIER_ORDERS_STREAM, hash(data), time.time()))
+                entities[0].handle_message(data)
+                supplier_orders.ack(entry_id)
+                handled += 1
+
+        if periodic and time.time() >= next_tick:
+            for step in periodic:
+                step()
+            next_tick += BENCH_TICK
+
+    extra = {}
+    if role == 'product_stock':
+        extra['products_received'] = sum(1 for channel, _, _ in received if channel == entities[0].channel)
+    if role == 'lines':
+        extra['line_stops'] = sum(line.line_stops for line in entities)
+    results.put({
+        'role': role,
+        'handled': handled,
+        'service_seconds': service,
+        'cpu_seconds': time.process_time() - cpu_start,
+        'round_trips': r.round_trips,
+        'sent': r.sent,
+        'received': received,
+        **extra,
+    })
+
+def hop_latencies(sent, received):
+    """Casa envios e recebimentos (mesmo canal e payload, em ordem) e devolve os percentis por salto, em ms."""
+    pending = defaultdict(deque)
+    for channel, key, t in sorted(sent, key=lambda item: item[2]):
+        pending[(channel, key)].append(t)
+
+    samples = defaultdict(list)
+    for channel, key, t in sorted(received, key=lambda item: item[2]):
+        queue = pending.get((channel, key))
+        if queue:
+            samples[_hop(channel)].append((t - queue.popleft()) * 1000)
+
+    report = {}
+    for hop, values in sorted(samples.items()):
+        values = np.asarray(values)
+        report[hop] = {
+            'count': len(values),
+            'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p95_ms': round(float(np.percentile(values, 95)), 3),
+            'p99_ms': round(float(np.percentile(values, 99)), 3),
+            'max_ms': round(float(values.max()), 3),
+        }
+    return report
+
+def _command_calls(r):
+    """Total de comandos executados pelo servidor (INFO commandstats); None se indisponível."""
+    try:
+        return sum(stats['calls'] for stats in r.info('commandstats').values())
+    except (redis.exceptions.ResponseError, KeyError, TypeError):
+        return None
+
+def _prepare(r, lines):
+    r.flushdb()
+    populate_initial_stock(r)
+    storage = make_stock_storage(r)
+    pipe = r.pipeline(transaction=False)
+    for factory_id, line_id in lines:
+        storage.set_all(f"line:{factory_id}:{line_id}", [INITIAL_LINE_STOCK] * NUM_PARTS, pipe=pipe)
+    pipe.execute()
+
+def run_load(n_lines, rate, seconds, host=REDIS_HOST, port=REDIS_PORT, connect=_connect, spawn=None):
+    """
+    Uma rodada: sobe um processo por papel (linhas, almoxarifado, estoque de
+    produtos e fornecedor), envia `rate` ordens de produção por segundo para
+    linhas sorteadas durante `seconds` e coleta as métricas de todos.
+    """
+    lines = [(1 + i // 100, 1 + i % 100) for i in range(n_lines)]
+    control = connect(host, port)
+    _prepare(control, lines)
+
+    spawn = spawn or (lambda target, args: multiprocessing.Process(target=target, args=args, daemon=True))
+    roles = ['lines', 'warehouse', 'product_stock', 'supplier']
+    ready = multiprocessing.Semaphore(0)
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = [spawn(run_worker, (role, lines, host, port, ready, stop, results, connect)) for role in roles]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        ready.acquire()
+
+    driver = InstrumentedRedis(control)
+    rng = random.Random(42)
+    commands_before = _command_calls(control)
+    interval = 1.0 / rate
+    start = time.time()
+    sent_orders = 0
+    while True:
+        now = time.time()
+        if now - start >= seconds:
+            break
+        due = int((now - start) / interval) + 1
+        while sent_orders < due:
+            factory_id, line_id = lines[rng.randrange(n_lines)]
+            driver.publish(f"channel:line:{factory_id}:{line_id}",
+                           encode_message("receive_order", rng.randrange(NUM_PRODUCTS), BATCH_SIZE))
+            sent_orders += 1
+        time.sleep(min(interval, 0.01))
+
+    time.sleep(DRAIN_SECONDS)
+    stop.set()
+    reports = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=5)
+    commands_after = _command_calls(control)
+
+    by_role = {report['role']: report for report in reports}
+    sent = driver.sent + [item for report in reports for item in report['sent']]
+    received = [item for report in reports for item in report['received']]
+    handled = sum(report['handled'] for report in reports)
+    completed = by_role['product_stock']['products_received']
+    elapsed = seconds + DRAIN_SECONDS
+    return {
+        'lines': n_lines,
+        'offered_orders_per_s': rate,
+        'orders_sent': sent_orders,
+        'orders_completed': completed,
+        'line_stops': by_role['lines']['line_stops'],
+        'completed_orders_per_s': round(completed / seconds, 2),
+        'messages_per_s': round(handled / elapsed, 2),
+        'saturated': completed < SATURATION_RATIO * sent_orders,
+        'redis_commands_per_order': (round((commands_after - commands_before) / sent_orders, 2)
+                                     if commands_before is not None and commands_after is not None else None),
+        'round_trips_per_order': round(sum(report['round_trips'] for report in reports) / sent_orders, 2),
+        'cpu_percent': {report['role']: round(100 * report['cpu_seconds'] / elapsed, 1) for report in reports},
+        'handler_ms_per_message': {report['role']: round(1000 * report['service_seconds'] / max(report['handled'], 1), 3)
+                                   for report in reports},
+        'hops': hop_latencies(sent, received),
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_run(run):
+    print(f"{run['lines']:>6} linhas {run['offered_orders_per_s']:>6} ordens/s -> "
+          f"{run['completed_orders_per_s']:>8} concluídas/s, {run['messages_per_s']:>9} msgs/s, "
+          f"{run['round_trips_per_order']} round trips/ordem, {run['redis_commands_per_order']} comandos/ordem"
+          f"{'  SATURADO' if run['saturated'] else ''}")
+    for hop, stats in run['hops'].items():
+        print(f"{'':>8}{hop:<26} p50 {stats['p50_ms']:>8} ms  p95 {stats['p95_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms")
+    print(f"{'':>8}CPU %: {run['cpu_percent']}")
+
+def compare(before_path, after_path):
+    """Compara duas execuções salvas, rodada a rodada (mesmas linhas e taxa)."""
+    with open(before_path) as f:
+        before = {(run['lines'], run['offered_orders_per_s']): run for run in json.load(f)['runs']}
+    with open(after_path) as f:
+        after = json.load(f)['runs']
+    for run in after:
+        old = before.get((run['lines'], run['offered_orders_per_s']))
+        if old is None:
+            continue
+        print(f"{run['lines']:>6} linhas {run['offered_orders_per_s']:>6} ordens/s: "
+              f"concluídas/s {old['completed_orders_per_s']} -> {run['completed_orders_per_s']}, "
+              f"round trips/ordem {old['round_trips_per_order']} -> {run['round_trips_per_order']}")
+        for hop, stats in run['hops'].items():
+            if hop in old['hops']:
+                print(f"{'':>8}{hop:<26} p95 {old['hops'][hop]['p95_ms']} -> {stats['p95_ms']} ms")
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'comparar':
+        if len(sys.argv) != 4:
+            print(USAGE)
+            sys.exit(1)
+        compare(sys.argv[2], sys.argv[3])
+        return
+
+    try:
+        line_counts = [int(n) for n in sys.argv[1].split(',')] if len(sys.argv) > 1 else DEFAULT_LINE_COUNTS
+        rates = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else DEFAULT_RATES
+        seconds = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_SECONDS
+    except ValueError:
+        print(USAGE)
+        sys.exit(1)
+    path = sys.argv[4] if len(sys.argv) > 4 else f"bench_plant_{time.strftime('%Y%m%d_%H%M%S')}.json"
+
+    try:
+        _connect(REDIS_HOST, REDIS_PORT).ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        sys.exit(1)
+
+    runs = []
+    for n_lines in line_counts:
+        for rate in rates:
+            run = run_load(n_lines, rate, seconds)
+            print_run(run)
+            runs.append(run)
+
+    with open(path, 'w') as f:
+        json.dump({
+            'commit': _git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'config': {
+                'seconds': seconds,
+                'bench_tick': BENCH_TICK,
+                'wire_format': WIRE_FORMAT,
+                'order_transport': ORDER_TRANSPORT,
+                'stock_layout': utils.STOCK_LAYOUT,
+                'allocation_policy': utils.WAREHOUSE_ALLOCATION_POLICY,
+            },
+            'runs': runs,
+        }, f, indent=2)
+    print(f"Resultados salvos em {path}")
+
+if __name__ == "__main__":
+    main()
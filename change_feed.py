@@ -0,0 +1,222 @@
+# change_feed.py
+
+import json
+import threading
+import time
+from collections import deque
+from lua_scripts import PUBLISH_CHANGE_LUA
+from stock_storage import make_stock_storage
+from snapshot_aggregator import (
+    registered_lines,
+    read_snapshot,
+    read_snapshot_version,
+    read_feed_seq,
+    STOCK_FLUSH_CHANNEL,
+    SNAPSHOT_SCHEMA,
+    CHANGE_FEED_SEQ_KEY
+)
+from utils import NUM_PRODUCTS, DASHBOARD_RESYNC_INTERVAL, DASHBOARD_FEED_BUFFER
+
+# Canal pub/sub em que as entidades anunciam cada mudança de estoque, depois de gravá-la.
+# Mensagem (JSON): {"seq": n, "loc": local, "parts": [ids], "delta": qtd ou [qtds]}
+# O local é 'warehouse', 'line:{f}:{l}' ou PRODUCTS_LOCATION (ids = índices dos produtos);
+# "seq" vem do contador CHANGE_FEED_SEQ_KEY, o mesmo que a foto do agregador guarda.
+CHANGE_FEED_CHANNEL = "dashboard:changes"
+PRODUCTS_LOCATION = "products"
+
+# Desligado pelo motor em processo (simulation_engine.py), onde nenhum dashboard escuta
+CHANGE_FEED_ENABLED = True
+
+def set_change_feed_enabled(enabled):
+    """Liga ou desliga a publicação de mudanças para todo o processo."""
+    global CHANGE_FEED_ENABLED
+    CHANGE_FEED_ENABLED = enabled
+
+def publish_stock_change(r, location, part_ids, delta):
+    """Anuncia que o estoque das peças `part_ids` do local mudou de `delta` (um valor para todas ou um por peça)."""
+    if not CHANGE_FEED_ENABLED or not len(part_ids):
+        return
+    message = json.dumps({'loc': location, 'parts': list(part_ids), 'delta': delta}, separators=(',', ':'))
+    r.eval(PUBLISH_CHANGE_LUA, 1, CHANGE_FEED_SEQ_KEY, CHANGE_FEED_CHANNEL, message)
+
+def publish_dense_change(r, location, amounts, sign=1):
+    """Atalho para listas densas por peça (ex.: uma remessa): só as peças não nulas entram na mensagem."""
+    part_ids = [i for i, amount in enumerate(amounts) if amount]
+    publish_stock_change(r, location, part_ids, [sign * amounts[i] for i in part_ids])
+
+
+class LivePlantState:
+    """
+    Estado da planta mantido por empurrão para o dashboard. Parte da foto
+    versionada do snapshot_aggregator.py (uma leitura, qualquer que seja o
+    número de linhas) e uma thread própria aplica por cima, em memória, os
+    deltas do CHANGE_FEED_CHANNEL, sem reler o Redis a cada mudança, e
+    avisa quem espera em wait_for_change. A cada `resync_interval` segundos,
+    se o agregador publicou uma foto mais nova, o estado volta a ser o dela
+    mais os deltas recebidos com sequência posterior à da foto (guardados em
+    um buffer dos últimos `DASHBOARD_FEED_BUFFER`): um delta perdido só deixa
+    o painel errado até a próxima foto, e a troca nunca desfaz um mais novo.
+    Sem foto utilizável (agregador parado, foto anterior à assinatura do
+    canal ou mais velha que o buffer), os locais são lidos direto do Redis.
+    """
+
+    def __init__(self, redis_client, resync_interval=DASHBOARD_RESYNC_INTERVAL):
+        self.r = redis_client
+        self.stock = make_stock_storage(self.r)
+        self.resync_interval = resync_interval
+        self.values = {}
+        self.version = 0
+        # Versão em que cada local mudou pela última vez
+        self.changed_at = {}
+        # Versão da foto do agregador aplicada por último (0: nenhuma)
+        self.snapshot_version = 0
+        # Sequência do último delta do feed refletido em `values`
+        self.feed_seq = 0
+        # Deltas recebidos, como (seq, mudança), para reaplicar sobre uma foto; uma foto
+        # só pode ser completada se tirada a partir de `_replay_from` (ver resync)
+        self._recent = deque(maxlen=DASHBOARD_FEED_BUFFER)
+        self._replay_from = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        """Carrega a foto (ou o Redis) e passa a seguir o canal de mudanças."""
+        pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+        # Assina antes de ler o estado inicial para não perder mudanças no intervalo;
+        # a leitura espera a confirmação, e daí em diante todo delta chega pelo canal
+        pubsub.subscribe(CHANGE_FEED_CHANNEL)
+        pubsub.get_message(timeout=1.0)
+        self._replay_from = read_feed_seq(self.r)
+        if not self.resync():
+            # Sequência lida antes dos estoques: os deltas até ela já estão na leitura
+            seq = read_feed_seq(self.r)
+            self._apply(self._read({'warehouse', PRODUCTS_LOCATION, *registered_lines(self.r)}))
+            self.feed_seq = seq
+        # Linhas com estoque em memória gravam (e anunciam) as mudanças pendentes
+        self.r.publish(STOCK_FLUSH_CHANNEL, "FLUSH")
+        self._thread = threading.Thread(target=self._follow, args=(pubsub,), name='change-feed', daemon=True)
+        self._thread.start()
+        return self
+
+    def resync(self):
+        """
+        Troca o estado pela foto do agregador mais os deltas recebidos depois
+        dela, se houver uma foto mais nova que a aplicada; devolve se trocou.
+        """
+        if read_snapshot_version(self.r) <= self.snapshot_version:
+            return False
+        snapshot = read_snapshot(self.r)
+        if snapshot is None or snapshot.get('schema') != SNAPSHOT_SCHEMA:
+            return False
+        # Deltas entre a foto e o início do buffer não estão em mãos: a foto não serve
+        if snapshot['feed_seq'] < self._replay_from:
+            return False
+        fresh = {'warehouse': snapshot['warehouse'], PRODUCTS_LOCATION: snapshot['products']}
+        fresh.update(zip(snapshot['lines'], snapshot['line_stocks']))
+        newer = [change for seq, change in self._recent if seq > snapshot['feed_seq']]
+        updated, _ = self._sum_changes(fresh, newer)
+        fresh.update(updated)
+        self._apply(fresh)
+        self.snapshot_version = snapshot['version']
+        # Os deltas ainda não lidos do canal e já contidos na foto serão ignorados
+        self.feed_seq = max(snapshot['feed_seq'], self._recent[-1][0] if self._recent else 0)
+        return True
+
+    def _follow(self, pubsub):
+        last_resync = time.monotonic()
+        while True:
+            message = pubsub.get_message(timeout=1.0)
+            # Junta a rajada inteira antes de acordar as sessões
+            changes = []
+            while message is not None:
+                if message['type'] == 'message':
+                    changes.append(json.loads(message['data']))
+                message = pubsub.get_message(timeout=0)
+            if changes:
+                self._apply_changes(changes)
+            if time.monotonic() - last_resync >= self.resync_interval:
+                self.resync()
+                last_resync = time.monotonic()
+
+    def _read(self, locations):
+        fresh = {}
+        if PRODUCTS_LOCATION in locations:
+            fresh[PRODUCTS_LOCATION] = [int(v or 0) for v in self.r.mget([f"product:{i}" for i in range(NUM_PRODUCTS)])]
+        parts_locations = sorted(locations - {PRODUCTS_LOCATION})
+        fresh.update(zip(parts_locations, self.stock.get_all_many(parts_locations)))
+        return fresh
+
+    @staticmethod
+    def _sum_changes(base, changes):
+        """
+        Soma os deltas aos valores de `base` (local -> lista) em cópias novas
+        por local, que as sessões desenham fora da trava; devolve as cópias e
+        os locais sem valores em `base`.
+        """
+        updated = {}
+        unknown = set()
+        for change in changes:
+            location = change['loc']
+            if location not in base:
+                unknown.add(location)
+                continue
+            values = updated.get(location)
+            if values is None:
+                values = updated[location] = list(base[location])
+            delta = change['delta']
+            deltas = delta if isinstance(delta, list) else [delta] * len(change['parts'])
+            for part_id, amount in zip(change['parts'], deltas):
+                values[part_id] += amount
+        return updated, unknown
+
+    def _apply_changes(self, changes):
+        """Soma os deltas mais novos que o estado aos valores em memória; um local ainda desconhecido (linha nova) é lido do Redis."""
+        for change in changes:
+            if len(self._recent) == self._recent.maxlen:
+                self._replay_from = self._recent[0][0]
+            self._recent.append((change['seq'], change))
+        changes = [change for change in changes if change['seq'] > self.feed_seq]
+        if not changes:
+            return
+        with self._condition:
+            updated, unknown = self._sum_changes(self.values, changes)
+            self.feed_seq = changes[-1]['seq']
+            if updated:
+                self.version += 1
+                for location, values in updated.items():
+                    self.values[location] = values
+                    self.changed_at[location] = self.version
+                self._condition.notify_all()
+        if unknown:
+            self._apply(self._read(unknown))
+
+    def _apply(self, fresh):
+        with self._condition:
+            changed = [loc for loc, values in fresh.items() if self.values.get(loc) != values]
+            if not changed:
+                return
+            self.version += 1
+            for location in changed:
+                self.values[location] = fresh[location]
+                self.changed_at[location] = self.version
+            self._condition.notify_all()
+
+    def wait_for_change(self, since_version, timeout=None):
+        """Bloqueia até existir uma versão mais nova que `since_version` (ou até o timeout); devolve a versão atual."""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version > since_version, timeout)
+            return self.version
+
+    def changed_since(self, version):
+        """Locais que mudaram depois de `version`."""
+        with self._condition:
+            return {loc for loc, at in self.changed_at.items() if at > version}
+
+    def read(self, location):
+        with self._condition:
+            return self.values.get(location)
+
+    def line_locations(self):
+        with self._condition:
+            return sorted((loc for loc in self.values if loc.startswith('line:')),
+                          key=lambda loc: tuple(int(x) for x in loc.split(':')[1:]))
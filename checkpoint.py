@@ -0,0 +1,297 @@
+# checkpoint.py
+
+import json
+import struct
+import sys
+import time
+import zlib
+import redis
+from memory_redis import InMemoryRedis
+from utils import (
+    print_update,
+    REDIS_HOST,
+    REDIS_PORT,
+    NUM_PARTS,
+    NUM_PRODUCTS,
+    STOCK_LAYOUT,
+    WIRE_FORMAT,
+    PLANT_FACTORIES,
+    PRODUCTS_AND_PARTS_FILE,
+    CHECKPOINT_CHUNK
+)
+
+# Formato do arquivo (um só arquivo binário):
+#   cabeçalho  CHECKPOINT_HEADER: magic, versão, backend, dia, criado em (epoch)
+#   corpo      zlib de: tamanho + JSON da configuração da planta, tamanho + conteúdo do
+#              PRODUCTS_AND_PARTS_FILE, número de chaves e, por chave, KEY_HEADER (tamanho do
+#              nome, tamanho do valor), nome e valor serializado
+# O valor é o do DUMP do Redis (ou o equivalente do InMemoryRedis, para o motor em processo) e
+# volta com RESTORE: contadores, hashes, sorted sets e streams com seus grupos saem intactos.
+# Restaurar executa o que o arquivo contém (no backend em memória, os valores são pickle):
+# só restaure checkpoints de fonte confiável.
+CHECKPOINT_MAGIC = b'PLANTCKP'
+CHECKPOINT_VERSION = 2
+CHECKPOINT_HEADER = struct.Struct('!8sBBId')
+KEY_HEADER = struct.Struct('!HI')
+COUNT = struct.Struct('!I')
+
+BACKEND_REDIS = 0
+BACKEND_MEMORY = 1
+BACKEND_NAMES = {BACKEND_REDIS: 'redis', BACKEND_MEMORY: 'memória'}
+
+# Dia (fim do dia) em que o checkpoint foi feito; o coordenador continua do seguinte
+CHECKPOINT_DAY_KEY = "checkpoint:day"
+# Estado em memória de cada entidade (JSON), gravado junto com as chaves da planta
+ENTITY_STATE_PREFIX = "checkpoint:state:"
+
+USAGE = """Uso: python3 checkpoint.py salvar [arquivo.ckpt] [dia]
+       python3 checkpoint.py restaurar [arquivo.ckpt]
+       python3 checkpoint.py info [arquivo.ckpt]"""
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def entity_state_key(entity_name):
+    return f"{ENTITY_STATE_PREFIX}{entity_name}"
+
+def save_entity_states(r, entities):
+    """Grava o estado em memória (get_state) de cada entidade em um único round trip."""
+    pipe = r.pipeline(transaction=False)
+    for entity in entities:
+        pipe.set(entity_state_key(entity.entity_name), json.dumps(entity.get_state(), separators=(',', ':')))
+    pipe.execute()
+
+def load_entity_states(r, entities):
+    """
+    Devolve às entidades o estado gravado por save_entity_states (um MGET para
+    todas). Entidades sem estado gravado (início do zero) ficam como estão.
+    Devolve quantas foram restauradas.
+    """
+    entities = list(entities)
+    if not entities:
+        return 0
+    states = r.mget([entity_state_key(entity.entity_name) for entity in entities])
+    restored = 0
+    for entity, state in zip(entities, states):
+        if state is not None:
+            entity.set_state(json.loads(state))
+            restored += 1
+    return restored
+
+def discard_entity_states(r, chunk=CHECKPOINT_CHUNK):
+    """
+    Apaga os estados gravados por save_entity_states, depois que todas as
+    entidades os carregaram: eles valem só para o recomeço no dia do
+    checkpoint. Uma entidade que reinicia no meio da execução volta como
+    qualquer processo reiniciado, e não com a fila de pedidos ou as esperas
+    daquele dia. Devolve quantas chaves apagou.
+    """
+    names = list(r.scan_iter(match=f"{ENTITY_STATE_PREFIX}*", count=chunk))
+    if names:
+        r.delete(*names)
+    return len(names)
+
+def checkpoint_day(r):
+    """Dia do checkpoint restaurado no Redis, ou 0 se a planta começou do zero."""
+    return int(r.get(CHECKPOINT_DAY_KEY) or 0)
+
+
+def _products_file():
+    """Conteúdo atual do PRODUCTS_AND_PARTS_FILE, ou None se ainda não foi gerado."""
+    try:
+        with open(PRODUCTS_AND_PARTS_FILE, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def plant_config():
+    """
+    Configuração da planta gravada no checkpoint. Tudo menos products_crc
+    precisa ser igual ao restaurar (ver check_config); o arquivo de produtos
+    vai junto no checkpoint e o CRC só confere a sua integridade.
+    """
+    products = _products_file()
+    products_crc = zlib.crc32(products) if products is not None else None
+    return {
+        'num_parts': NUM_PARTS,
+        'num_products': NUM_PRODUCTS,
+        'stock_layout': STOCK_LAYOUT,
+        'wire_format': WIRE_FORMAT,
+        'factories': [list(factory) for factory in PLANT_FACTORIES],
+        'products_crc': products_crc,
+    }
+
+def check_config(config):
+    current = plant_config()
+    different = sorted(name for name in current if name != 'products_crc' and config.get(name) != current[name])
+    if different:
+        raise ValueError(f"Checkpoint de outra configuração da planta (diferem: {', '.join(different)}).")
+
+def _backend(r):
+    return BACKEND_MEMORY if isinstance(r, InMemoryRedis) else BACKEND_REDIS
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def write_checkpoint(r, path, day, exclude=(), chunk=CHECKPOINT_CHUNK):
+    """
+    Grava todas as chaves do banco (menos `exclude`) em `path`, lidas com DUMP
+    em pipelines de `chunk` comandos. Deve ser chamado entre dois dias, com as
+    entidades paradas e seus estados já gravados (save_entity_states).
+    Devolve o número de chaves.
+    """
+    r.set(CHECKPOINT_DAY_KEY, day)
+    exclude = set(exclude)
+    names = sorted(name for name in map(_text, r.scan_iter(count=chunk)) if name not in exclude)
+
+    body = bytearray()
+    config = json.dumps(plant_config(), separators=(',', ':')).encode()
+    body += COUNT.pack(len(config)) + config
+    products = _products_file() or b''
+    body += COUNT.pack(len(products)) + products
+    entries = []
+    for names_chunk in _chunks(names, chunk):
+        pipe = r.pipeline(transaction=False)
+        for name in names_chunk:
+            pipe.dump(name)
+        # Chaves que sumiram entre o SCAN e o DUMP ficam de fora
+        entries += [(name, payload) for name, payload in zip(names_chunk, pipe.execute()) if payload is not None]
+    body += COUNT.pack(len(entries))
+    for name, payload in entries:
+        encoded = name.encode()
+        body += KEY_HEADER.pack(len(encoded), len(payload)) + encoded + payload
+
+    with open(path, 'wb') as f:
+        f.write(CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, _backend(r), day, time.time()))
+        f.write(zlib.compress(bytes(body)))
+    return len(entries)
+
+def read_checkpoint(path):
+    """Lê um checkpoint: (cabeçalho, configuração, arquivo de produtos, [(chave, valor serializado)])."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < CHECKPOINT_HEADER.size:
+        raise ValueError(f"{path}: arquivo curto demais para um checkpoint.")
+    magic, version, backend, day, created_at = CHECKPOINT_HEADER.unpack_from(data)
+    if magic != CHECKPOINT_MAGIC:
+        raise ValueError(f"{path}: não é um checkpoint da planta.")
+    if version != CHECKPOINT_VERSION:
+        raise ValueError(f"{path}: versão {version} do formato não suportada (esperada {CHECKPOINT_VERSION}).")
+
+    body = zlib.decompress(data[CHECKPOINT_HEADER.size:])
+    (size,) = COUNT.unpack_from(body)
+    offset = COUNT.size
+    config = json.loads(body[offset:offset + size])
+    offset += size
+    (size,) = COUNT.unpack_from(body, offset)
+    offset += COUNT.size
+    products = body[offset:offset + size]
+    offset += size
+    if config.get('products_crc') is not None and zlib.crc32(products) != config['products_crc']:
+        raise ValueError(f"{path}: arquivo de produtos corrompido (CRC diferente do gravado).")
+    (n_keys,) = COUNT.unpack_from(body, offset)
+    offset += COUNT.size
+    entries = []
+    for _ in range(n_keys):
+        name_size, payload_size = KEY_HEADER.unpack_from(body, offset)
+        offset += KEY_HEADER.size
+        name = body[offset:offset + name_size].decode()
+        offset += name_size
+        entries.append((name, body[offset:offset + payload_size]))
+        offset += payload_size
+
+    header = {'version': version, 'backend': backend, 'day': day, 'created_at': created_at}
+    return header, config, products, entries
+
+def _write_products_file(config, products):
+    """Grava o arquivo de produtos do checkpoint se o atual for outro (ou não existir); devolve se gravou."""
+    if config.get('products_crc') is None or _products_file() == products:
+        return False
+    with open(PRODUCTS_AND_PARTS_FILE, 'wb') as f:
+        f.write(products)
+    return True
+
+def restore_products_file(path):
+    """
+    Só o PRODUCTS_AND_PARTS_FILE do checkpoint, para processos que leem o arquivo
+    ao criar as entidades (o motor em processo, a reprodução do event_log.py):
+    chame antes de criá-las. Devolve se o arquivo foi regravado.
+    """
+    _, config, products, _ = read_checkpoint(path)
+    return _write_products_file(config, products)
+
+def restore_checkpoint(r, path, chunk=CHECKPOINT_CHUNK):
+    """
+    Substitui o banco inteiro pelo checkpoint: FLUSHDB e RESTORE de todas as
+    chaves em pipelines de `chunk` comandos, e o PRODUCTS_AND_PARTS_FILE pelo
+    que foi gravado com ele. As entidades iniciadas depois recuperam o próprio
+    estado com load_entity_states, até ele ser descartado no início da execução
+    (discard_entity_states). Devolve o dia do checkpoint. Só para
+    checkpoints de fonte confiável (ver o formato acima).
+    """
+    header, config, products, entries = read_checkpoint(path)
+    if header['backend'] != _backend(r):
+        raise ValueError(f"{path}: checkpoint de backend '{BACKEND_NAMES[header['backend']]}', "
+                         f"não pode ser restaurado em '{BACKEND_NAMES[_backend(r)]}'.")
+    check_config(config)
+    _write_products_file(config, products)
+
+    r.flushdb()
+    for entries_chunk in _chunks(entries, chunk):
+        pipe = r.pipeline(transaction=False)
+        for name, payload in entries_chunk:
+            pipe.restore(name, 0, payload, replace=True)
+        pipe.execute()
+    return header['day']
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('salvar', 'restaurar', 'info') or len(sys.argv) > 4:
+        print(USAGE)
+        sys.exit(1)
+    command, path = sys.argv[1], sys.argv[2]
+
+    if command == 'info':
+        try:
+            header, config, products, entries = read_checkpoint(path)
+        except (OSError, ValueError, zlib.error) as e:
+            print(f"ERRO: checkpoint inválido. Detalhes: {e}")
+            sys.exit(1)
+        created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(header['created_at']))
+        states = sum(1 for name, _ in entries if name.startswith(ENTITY_STATE_PREFIX))
+        print(f"{path}: fim do dia {header['day']}, backend '{BACKEND_NAMES[header['backend']]}', criado em {created}.")
+        print(f"  {len(entries)} chaves ({states} estados de entidades), "
+              f"{sum(len(payload) for _, payload in entries)} bytes serializados, "
+              f"{len(products)} bytes de {PRODUCTS_AND_PARTS_FILE}.")
+        print(f"  Planta: {config}")
+        return
+
+    try:
+        # DUMP/RESTORE trocam bytes: sem decode_responses
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO (Checkpoint): Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+
+    start = time.perf_counter()
+    try:
+        if command == 'salvar':
+            # Sem o coordenador lockstep, só é um ponto consistente com a planta parada
+            day = int(sys.argv[3]) if len(sys.argv) > 3 else checkpoint_day(r)
+            n_keys = write_checkpoint(r, path, day)
+            print_update(f"Checkpoint do dia {day} gravado em {path}: {n_keys} chaves "
+                         f"em {time.perf_counter() - start:.2f}s.", 'checkpoint')
+        else:
+            day = restore_checkpoint(r, path)
+            print_update(f"Checkpoint {path} restaurado (fim do dia {day}) "
+                         f"em {time.perf_counter() - start:.2f}s.", 'checkpoint')
+    except (OSError, ValueError, zlib.error) as e:
+        print(f"ERRO: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# codec.py
+
+import struct
+from collections import namedtuple
+from utils import list_to_string, string_to_list, WIRE_FORMAT
+from tracing import Trace, outgoing_trace
+
+# Mensagem decodificada, igual para os dois formatos de fio:
+#   command: nome do comando ('receive_order', 'send_parts', ...)
+#   args:    campos escalares, como strings (o mesmo que o split('/') do texto devolve)
+#   parts:   lista densa de inteiros por peça/produto, ou None se o comando não tiver lista
+#   trace:   tracing.Trace (id de correlação e instantes), ou None em mensagens sem rastreio
+Message = namedtuple('Message', 'command args parts trace', defaults=(None,))
+
+# Comandos conhecidos: código no formato binário e se carregam uma lista de peças/produtos.
+# 'send_parts' com 2 argumentos é o pedido linha -> almoxarifado por flags (modo 'kanban'); sem argumentos,
+# almoxarifado -> fornecedor. 'request_parts' é o pedido da linha com a quantidade de cada peça (ver replenishment.py).
+COMMANDS = {
+    'update_factory': (1, True),
+    'receive_order': (2, False),
+    'receive_parts': (3, True),
+    'send_parts': (4, True),
+    'receive_products': (5, False),
+    'request_parts': (6, True),
+}
+COMMANDS_BY_CODE = {code: name for name, (code, _) in COMMANDS.items()}
+
+# --- Formato binário ---
+# Cabeçalho: magic, versão, código do comando, número de argumentos (int32 cada).
+# O magic 0xFE nunca aparece em UTF-8, então texto e binário se distinguem pelo 1º byte.
+# Na versão 2 o cabeçalho é seguido do rastreio: id (uint64), início e envio (float64).
+BINARY_MAGIC = 0xFE
+BINARY_VERSION = 1
+BINARY_VERSION_TRACED = 2
+HEADER = struct.Struct('!BBBB')
+TRACE_BLOCK = struct.Struct('!Qdd')
+
+# Codificação da lista, escolhida pelo menor tamanho:
+PARTS_NONE = 0      # comando sem lista
+PARTS_DENSE_U8 = 1  # uint16 n + n x uint8   (ex.: flags de pedido)
+PARTS_DENSE_I32 = 2 # uint16 n + n x int32
+PARTS_SPARSE = 3    # uint16 n + uint16 k + k x (uint16 id, int32 qtd)  (ex.: remessas quase zeradas)
+COUNT = struct.Struct('!H')
+SPARSE_COUNTS = struct.Struct('!HH')
+
+
+def _encode_parts(parts):
+    n = len(parts)
+    nonzero_count = n - parts.count(0)
+    dense_u8 = n == 0 or (min(parts) >= 0 and max(parts) <= 255)
+
+    sparse_size = 4 + 6 * nonzero_count
+    dense_size = 2 + (n if dense_u8 else 4 * n)
+    if sparse_size < dense_size:
+        flat = []
+        for i, v in enumerate(parts):
+            if v:
+                flat += (i, v)
+        return bytes([PARTS_SPARSE]) + SPARSE_COUNTS.pack(n, nonzero_count) + struct.pack(f'!{"Hi" * nonzero_count}', *flat)
+    if dense_u8:
+        return bytes([PARTS_DENSE_U8]) + COUNT.pack(n) + bytes(parts)
+    return bytes([PARTS_DENSE_I32]) + COUNT.pack(n) + struct.pack(f'!{n}i', *parts)
+
+def _decode_parts(data, offset):
+    encoding = data[offset]
+    offset += 1
+    if encoding == PARTS_NONE:
+        return None
+    if encoding == PARTS_DENSE_U8:
+        (n,) = COUNT.unpack_from(data, offset)
+        return list(data[offset + 2:offset + 2 + n])
+    if encoding == PARTS_DENSE_I32:
+        (n,) = COUNT.unpack_from(data, offset)
+        return list(struct.unpack_from(f'!{n}i', data, offset + 2))
+    if encoding == PARTS_SPARSE:
+        n, k = SPARSE_COUNTS.unpack_from(data, offset)
+        flat = struct.unpack_from(f'!{"Hi" * k}', data, offset + 4)
+        parts = [0] * n
+        for i in range(0, 2 * k, 2):
+            parts[flat[i]] = flat[i + 1]
+        return parts
+    raise ValueError(f"Codificação de lista desconhecida: {encoding}")
+
+def encode_binary(command, *args, parts=None, trace=None):
+    code, has_parts = COMMANDS[command]
+    if trace is None:
+        body = HEADER.pack(BINARY_MAGIC, BINARY_VERSION, code, len(args))
+    else:
+        body = HEADER.pack(BINARY_MAGIC, BINARY_VERSION_TRACED, code, len(args)) + TRACE_BLOCK.pack(*trace)
+    body += struct.pack(f'!{len(args)}i', *(int(a) for a in args))
+    if has_parts:
+        return body + _encode_parts(parts)
+    return body + bytes([PARTS_NONE])
+
+def decode_binary(data):
+    magic, version, code, n_args = HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC or version not in (BINARY_VERSION, BINARY_VERSION_TRACED):
+        raise ValueError(f"Mensagem binária inválida (magic={magic}, versão={version})")
+    offset = HEADER.size
+    trace = None
+    if version == BINARY_VERSION_TRACED:
+        trace = Trace(*TRACE_BLOCK.unpack_from(data, offset))
+        offset += TRACE_BLOCK.size
+    args = struct.unpack_from(f'!{n_args}i', data, offset)
+    parts = _decode_parts(data, offset + 4 * n_args)
+    return Message(COMMANDS_BY_CODE[code], tuple(str(a) for a in args), parts, trace)
+
+# --- Formato texto (o original, legível para depuração) ---
+# O rastreio, se houver, vai no fim: "...|{id}|{início}|{envio}"
+
+def encode_text(command, *args, parts=None, trace=None):
+    _, has_parts = COMMANDS[command]
+    suffix = "" if trace is None else f"|{trace.trace_id}|{trace.started_at:.6f}|{trace.sent_at:.6f}"
+    if command == 'send_parts' and args:
+        # Pedido da linha: "{line_id}/{factory_id}/send_parts/{lista}"
+        return f"{args[0]}/{args[1]}/send_parts/{list_to_string(parts)}{suffix}"
+    fields = [command, *(str(a) for a in args)]
+    if has_parts:
+        fields.append(list_to_string(parts))
+    return "/".join(fields) + suffix
+
+def decode_text(data):
+    data, *trace_fields = data.split("|")
+    trace = None
+    if trace_fields:
+        trace = Trace(int(trace_fields[0]), float(trace_fields[1]), float(trace_fields[2]))
+    fields = data.split("/")
+    if len(fields) > 2 and fields[2] == 'send_parts':
+        return Message('send_parts', (fields[0], fields[1]), string_to_list(fields[3]), trace)
+    command = fields[0]
+    if COMMANDS.get(command, (None, False))[1]:
+        return Message(command, tuple(fields[1:-1]), string_to_list(fields[-1]), trace)
+    return Message(command, tuple(fields[1:]), None, trace)
+
+# --- Interface usada pelas entidades ---
+
+def encode_message(command, *args, parts=None, wire_format=None, trace=None):
+    """
+    Codifica uma mensagem no formato configurado em utils.WIRE_FORMAT (ou no
+    informado). Sem `trace`, a mensagem continua a cadeia da mensagem em
+    tratamento na thread (ou começa uma nova), se o rastreio estiver ligado.
+    """
+    if trace is None:
+        trace = outgoing_trace()
+    if (wire_format or WIRE_FORMAT) == 'binary':
+        return encode_binary(command, *args, parts=parts, trace=trace)
+    return encode_text(command, *args, parts=parts, trace=trace)
+
+def decode_message(data):
+    """Decodifica uma mensagem de qualquer um dos formatos (detectado pelo primeiro byte)."""
+    if isinstance(data, (bytes, bytearray)):
+        if data[:1] == bytes([BINARY_MAGIC]):
+            return decode_binary(data)
+        data = data.decode('utf-8')
+    return decode_text(data)
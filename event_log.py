@@ -0,0 +1,344 @@
+# event_log.py
+
+import json
+import random
+import struct
+import sys
+import time
+from collections import namedtuple, Counter
+from memory_redis import InMemoryRedis
+from init_redis import populate_initial_stock
+from checkpoint import restore_checkpoint, restore_products_file, load_entity_states
+from change_feed import set_change_feed_enabled
+from tracing import set_tracing_enabled
+from metrics import set_metrics_enabled
+from factory_redis import FactoryRedis
+from line_redis import LineRedis
+from warehouse_redis import WarehouseRedis
+from product_stock_redis import ProductStockRedis
+from supplier_redis import SupplierRedis
+from utils import print_update, set_output_enabled, INFO, ERROR, WIRE_FORMAT
+
+# Log de eventos da planta (gravado pelo simulation_engine.py com gravar:arquivo): toda mensagem
+# publicada por uma entidade e todo passo diário, na ordem em que aconteceram. Só cresce: cada
+# registro é escrito no fim do arquivo, e os textos repetidos (remetentes, canais, fases) viram ids.
+#   cabeçalho  LOG_HEADER: magic e versão
+#   registros  RECORD_STRING: id e texto (definido antes do primeiro uso)
+#              RECORD_META: JSON com a configuração da execução (seed, fábricas, estado inicial...)
+#              RECORD_PUBLISH: tick, remetente, canal, flags e a mensagem como foi publicada
+#              RECORD_STEP: tick, entidade e fase (ver tick_coordinator.PHASES) da rotina diária
+EVENT_LOG_MAGIC = b'PLANTEVL'
+EVENT_LOG_VERSION = 1
+LOG_HEADER = struct.Struct('!8sB')
+
+RECORD_STRING = 0
+RECORD_META = 1
+RECORD_PUBLISH = 2
+RECORD_STEP = 3
+STRING_RECORD = struct.Struct('!BHH')
+META_RECORD = struct.Struct('!BI')
+PUBLISH_RECORD = struct.Struct('!BdHHBI')
+STEP_RECORD = struct.Struct('!BdHH')
+
+# Flags de RECORD_PUBLISH: a mensagem era texto (WIRE_FORMAT = 'text') e volta como str
+FLAG_TEXT = 1
+
+Event = namedtuple('Event', 'kind tick sender channel payload')
+
+USAGE = """Uso: python3 event_log.py info [arquivo.evlog]
+       python3 event_log.py reproduzir [arquivo.evlog] [entidade] [repetições]
+Entidades: warehouse | product_stock | supplier | factory:[factory_id] | line:[factory_id]:[line_id]"""
+
+
+class EventRecorder:
+    """
+    Grava os eventos de uma execução em `path`. `clock()` dá o tick (dia do
+    relógio virtual) de cada evento. A escrita é bufferizada: flush() ao fim
+    de cada trecho da execução.
+    """
+
+    def __init__(self, path, clock):
+        self.path = path
+        self.clock = clock
+        self.events = 0
+        self._ids = {}
+        self._file = open(path, 'wb', buffering=1 << 20)
+        self._file.write(LOG_HEADER.pack(EVENT_LOG_MAGIC, EVENT_LOG_VERSION))
+
+    def _id(self, text):
+        string_id = self._ids.get(text)
+        if string_id is None:
+            string_id = self._ids[text] = len(self._ids)
+            encoded = text.encode()
+            self._file.write(STRING_RECORD.pack(RECORD_STRING, string_id, len(encoded)) + encoded)
+        return string_id
+
+    def meta(self, meta):
+        encoded = json.dumps(meta, separators=(',', ':')).encode()
+        self._file.write(META_RECORD.pack(RECORD_META, len(encoded)) + encoded)
+
+    def publish(self, sender, channel, message):
+        flags = 0
+        if isinstance(message, str):
+            message, flags = message.encode(), FLAG_TEXT
+        sender_id, channel_id = self._id(sender or ''), self._id(channel)
+        self._file.write(PUBLISH_RECORD.pack(RECORD_PUBLISH, self.clock(), sender_id, channel_id, flags, len(message)))
+        self._file.write(message)
+        self.events += 1
+
+    def step(self, entity_name, phase):
+        entity_id, phase_id = self._id(entity_name), self._id(phase)
+        self._file.write(STEP_RECORD.pack(RECORD_STEP, self.clock(), entity_id, phase_id))
+        self.events += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class _RecordingPipeline:
+    def __init__(self, pipe, owner):
+        self._pipe = pipe
+        self._owner = owner
+        self._published = []
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    def __bool__(self):
+        # Como o Pipeline do redis-py: `pipe or r` escolhe o pipeline mesmo vazio
+        return True
+
+    def publish(self, channel, message):
+        self._pipe.publish(channel, message)
+        self._published.append((channel, message))
+        return self
+
+    def execute(self, *args, **kwargs):
+        # Gravadas na ordem da fila, quando de fato vão para o broker
+        published, self._published = self._published, []
+        for channel, message in published:
+            self._owner.recorder.publish(self._owner.sender, channel, message)
+        return self._pipe.execute(*args, **kwargs)
+
+class RecordingRedis:
+    """Cliente Redis que grava cada publish (direto ou em pipeline) no EventRecorder, em nome de `sender`."""
+
+    def __init__(self, client, recorder, sender=None):
+        self._client = client
+        self.recorder = recorder
+        self.sender = sender
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def publish(self, channel, message):
+        self.recorder.publish(self.sender, channel, message)
+        return self._client.publish(channel, message)
+
+    def pipeline(self, *args, **kwargs):
+        return _RecordingPipeline(self._client.pipeline(*args, **kwargs), self)
+
+
+def read_event_log(path):
+    """Lê um log: (configuração da execução, lista de Event). A configuração é a do primeiro RECORD_META."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < LOG_HEADER.size or LOG_HEADER.unpack_from(data)[0] != EVENT_LOG_MAGIC:
+        raise ValueError(f"{path}: não é um log de eventos da planta.")
+    version = LOG_HEADER.unpack_from(data)[1]
+    if version != EVENT_LOG_VERSION:
+        raise ValueError(f"{path}: versão {version} do formato não suportada (esperada {EVENT_LOG_VERSION}).")
+
+    strings, meta, events = [], None, []
+    offset = LOG_HEADER.size
+    # Um registro cortado no fim (execução interrompida no meio de uma escrita) é ignorado
+    while offset < len(data):
+        kind = data[offset]
+        if kind == RECORD_STRING:
+            if offset + STRING_RECORD.size > len(data):
+                break
+            _, string_id, size = STRING_RECORD.unpack_from(data, offset)
+            offset += STRING_RECORD.size
+            strings.append(data[offset:offset + size].decode())
+            offset += size
+        elif kind == RECORD_META:
+            if offset + META_RECORD.size > len(data):
+                break
+            _, size = META_RECORD.unpack_from(data, offset)
+            offset += META_RECORD.size
+            if meta is None:
+                meta = json.loads(data[offset:offset + size])
+            offset += size
+        elif kind == RECORD_PUBLISH:
+            if offset + PUBLISH_RECORD.size > len(data):
+                break
+            _, tick, sender_id, channel_id, flags, size = PUBLISH_RECORD.unpack_from(data, offset)
+            offset += PUBLISH_RECORD.size
+            if offset + size > len(data):
+                break
+            payload = data[offset:offset + size]
+            offset += size
+            events.append(Event('publish', tick, strings[sender_id], strings[channel_id],
+                                payload.decode() if flags & FLAG_TEXT else payload))
+        elif kind == RECORD_STEP:
+            if offset + STEP_RECORD.size > len(data):
+                break
+            _, tick, entity_id, phase_id = STEP_RECORD.unpack_from(data, offset)
+            offset += STEP_RECORD.size
+            events.append(Event('step', tick, strings[entity_id], strings[phase_id], None))
+        else:
+            raise ValueError(f"{path}: registro desconhecido ({kind}) na posição {offset}.")
+    return meta or {}, events
+
+
+def replay_client(outputs):
+    """Cliente em memória cujo publish só anota (canal, mensagem) em `outputs`."""
+    def capture(channel, message):
+        outputs.append((channel, message))
+        return 1
+    return InMemoryRedis(broker=capture)
+
+def prepare_replay_state(r, meta, entities):
+    """Estado inicial da execução gravada: o checkpoint de onde ela partiu ou o estoque inicial do perfil."""
+    if meta.get('checkpoint'):
+        restore_checkpoint(r, meta['checkpoint'])
+        load_entity_states(r, entities)
+    else:
+        populate_initial_stock(r, meta.get('stock_profile', 'uniforme'), [tuple(f) for f in meta['factories']])
+
+def replay(events, entity, steps, channels=None):
+    """
+    Alimenta `entity` com o tráfego gravado, sem Redis nem sleeps: cada
+    mensagem publicada em `channels` (o canal da entidade, por padrão) vai
+    para entity.handle_message e cada passo diário gravado da entidade roda
+    steps[fase], na ordem original. Só o que a entidade lê das próprias
+    chaves é reproduzido: com a política 'red' o almoxarifado lê o estoque
+    das linhas, que na reprodução não muda. Devolve (mensagens, passos).
+    """
+    channels = {entity.channel} if channels is None else set(channels)
+    name = entity.entity_name
+    delivered = stepped = 0
+    for event in events:
+        if event.kind == 'publish':
+            if event.channel in channels:
+                entity.handle_message(event.payload)
+                delivered += 1
+        elif event.sender == name:
+            steps[event.channel]()
+            stepped += 1
+    return delivered, stepped
+
+def recorded_outputs(events, entity_name):
+    """Mensagens que a entidade publicou na execução gravada, em ordem."""
+    return [(event.channel, event.payload) for event in events if event.kind == 'publish' and event.sender == entity_name]
+
+def build_entity(spec, r, meta):
+    """Cria a entidade de `spec` (ver USAGE) como o motor a cria; devolve (entidade, passos por fase)."""
+    kind, *args = spec.split(':')
+    if kind == 'warehouse' and not args:
+        wh = WarehouseRedis(r, order_transport='pubsub')
+        return wh, {'warehouse': wh.daily_routine}
+    if kind == 'product_stock' and not args:
+        if meta.get('seed') is None and not meta.get('checkpoint'):
+            raise ValueError("A demanda da execução gravada não tem seed: o estoque de produtos não é reproduzível.")
+        ps = ProductStockRedis(r, rng=random.Random(meta.get('seed')))
+        return ps, {'product_stock': ps.simulate_daily_customer_orders}
+    if kind == 'supplier' and not args:
+        return SupplierRedis(r), {}
+    if kind == 'factory' and len(args) == 1:
+        for fabric_type, factory_id, lines in meta['factories']:
+            if str(factory_id) == args[0]:
+                fac = FactoryRedis(fabric_type, factory_id, lines, r)
+                return fac, {'factory': fac.order_daily_batch}
+        raise ValueError(f"Fábrica {args[0]} não existe na execução gravada.")
+    if kind == 'line' and len(args) == 2:
+        if meta.get('vectorized'):
+            raise ValueError("Execução gravada com as linhas vetorizadas: não há passos de linhas individuais.")
+        line = LineRedis(args[1], args[0], r, order_transport='pubsub')
+        return line, {'line': line.check_and_order_parts}
+    raise ValueError(f"Entidade desconhecida: '{spec}'")
+
+def replay_entity(path, spec, repetitions=1):
+    """
+    Reproduz a entidade `spec` contra o log `path` (`repetitions` vezes, para
+    medir) e compara as mensagens publicadas com as da execução gravada.
+    """
+    meta, events = read_event_log(path)
+    if meta.get('wire_format', WIRE_FORMAT) != WIRE_FORMAT:
+        raise ValueError(f"Log gravado com WIRE_FORMAT = '{meta['wire_format']}'.")
+    # Como no motor: nada de feed de mudanças nem rastreio (que mudaria as mensagens)
+    set_change_feed_enabled(False)
+    set_tracing_enabled(False)
+    set_metrics_enabled(False)
+    if meta.get('checkpoint'):
+        # Antes de criar a entidade, que lê o arquivo de produtos
+        restore_products_file(meta['checkpoint'])
+
+    timings = []
+    for _ in range(repetitions):
+        outputs = []
+        r = replay_client(outputs)
+        entity, steps = build_entity(spec, r, meta)
+        prepare_replay_state(r, meta, [entity])
+        start = time.perf_counter()
+        delivered, stepped = replay(events, entity, steps)
+        timings.append(time.perf_counter() - start)
+
+    expected = recorded_outputs(events, entity.entity_name)
+    mismatch = next((i for i, (a, b) in enumerate(zip(outputs, expected)) if a != b), None)
+    if mismatch is None and len(outputs) != len(expected):
+        mismatch = min(len(outputs), len(expected))
+    return {
+        'entity': entity.entity_name,
+        'messages': delivered,
+        'steps': stepped,
+        'outputs': len(outputs),
+        'expected_outputs': len(expected),
+        'identical': mismatch is None,
+        'first_mismatch': mismatch,
+        'best_seconds': min(timings),
+    }
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if not ((command == 'info' and len(sys.argv) == 3) or (command == 'reproduzir' and 4 <= len(sys.argv) <= 5)):
+        print(USAGE)
+        sys.exit(1)
+    path = sys.argv[2]
+
+    try:
+        if command == 'info':
+            meta, events = read_event_log(path)
+            publishes = [event for event in events if event.kind == 'publish']
+            print(f"{path}: {len(publishes)} mensagens e {len(events) - len(publishes)} passos diários, "
+                  f"ticks {events[0].tick if events else 0:g} a {events[-1].tick if events else 0:g}.")
+            print(f"  Execução: {meta}")
+            for sender, count in Counter(event.sender for event in publishes).most_common():
+                print(f"  {sender:<24} {count} mensagens")
+            return
+
+        repetitions = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+        set_output_enabled(False)
+        result = replay_entity(path, sys.argv[3], repetitions)
+        set_output_enabled(True)
+    except (OSError, ValueError) as e:
+        set_output_enabled(True)
+        print(f"ERRO: {e}")
+        sys.exit(1)
+
+    total = result['messages'] + result['steps']
+    summary = (f"{result['messages']} mensagens e {result['steps']} passos em {result['best_seconds']:.3f}s "
+               f"({total / max(result['best_seconds'], 1e-9):,.0f} eventos/s). ")
+    if result['identical']:
+        summary += f"Saídas idênticas às gravadas ({result['outputs']} mensagens)."
+    else:
+        summary += (f"Saídas DIFERENTES: {result['outputs']} mensagens contra {result['expected_outputs']} gravadas, "
+                    f"primeira diferença na mensagem {result['first_mismatch']}.")
+    print_update(summary, result['entity'], INFO if result['identical'] else ERROR)
+
+if __name__ == "__main__":
+    main()
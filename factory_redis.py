@@ -4,8 +4,12 @@ import redis
 import threading
 import sys
 import time
+from codec import encode_message, decode_message
+from tracing import Tracer, traced_client
+from metrics import start_metrics_server
+from tick_coordinator import run_lockstep
+from checkpoint import load_entity_states
 from utils import (
-    string_to_list,
     print_update,
     BATCH_SIZE,
     TIME_SLEEP,
@@ -13,20 +17,25 @@ from utils import (
     RED_ALERT_PRODUCT_STOCK,
     NUM_PRODUCTS,
     REDIS_HOST,
-    REDIS_PORT
+    REDIS_PORT,
+    WIRE_FORMAT,
+    DAY_CLOCK
 )
 
 class FactoryRedis:
 
     def __init__(self, fabric_type, factory_id, lines_number, redis_client):
-        self.r = redis_client
+        self.r = traced_client(redis_client)
         self.fabric_type = fabric_type
         self.factory_id = str(factory_id)
         self.lines_number = lines_number
         self.entity_name = f'factory-{self.factory_id}-{self.fabric_type}'
+        self.tracer = Tracer(self.entity_name, redis_client)
         self.last_stock_status = 'green'
         # <<< MUDANÇA: Armazena o buffer de estoque mais recente
         self.last_stock_buffer = [0] * NUM_PRODUCTS
+        self.channel = "channel:factory"
+        self.orders_sent = 0
 
     def update_finished_goods_stock(self, stock_buffer):
         print_update(f"Recebeu atualização do estoque de produtos: {stock_buffer}", self.entity_name)
@@ -73,22 +82,44 @@ class FactoryRedis:
     def order_to_line(self, line_index, size, product_index):
         line_id_for_msg = line_index + 1
         target_channel = f"channel:line:{self.factory_id}:{line_id_for_msg}"
-        msg = f"receive_order/{product_index}/{size}"
+        msg = encode_message("receive_order", product_index, size)
         
         print_update(f"Enviando Ordem para o canal {target_channel} -> Produto: {product_index + 1}, Qtd: {size}", self.entity_name)
         self.r.publish(target_channel, msg)
+        self.orders_sent += 1
+
+    def get_state(self):
+        """Estado em memória para um checkpoint (ver checkpoint.py)."""
+        return {
+            'last_stock_buffer': self.last_stock_buffer,
+            'last_stock_status': self.last_stock_status,
+            'orders_sent': self.orders_sent,
+        }
+
+    def set_state(self, state):
+        self.last_stock_buffer = state['last_stock_buffer']
+        self.last_stock_status = state['last_stock_status']
+        self.orders_sent = state['orders_sent']
+
+    def metrics(self):
+        """Amostras para o endpoint de métricas (ver metrics.py): (nome, rótulos, valor)."""
+        return [('plant_orders_sent_total', {}, self.orders_sent)]
+
+    def handle_message(self, data):
+        """Trata uma mensagem recebida no canal da fábrica."""
+        msg = decode_message(data)
+        with self.tracer.span(msg.command, msg.trace):
+            if msg.command == "update_factory":
+                self.update_finished_goods_stock(msg.parts)
 
     def listen(self):
         pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:factory")
-        print_update("Ouvindo o canal 'channel:factory' por atualizações de estoque...", self.entity_name)
+        pubsub.subscribe(self.channel)
+        print_update(f"Ouvindo o canal '{self.channel}' por atualizações de estoque...", self.entity_name)
         
         for message in pubsub.listen():
             if message['type'] == 'message':
-                parts = message['data'].split("/")
-                if parts[0] == "update_factory":
-                    buffer = string_to_list(parts[1])
-                    self.update_finished_goods_stock(buffer)
+                self.handle_message(message['data'])
 
 def main():
     if len(sys.argv) != 4:
@@ -98,13 +129,22 @@ def main():
     fabric_type, factory_id, lines_n = sys.argv[1], sys.argv[2], int(sys.argv[3])
     
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        # Com mensagens binárias (ver codec.py) as respostas ficam em bytes
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=(WIRE_FORMAT == 'text'))
         r.ping()
     except redis.exceptions.ConnectionError as e:
         print(f"ERRO CRÍTICO (Fábrica {factory_id}): Não foi possível conectar ao Redis. Detalhes: {e}")
         return
 
     fac = FactoryRedis(fabric_type, factory_id, lines_n, r)
+    if load_entity_states(r, [fac]):
+        print_update("Estado restaurado do checkpoint.", fac.entity_name)
+    start_metrics_server([fac], r)
+
+    if DAY_CLOCK == 'lockstep':
+        run_lockstep(r, fac.entity_name, {'factory': fac.order_daily_batch},
+                     lambda channel, data: fac.handle_message(data), channels=[fac.channel], entities=[fac])
+        return
     
     listener_thread = threading.Thread(target=fac.listen, daemon=True)
     listener_thread.start()
@@ -1,9 +1,103 @@
 # init_redis.py
 
+import sys
+import time
+import numpy as np
 import redis
-from utils import BATCH_SIZE, NUM_PRODUCTS, REDIS_HOST, REDIS_PORT
+from stock_storage import make_stock_storage
+from vector_stock import build_consumption_matrix
+from replenishment import DemandForecast
+from checkpoint import restore_checkpoint
+from utils import (
+    NUM_PRODUCTS,
+    NUM_PARTS,
+    REDIS_HOST,
+    REDIS_PORT,
+    STOCK_LAYOUT,
+    PLANT_FACTORIES,
+    INITIAL_PRODUCT_STOCK,
+    INITIAL_WAREHOUSE_STOCK,
+    INITIAL_LINE_STOCK,
+    INIT_PROFILE,
+    INIT_PIPELINE_FIELDS,
+    LINE_REPLENISHMENT,
+    LINE_REORDER_DAYS,
+    LINE_TARGET_DAYS,
+    YELLOW_ALERT_LINE,
+    YELLOW_ALERT_WAREHOUSE,
+    PARTS_TO_SEND_AMOUNT_WAREHOUSE,
+    PARTS_TO_SEND_AMOUNT_SUPPLIER
+)
 
-def initialize_simulation():
+# Perfis de estoque calculados aqui; 'checkpoint' restaura um arquivo de checkpoint.py
+STOCK_PROFILES = ('uniforme', 'regime')
+INIT_PROFILES = STOCK_PROFILES + ('checkpoint',)
+
+USAGE = f"""Uso: python3 init_redis.py [{'|'.join(STOCK_PROFILES)}]
+       python3 init_redis.py checkpoint [arquivo.ckpt]
+Sem perfil, usa INIT_PROFILE ('{INIT_PROFILE}')."""
+
+
+def line_locations(factories=PLANT_FACTORIES):
+    return [f"line:{factory_id}:{line_id}" for _, factory_id, lines in factories for line_id in range(1, lines + 1)]
+
+def steady_line_stock():
+    """
+    Estimativa do estoque de uma linha em regime: no modo 'demanda', o meio
+    da faixa entre o ponto de pedido e o nível-alvo para o consumo previsto
+    antes das primeiras ordens; no 'kanban', o limite amarelo mais meia remessa.
+    """
+    if LINE_REPLENISHMENT == 'kanban':
+        return [YELLOW_ALERT_LINE + PARTS_TO_SEND_AMOUNT_WAREHOUSE // 2] * NUM_PARTS
+    rates = DemandForecast(1, build_consumption_matrix()).part_rates()[0]
+    return np.ceil(rates * (LINE_REORDER_DAYS + LINE_TARGET_DAYS) / 2).astype(np.int64).tolist()
+
+def stock_plan(profile='uniforme'):
+    """
+    Estoque inicial do perfil: (produtos, almoxarifado, estoque de cada linha).
+    Todas as linhas começam iguais; None quando elas começam vazias.
+    """
+    if profile not in STOCK_PROFILES:
+        raise ValueError(f"Perfil de estoque desconhecido: '{profile}'. Use um de {list(STOCK_PROFILES)}.")
+    products = [INITIAL_PRODUCT_STOCK] * NUM_PRODUCTS
+    if profile == 'uniforme':
+        return products, [INITIAL_WAREHOUSE_STOCK] * NUM_PARTS, [INITIAL_LINE_STOCK] * NUM_PARTS if INITIAL_LINE_STOCK else None
+    # O almoxarifado oscila entre o limite amarelo (quando pede) e ele mais uma remessa do fornecedor
+    warehouse = [YELLOW_ALERT_WAREHOUSE + PARTS_TO_SEND_AMOUNT_SUPPLIER // 2] * NUM_PARTS
+    return products, warehouse, steady_line_stock()
+
+def populate_initial_stock(r, profile='uniforme', factories=PLANT_FACTORIES, max_fields=INIT_PIPELINE_FIELDS):
+    """
+    Grava o estoque inicial do perfil no cliente informado: produtos com um
+    MSET, o almoxarifado e a primeira linha no layout de STOCK_LAYOUT, e as
+    demais linhas copiadas da primeira dentro do Redis (COPY), sem reenviar
+    as peças. Os comandos vão em pipelines de até `max_fields` campos.
+    Devolve (locais, campos, round trips).
+    """
+    products, warehouse, line_stock = stock_plan(profile)
+    storage = make_stock_storage(r)
+    lines = line_locations(factories) if line_stock is not None else []
+
+    pipe = r.pipeline(transaction=False)
+    pipe.mset({f"product:{i}": value for i, value in enumerate(products)})
+    storage.set_all('warehouse', warehouse, pipe=pipe)
+    pending, round_trips = len(products) + len(warehouse), 0
+    for index, location in enumerate(lines):
+        if index == 0:
+            storage.set_all(location, line_stock, pipe=pipe)
+            pending += len(line_stock)
+        else:
+            pending += storage.copy_location(lines[0], location, pipe=pipe)
+        if pending >= max_fields:
+            pipe.execute()
+            pending, round_trips = 0, round_trips + 1
+    if pending:
+        pipe.execute()
+        round_trips += 1
+    fields = len(products) + len(warehouse) + len(lines) * NUM_PARTS
+    return 1 + len(lines), fields, round_trips
+
+def initialize_simulation(profile=INIT_PROFILE, checkpoint_path=None):
     """
     Limpa o banco de dados Redis e o popula com um estado inicial saudável.
     Isso evita que a simulação comece com estoques zerados e trave imediatamente.
@@ -20,33 +114,49 @@ def initialize_simulation():
         return
 
     print(">>> Conexão com Redis bem-sucedida.")
-    
+
+    if profile == 'checkpoint':
+        # O checkpoint substitui o banco inteiro (FLUSHDB e RESTORE em lotes)
+        print(f">>> Restaurando o checkpoint {checkpoint_path}...")
+        start = time.perf_counter()
+        day = restore_checkpoint(r, checkpoint_path)
+        print(f"    - Estado do fim do dia {day} restaurado em {time.perf_counter() - start:.2f}s")
+        print("\n>>> Inicialização do Redis completa! A simulação continua do dia seguinte.")
+        return
+
     print(">>> Limpando o banco de dados de simulações anteriores (FLUSHDB)...")
+    start = time.perf_counter()
     r.flushdb()
+    flushed = time.perf_counter()
+
+    # Produtos acabados e almoxarifado começam saudáveis para os primeiros pedidos serem atendidos;
+    # as linhas começam vazias (e pedem tudo no primeiro dia), a não ser que o perfil as abasteça.
+    lines = sum(n for _, _, n in PLANT_FACTORIES)
+    print(f">>> Estoque inicial '{profile}': {NUM_PRODUCTS} produtos, {NUM_PARTS} peças no almoxarifado "
+          f"e em {lines} linhas (layout '{STOCK_LAYOUT}')...")
+    locations, fields, round_trips = populate_initial_stock(r, profile)
+    done = time.perf_counter()
+    print(f"    - FLUSHDB em {flushed - start:.2f}s")
+    print(f"    - {locations} locais, {fields} campos em {round_trips} round trips: {done - flushed:.2f}s "
+          f"({fields / max(done - flushed, 1e-9):,.0f} campos/s)")
+    if locations == 1:
+        print("    - Linhas sem estoque inicial: pedirão peças ao almoxarifado no primeiro dia")
 
-    # 1. Inicializar estoque de produtos acabados
-    # Começa com um estoque saudável para que os primeiros pedidos dos clientes possam ser atendidos.
-    print(f">>> Inicializando estoque de {NUM_PRODUCTS} produtos acabados...")
-    initial_product_stock = 1000
-    for i in range(NUM_PRODUCTS):
-        key = f"product:{i}"
-        r.set(key, initial_product_stock)
-        print(f"    - Chave '{key}' criada com valor {initial_product_stock}")
-
-    # 2. Inicializar estoque do almoxarifado (warehouse)
-    # O almoxarifado precisa de um estoque robusto para poder abastecer as 13 linhas de produção.
-    print(">>> Inicializando estoque de peças no Almoxarifado...")
-    initial_warehouse_stock = BATCH_SIZE * 1000  # Um valor alto para garantir o início
-    for i in range(100): # Total de 100 peças diferentes
-        key = f"warehouse:part:{i}"
-        r.set(key, initial_warehouse_stock)
-    print(f"    - 100 chaves 'warehouse:part:x' criadas com valor {initial_warehouse_stock}")
-    
-    # NOTA: As linhas de produção podem começar com estoque zero. A lógica delas
-    # fará com que peçam peças ao almoxarifado assim que iniciarem.
-    
     print("\n>>> Inicialização do Redis completa! A simulação está pronta para começar.")
 
 
+def main():
+    args = sys.argv[1:]
+    profile = args[0] if args else INIT_PROFILE
+    if (len(args) > 2 or profile not in INIT_PROFILES or (len(args) == 2 and profile != 'checkpoint')
+            or (profile == 'checkpoint' and len(args) < 2)):
+        print(USAGE)
+        sys.exit(1)
+    try:
+        initialize_simulation(profile, args[1] if len(args) > 1 else None)
+    except (OSError, ValueError) as e:
+        print(f"ERRO: {e}")
+        sys.exit(1)
+
 if __name__ == "__main__":
-    initialize_simulation()
\ No newline at end of file
+    main()
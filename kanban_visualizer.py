@@ -1,7 +1,10 @@
 # kanban_visualizer.py
 
+import numpy as np
 import streamlit as st
 import redis
+from change_feed import LivePlantState, PRODUCTS_LOCATION
+from stock_history import StockHistory
 from utils import (
     REDIS_HOST,
     REDIS_PORT,
@@ -9,9 +12,7 @@ from utils import (
     YELLOW_ALERT_LINE,
     RED_ALERT_WAREHOUSE,
     YELLOW_ALERT_WAREHOUSE,
-    RED_ALERT_PRODUCT_STOCK,
-    NUM_PARTS,
-    NUM_PRODUCTS
+    RED_ALERT_PRODUCT_STOCK
 )
 
 # --- Configurações da Página do Streamlit ---
@@ -21,18 +22,38 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Cores das zonas Kanban nos mapas de calor (verde, amarelo, vermelho)
+ZONE_COLORS = np.array([[46, 160, 67], [230, 180, 20], [210, 50, 50]], dtype=np.uint8)
+# Tamanho, em pixels, de cada célula (peça) do mapa de calor
+CELL_SIZE = 10
+# Espera máxima (s) por uma mudança antes de o laço de atualização voltar a esperar.
+# O Streamlit encerra o laço de uma aba fechada na próxima chamada st.* (a próxima mudança).
+IDLE_TIMEOUT = 30
+# Pontos no gráfico de histórico; períodos longos vêm dos níveis reduzidos do histórico
+HISTORY_MAX_POINTS = 200
+
 # --- Funções Auxiliares ---
 
+@st.cache_resource
 def connect_to_redis():
-    """Tenta conectar ao Redis e retorna o cliente ou None se falhar."""
+    """Conexão única, compartilhada por todas as sessões do dashboard (None se falhar)."""
     try:
         r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
         r.ping()
         return r
     except redis.exceptions.ConnectionError:
-        st.error(f"**Erro de Conexão:** Não foi possível conectar ao servidor Redis em `{REDIS_HOST}:{REDIS_PORT}`. Verifique se o Redis está rodando e se os outros scripts estão ativos.", icon="🚨")
         return None
 
+@st.cache_resource
+def live_state():
+    """Estado empurrado pelo change feed; uma única thread e assinatura para todas as sessões."""
+    return LivePlantState(connect_to_redis()).start()
+
+@st.cache_resource
+def history_store():
+    """O histórico é binário: usa uma conexão própria, sem decode_responses."""
+    return StockHistory(redis.Redis(host=REDIS_HOST, port=REDIS_PORT))
+
 def get_kanban_color_and_symbol(value, red_limit, yellow_limit):
     """Retorna um símbolo e cor com base nos limites do Kanban."""
     if value < red_limit:
@@ -41,68 +62,114 @@ def get_kanban_color_and_symbol(value, red_limit, yellow_limit):
         return "🟨", "orange"
     return "🟩", "green"
 
-def display_stock_grid(title, data_dict, red_limit, yellow_limit, items_per_row=10):
-    """Exibe um grid de métricas de estoque com cores Kanban."""
+def zone_heatmap(values, red_limit, yellow_limit):
+    """Imagem RGB (local x peça) com a cor da zona Kanban de cada peça."""
+    stock = np.atleast_2d(np.asarray(values, dtype=np.int64))
+    zones = (stock < yellow_limit).astype(np.int8) + (stock < red_limit)
+    image = ZONE_COLORS[zones]
+    return np.repeat(np.repeat(image, CELL_SIZE, axis=0), CELL_SIZE, axis=1)
+
+def zone_summary(labels, values, red_limit, yellow_limit):
+    """Tabela curta por local: peças em cada zona e o menor estoque."""
+    stock = np.atleast_2d(np.asarray(values, dtype=np.int64))
+    red = (stock < red_limit).sum(axis=1)
+    yellow = (stock < yellow_limit).sum(axis=1) - red
+    return {
+        "Local": labels,
+        "🟥 Vermelho": red.tolist(),
+        "🟨 Amarelo": yellow.tolist(),
+        "🟩 Verde": (stock.shape[1] - red - yellow).tolist(),
+        "Menor estoque": stock.min(axis=1).tolist(),
+    }
+
+def display_products(products, red_limit, yellow_limit):
+    st.subheader("Estoque de Produtos Acabados")
+    cols = st.columns(len(products))
+    for i, qty in enumerate(products):
+        symbol, _ = get_kanban_color_and_symbol(qty, red_limit, yellow_limit)
+        with cols[i]:
+            st.metric(label=f"{symbol} Produto {i + 1}", value=qty)
+
+def display_heatmap(title, labels, values, limits):
     st.subheader(title)
-    
-    # Organiza os itens em colunas para uma visualização em grid
-    cols = st.columns(items_per_row)
-    
-    # Itera sobre o dicionário de itens (ex: {id_da_peca: quantidade})
-    for i, (item_id, qty) in enumerate(data_dict.items()):
-        symbol, color = get_kanban_color_and_symbol(qty, red_limit, yellow_limit)
-        
-        # Coloca cada métrica em uma coluna do grid
-        with cols[i % items_per_row]:
-            # Usa st.metric para um visual mais limpo
-            st.metric(
-                label=f"{symbol} {item_id}",
-                value=qty
-            )
+    st.image(zone_heatmap(values, *limits), caption=f"Peças 1 a {len(values[0])} (colunas) • {', '.join(labels)} (linhas)")
+    st.dataframe(zone_summary(labels, values, *limits), hide_index=True)
+
+def display_history(lines):
+    """Gráfico do estoque total por local ao longo dos dias (ver stock_history.py)."""
+    history = history_store()
+    last_day = history.last_day()
+    with st.expander("📈 Histórico de estoque", expanded=False):
+        if last_day == 0:
+            st.info("Nenhum dia registrado ainda. Inicie: `python3 stock_history.py registrar`.")
+            return
+        start_day, end_day = st.slider("Dias", 1, max(last_day, 2), (max(1, last_day - 90), last_day))
+        totals = history.query_totals(['warehouse', PRODUCTS_LOCATION, *lines], start_day, end_day, HISTORY_MAX_POINTS)
+        days = totals['warehouse'][0]
+        st.line_chart({"dia": days, **{loc: values for loc, (_, values) in totals.items()}}, x="dia")
+
+def factory_of(location):
+    return location.split(':')[1]
+
+def render_panel(panel, state, lines_by_factory):
+    """Redesenha um painel: 'warehouse', PRODUCTS_LOCATION ou o id de uma fábrica."""
+    if panel == 'warehouse':
+        display_heatmap("Estoque do Almoxarifado Central", ["Almoxarifado"], [state.read('warehouse')],
+                        (RED_ALERT_WAREHOUSE, YELLOW_ALERT_WAREHOUSE))
+    elif panel == PRODUCTS_LOCATION:
+        display_products(state.read(PRODUCTS_LOCATION), RED_ALERT_PRODUCT_STOCK, RED_ALERT_PRODUCT_STOCK * 2)
+    else:
+        locations = lines_by_factory[panel]
+        display_heatmap(f"Fábrica {panel}", [f"Linha {loc.split(':')[2]}" for loc in locations],
+                        [state.read(loc) for loc in locations], (RED_ALERT_LINE, YELLOW_ALERT_LINE))
 
 # --- Lógica Principal da Interface ---
 
 st.title("📊 Dashboard Kanban de Produção em Tempo Real")
-st.markdown("Este painel atualiza automaticamente a cada 2 segundos.")
+st.markdown("Este painel é atualizado pelas próprias entidades a cada mudança de estoque, sem recarregar a página.")
 
-# Conecta ao Redis. Se falhar, exibe o erro e para a execução.
 r = connect_to_redis()
 
-if r:
-    # Auto-reload a cada 2 segundos se a conexão for bem-sucedida
-    st.markdown('<meta http-equiv="refresh" content="2">', unsafe_allow_html=True)
+if r is None:
+    connect_to_redis.clear()
+    st.error(f"**Erro de Conexão:** Não foi possível conectar ao servidor Redis em `{REDIS_HOST}:{REDIS_PORT}`. Verifique se o Redis está rodando e se os outros scripts estão ativos.", icon="🚨")
+else:
+    state = live_state()
+    lines = state.line_locations()
+    lines_by_factory = {}
+    for location in lines:
+        lines_by_factory.setdefault(factory_of(location), []).append(location)
 
-    # --- Estoque do Almoxarifado Central ---
-    st.markdown("---")
-    warehouse_keys = [f"warehouse:part:{i}" for i in range(NUM_PARTS)]
-    warehouse_values = r.mget(warehouse_keys)
-    warehouse_stock = {f"Peça {i+1}": int(v or 0) for i, v in enumerate(warehouse_values)}
-    display_stock_grid("Estoque do Almoxarifado Central", warehouse_stock, RED_ALERT_WAREHOUSE, YELLOW_ALERT_WAREHOUSE, items_per_row=10)
+    display_history(lines)
 
-    # --- Estoque de Produtos Acabados ---
+    # Um espaço reservado por painel; cada mudança redesenha só os painéis dos locais afetados
     st.markdown("---")
-    product_keys = [f"product:{i}" for i in range(NUM_PRODUCTS)]
-    product_values = r.mget(product_keys)
-    product_stock = {f"Produto {i+1}": int(v or 0) for i, v in enumerate(product_values)}
-    display_stock_grid("Estoque de Produtos Acabados", product_stock, RED_ALERT_PRODUCT_STOCK, RED_ALERT_PRODUCT_STOCK * 2, items_per_row=5)
-
-    # --- Estoque das Linhas de Produção ---
+    placeholders = {'warehouse': st.empty()}
+    st.markdown("---")
+    placeholders[PRODUCTS_LOCATION] = st.empty()
     st.markdown("---")
     st.subheader("Estoque de Peças nas Linhas de Produção")
-    
-    # Abas para cada fábrica para melhor organização
-    f1_tab, f2_tab = st.tabs(["Fábrica 1 (Empurrada)", "Fábrica 2 (Puxada)"])
-
-    with f1_tab:
-        for line_id in range(1, 6): # Linhas 1 a 5
-            line_keys = [f"line:1:{line_id}:part:{i}" for i in range(NUM_PARTS)]
-            line_values = r.mget(line_keys)
-            line_stock = {f"Peça {i+1}": int(v or 0) for i, v in enumerate(line_values)}
-            display_stock_grid(f"Fábrica 1 • Linha {line_id}", line_stock, RED_ALERT_LINE, YELLOW_ALERT_LINE, items_per_row=10)
-            
-    with f2_tab:
-        for line_id in range(1, 9): # Linhas 1 a 8
-            line_keys = [f"line:2:{line_id}:part:{i}" for i in range(NUM_PARTS)]
-            line_values = r.mget(line_keys)
-            line_stock = {f"Peça {i+1}": int(v or 0) for i, v in enumerate(line_values)}
-            display_stock_grid(f"Fábrica 2 • Linha {line_id}", line_stock, RED_ALERT_LINE, YELLOW_ALERT_LINE, items_per_row=10)
\ No newline at end of file
+    if not lines_by_factory:
+        st.info("Nenhuma linha de produção registrada ainda.")
+    else:
+        tabs = st.tabs([f"Fábrica {factory_id}" for factory_id in lines_by_factory])
+        for tab, factory_id in zip(tabs, lines_by_factory):
+            placeholders[factory_id] = tab.empty()
+
+    # Primeiro desenho completo; depois, só o que o change feed avisar que mudou
+    seen = state.wait_for_change(-1, timeout=0)
+    panels = set(placeholders)
+    while True:
+        for panel in panels & set(placeholders):
+            with placeholders[panel].container():
+                render_panel(panel, state, lines_by_factory)
+
+        version = state.wait_for_change(seen, timeout=IDLE_TIMEOUT)
+        if version == seen:
+            panels = set()
+            continue
+        if state.line_locations() != lines:
+            # Linha nova no change feed: o layout (abas) muda, então a página é montada de novo
+            st.rerun()
+        panels = {factory_of(loc) if loc.startswith('line:') else loc for loc in state.changed_since(seen)}
+        seen = version
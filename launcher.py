@@ -0,0 +1,215 @@
+# launcher.py
+
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from topology import load_topology, line_ranges, topology_path, TOPOLOGY_ENV, DEFAULT_TOPOLOGY_FILE
+
+# Este módulo não importa utils.py: os processos filhos leem a topologia passada em PLANT_TOPOLOGY.
+
+# Segundos entre iniciar as linhas/fábricas e o almoxarifado (que dá o sinal de prontidão)
+LAUNCH_GRACE = 1.0
+# Gerado de topology.toml pelo comando compose; não é editado à mão
+COMPOSE_FILE = 'docker-compose.yml'
+DASHBOARD_COMMAND = ['streamlit', 'run', 'kanban_visualizer.py', '--server.port', '8501', '--server.address', '0.0.0.0']
+
+USAGE = f"""Uso: python3 launcher.py iniciar [topologia.toml]
+       python3 launcher.py plano [topologia.toml]
+       python3 launcher.py compose [topologia.toml] [docker-compose.yml]
+Sem arquivo, usa ${TOPOLOGY_ENV} ou {DEFAULT_TOPOLOGY_FILE}."""
+
+
+def plan_processes(topology):
+    """
+    Processos da planta como (nome, argumentos do python), na ordem de início:
+    linhas e fábricas primeiro, almoxarifado por último (e, no relógio lockstep,
+    o coordenador dos dias, que espera todos se registrarem).
+    """
+    hosting = topology.hosting
+    factories = topology.factories
+    workers = range(1, hosting['warehouse_workers'])
+    processes = []
+
+    if hosting['mode'] in ('processos', 'line_hosts'):
+        if hosting['mode'] == 'line_hosts':
+            shards = hosting['line_shards']
+            processes += [(f'line-host-{shard}', ['line_host.py', str(shard), str(shards)]) for shard in range(shards)]
+        else:
+            for _, factory_id, lines in factories:
+                processes += [(f'line-f{factory_id}-l{line_id}', ['line_redis.py', str(line_id), str(factory_id)])
+                              for line_id in range(1, lines + 1)]
+        processes += [(f'factory-{factory_id}', ['factory_redis.py', fabric_type, str(factory_id), str(lines)])
+                      for fabric_type, factory_id, lines in factories]
+        processes += [('supplier', ['supplier_redis.py']), ('product_stock', ['product_stock_redis.py'])]
+        processes += [(f'warehouse-{worker_id}', ['warehouse_redis.py', str(worker_id)]) for worker_id in workers]
+        processes.append(('warehouse', ['warehouse_redis.py']))
+    else:
+        for index, group in enumerate(line_ranges(factories, hosting['lines_per_process']), start=1):
+            processes.append((f'lines-{index}', ['async_host.py', *(f'lines:{factory_id}:{first}-{last}'
+                                                                   for factory_id, first, last in group)]))
+        processes.append(('plant', [
+            'async_host.py', 'supplier', 'product_stock',
+            *(f'factory:{fabric_type}:{factory_id}:{lines}' for fabric_type, factory_id, lines in factories),
+            *(f'warehouse:{worker_id}' for worker_id in workers),
+            'warehouse',
+        ]))
+
+    if hosting['clock'] == 'lockstep':
+        processes.append(('tick_coordinator', ['tick_coordinator.py']))
+
+    for service in hosting['services']:
+        processes.append((service, [f'{service}.py', *(['registrar'] if service == 'stock_history' else [])]))
+    return processes
+
+def print_plan(topology, processes):
+    total_lines = sum(lines for _, _, lines in topology.factories)
+    print(f"Topologia {topology.path}: {len(topology.factories)} fábricas, {total_lines} linhas, "
+          f"modo '{topology.hosting['mode']}', {len(processes)} processos.")
+    for name, args in processes:
+        print(f"  {name:<22} python3 {' '.join(args)}")
+    if topology.hosting['dashboard']:
+        print(f"  {'dashboard':<22} {' '.join(DASHBOARD_COMMAND)}")
+
+def init_steps(topology):
+    """
+    Preparação do Redis antes dos processos: peças aleatórias e estado inicial,
+    ou, com hosting.restore, o checkpoint (que depende das peças já geradas).
+    """
+    if topology.hosting['restore']:
+        return [['checkpoint.py', 'restaurar', topology.hosting['restore']]]
+    return [['random_parts.py'], ['init_redis.py']]
+
+def _run_step(args, env):
+    print(f"[INIT] python3 {' '.join(args)}")
+    subprocess.run([sys.executable, *args], env=env, check=True)
+
+def launch(topology):
+    """Inicializa o Redis, sobe todos os processos da topologia e espera; Ctrl+C encerra todos."""
+    env = {**os.environ, TOPOLOGY_ENV: topology.path}
+    processes = plan_processes(topology)
+    print_plan(topology, processes)
+
+    for args in init_steps(topology):
+        _run_step(args, env)
+
+    children = []
+    try:
+        for name, args in processes:
+            if name == 'warehouse':
+                # As linhas já iniciadas recebem o sinal de prontidão; as atrasadas o leem do Redis
+                time.sleep(LAUNCH_GRACE)
+            children.append((name, subprocess.Popen([sys.executable, *args], env=env)))
+        if topology.hosting['dashboard']:
+            if shutil.which(DASHBOARD_COMMAND[0]) is None:
+                print("Streamlit não encontrado; dashboard não iniciado.")
+            else:
+                children.append(('dashboard', subprocess.Popen(DASHBOARD_COMMAND, env=env)))
+        print(f"{len(children)} processos iniciados. Ctrl+C encerra todos.")
+
+        while children:
+            for name, child in list(children):
+                code = child.poll()
+                if code is not None:
+                    print(f"Processo '{name}' terminou (código {code}).")
+                    children.remove((name, child))
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nEncerrando os processos...")
+    finally:
+        for _, child in children:
+            if child.poll() is None:
+                child.send_signal(signal.SIGTERM)
+        for _, child in children:
+            try:
+                child.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                child.kill()
+
+def _compose_service(name, command, extra=""):
+    return f"""  {name}:
+    <<: *base-service
+    command: {command}{extra}
+"""
+
+def compose_file(topology):
+    """docker-compose equivalente à topologia: um serviço por processo do plano."""
+    topology_file = os.path.relpath(topology.path)
+    if topology_file.startswith('..'):
+        raise ValueError(f"{topology.path} precisa estar dentro do projeto para ser montado em /app.")
+    services = [_compose_service(name, f"python {' '.join(args)}") for name, args in plan_processes(topology)]
+    init_command = ' && '.join(f"python {' '.join(args)}" for args in init_steps(topology))
+    if topology.hosting['dashboard']:
+        services.append(_compose_service('visualizer', ' '.join(DASHBOARD_COMMAND), """
+    ports:
+      - "8501:8501\""""))
+    return f"""# Gerado por launcher.py a partir de {topology_file}; gere de novo em vez de editar.
+
+x-base-service: &base-service
+  build: .
+  volumes:
+    - .:/app
+  environment:
+    {TOPOLOGY_ENV}: /app/{topology_file}
+  depends_on:
+    init_db:
+      condition: service_completed_successfully
+
+services:
+  redis:
+    image: redis:7-alpine
+    ports:
+      - "6379:6379"
+    healthcheck:
+      test: ["CMD", "redis-cli", "ping"]
+      interval: 10s
+      timeout: 5s
+      retries: 5
+
+  init_db:
+    build: .
+    volumes:
+      - .:/app
+    environment:
+      {TOPOLOGY_ENV}: /app/{topology_file}
+    command: sh -c "{init_command}"
+    depends_on:
+      redis:
+        condition: service_healthy
+
+{''.join(services)}"""
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('iniciar', 'plano', 'compose') or len(sys.argv) > 4:
+        print(USAGE)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    try:
+        topology = load_topology(sys.argv[2] if len(sys.argv) > 2 else topology_path())
+    except (OSError, ValueError) as e:
+        print(f"ERRO: topologia inválida. Detalhes: {e}")
+        sys.exit(1)
+    if not topology.factories:
+        print(f"ERRO: {topology.path} não define nenhuma fábrica ([[factories]]).")
+        sys.exit(1)
+
+    if command == 'plano':
+        print_plan(topology, plan_processes(topology))
+    elif command == 'compose':
+        path = sys.argv[3] if len(sys.argv) > 3 else COMPOSE_FILE
+        try:
+            content = compose_file(topology)
+        except ValueError as e:
+            print(f"ERRO: {e}")
+            sys.exit(1)
+        with open(path, 'w') as f:
+            f.write(content)
+        print(f"{path} gerado. Rode: docker compose -f {path} up --build")
+    else:
+        launch(topology)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# line_host.py
+
+import sys
+import threading
+import time
+import zlib
+import redis
+from line_redis import LineRedis
+from stock_storage import make_stock_storage
+from tracing import traced_client
+from metrics import start_metrics_server
+from tick_coordinator import run_lockstep
+from checkpoint import load_entity_states
+from snapshot_aggregator import STOCK_FLUSH_CHANNEL
+from utils import (
+    print_update,
+    ERROR,
+    TIME_SLEEP,
+    DAYS_MAX,
+    REDIS_HOST,
+    REDIS_PORT,
+    WIRE_FORMAT,
+    PLANT_FACTORIES,
+    DAY_CLOCK
+)
+
+READY_CHANNEL = "control:warehouse_ready"
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def shard_of(location, shards):
+    """Shard (0..shards-1) de uma linha; crc32 é estável entre processos, ao contrário de hash()."""
+    return zlib.crc32(location.encode()) % shards
+
+
+class LineHost:
+    """
+    Hospeda todas as linhas de um shard em um único processo: uma conexão
+    pubsub para as mensagens de todas elas (e o sinal de prontidão do
+    almoxarifado), um pool compartilhado para os comandos e uma única thread
+    para as rotinas diárias. Conexões e threads crescem com o número de
+    shards, não com o número de linhas.
+    """
+
+    def __init__(self, redis_client, shard=0, shards=1, factories=PLANT_FACTORIES):
+        if not 0 <= shard < shards:
+            raise ValueError(f"Shard {shard} fora do intervalo 0..{shards - 1}.")
+        self.r = redis_client
+        self.shard = shard
+        self.shards = shards
+        self.entity_name = f'line-host-{shard}'
+        self.factories = factories
+        # Um só storage (scripts Lua e listas de campos) para todas as linhas do processo
+        stock = make_stock_storage(traced_client(redis_client))
+        self.lines = {}
+        for _, factory_id, lines_n in factories:
+            for line_id in range(1, lines_n + 1):
+                if shard_of(f"line:{factory_id}:{line_id}", shards) == shard:
+                    line = LineRedis(line_id, factory_id, redis_client, stock=stock)
+                    self.lines[line.channel] = line
+        # Depois de um checkpoint restaurado, cada linha volta ao estado gravado (um MGET para todas)
+        self.restored = load_entity_states(redis_client, self.lines.values())
+        self.warehouse_ready = threading.Event()
+        # Uma gravação do estoque das linhas por vez (ouvinte e rotina diária)
+        self.flush_lock = threading.Lock()
+
+    def subscriptions(self):
+        """
+        Padrões e canais assinados. Com um shard só, um PSUBSCRIBE por fábrica
+        cobre todas as linhas; com vários, cada shard assina só os canais das
+        suas linhas, para não receber (e descartar) as mensagens dos outros.
+        """
+        control = [READY_CHANNEL]
+        if any(line.stock_cache == 'write_behind' for line in self.lines.values()):
+            control.append(STOCK_FLUSH_CHANNEL)
+        if self.shards == 1:
+            return [f"channel:line:{factory_id}:*" for _, factory_id, _ in self.factories], control
+        return [], [*control, *self.lines]
+
+    def listen(self):
+        patterns, channels = self.subscriptions()
+        pubsub = self.r.pubsub(ignore_subscribe_messages=True)
+        if patterns:
+            pubsub.psubscribe(*patterns)
+        pubsub.subscribe(*channels)
+        print_update(f"Ouvindo {len(self.lines)} linhas em uma única conexão pubsub "
+                     f"({len(patterns)} padrões, {len(channels)} canais)...", self.entity_name)
+        # O almoxarifado também deixa o sinal gravado, para hosts iniciados depois dele
+        if self.r.get(READY_CHANNEL) is not None:
+            self.warehouse_ready.set()
+
+        for message in pubsub.listen():
+            if message['type'] not in ('message', 'pmessage'):
+                continue
+            channel = _text(message['channel'])
+            if channel == READY_CHANNEL:
+                self.warehouse_ready.set()
+                continue
+            self.dispatch(channel, message['data'])
+
+    def dispatch(self, channel, data):
+        """Entrega uma mensagem à linha dona do canal."""
+        if channel == STOCK_FLUSH_CHANNEL:
+            self.flush_stock()
+            return
+        line = self.lines.get(channel)
+        if line is None:
+            return
+        try:
+            line.handle_message(data)
+        except Exception as e:
+            # Uma mensagem com problema não pode derrubar as outras linhas do processo
+            print_update(f"Erro ao tratar mensagem do canal {channel}: {e!r}", self.entity_name, ERROR)
+
+    def flush_stock(self):
+        """Grava o estoque em memória de todas as linhas do shard em um único pipeline."""
+        with self.flush_lock:
+            pipe = self.r.pipeline(transaction=False)
+            written = [(line, line.flush_stock(pipe)) for line in self.lines.values()]
+            if not len(pipe):
+                return
+            pipe.execute()
+            # Só com o pipeline executado as peças deixam de estar pendentes
+            for line, pending in written:
+                if pending is not None:
+                    line.stock.mark_flushed(*pending)
+
+    def daily_routine(self):
+        # Com o estoque já gravado, a checagem de cada linha não tem nada a gravar
+        self.flush_stock()
+        for line in self.lines.values():
+            line.check_and_order_parts()
+
+    def run_lockstep(self):
+        """Como run(), mas os dias vêm do coordenador (ver tick_coordinator.py)."""
+        patterns, channels = self.subscriptions()
+        run_lockstep(self.r, self.entity_name, {'line': self.daily_routine}, self.dispatch,
+                     channels=[c for c in channels if c != READY_CHANNEL], patterns=patterns,
+                     entities=list(self.lines.values()))
+
+    def run(self):
+        listener_thread = threading.Thread(target=self.listen, daemon=True)
+        listener_thread.start()
+
+        print_update("Aguardando sinal de prontidão do almoxarifado...", self.entity_name)
+        self.warehouse_ready.wait()
+        print_update("Sinal recebido! Iniciando ciclo de operações.", self.entity_name)
+
+        days = 0
+        while days < DAYS_MAX:
+            days += 1
+            self.daily_routine()
+            time.sleep(TIME_SLEEP)
+
+        print_update("Simulação terminada.", self.entity_name)
+        listener_thread.join()
+
+def main():
+    if len(sys.argv) > 3:
+        print("Uso: python3 line_host.py [shard] [total_de_shards]")
+        sys.exit(1)
+    shard = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    shards = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    try:
+        # Com mensagens binárias (ver codec.py) as respostas ficam em bytes
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=(WIRE_FORMAT == 'text'))
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO (Host de linhas {shard}): Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+
+    try:
+        host = LineHost(r, shard, shards)
+    except ValueError as e:
+        print(f"ERRO: {e}")
+        sys.exit(1)
+    print_update(f"Shard {shard}/{shards}: {len(host.lines)} linhas"
+                 f"{f' ({host.restored} restauradas do checkpoint)' if host.restored else ''}.", host.entity_name)
+    start_metrics_server(list(host.lines.values()), r)
+    if DAY_CLOCK == 'lockstep':
+        host.run_lockstep()
+    else:
+        host.run()
+
+if __name__ == "__main__":
+    main()
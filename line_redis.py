@@ -4,10 +4,23 @@ import redis
 import threading
 import time
 import sys
+import numpy as np
+from stock_storage import make_stock_storage, LocationStockCache, STOCK_CACHE_MODES
+from codec import encode_message, decode_message
+from order_streams import send_order, WAREHOUSE_ORDERS_STREAM
+from snapshot_aggregator import LINES_REGISTRY_KEY, STOCK_FLUSH_CHANNEL
+from change_feed import publish_stock_change, publish_dense_change
+from tracing import Tracer, traced_client
+from metrics import start_metrics_server
+from tick_coordinator import run_lockstep
+from checkpoint import load_entity_states
+from vector_stock import build_consumption_matrix
+from replenishment import DemandForecast, replenishment_quantities, check_replenishment_mode
 from utils import (
     string_to_list,
-    list_to_string,
     print_update,
+    WARNING,
+    ERROR,
     TIME_SLEEP,
     DAYS_MAX,
     RED_ALERT_LINE,
@@ -15,119 +28,222 @@ from utils import (
     REDIS_HOST,
     REDIS_PORT,
     NUM_PARTS,
+    BASE_KIT_SIZE,
+    PRODUCTS_AND_PARTS_FILE,
+    WIRE_FORMAT,
+    ORDER_TRANSPORT,
+    LINE_REPLENISHMENT,
+    LINE_STOCK_CACHE,
+    DAY_CLOCK,
 )
 
-BASE_KIT_SIZE = 43
-
 class LineRedis:
-    def __init__(self, line_id, factory_id, redis_client):
-        self.r = redis_client
+    # Tabelas de produtos lidas uma vez por processo e compartilhadas (só leitura) por todas as linhas
+    _products_cache = {}
+
+    def __init__(self, line_id, factory_id, redis_client, order_transport=ORDER_TRANSPORT, stock=None,
+                 replenishment=LINE_REPLENISHMENT, stock_cache=LINE_STOCK_CACHE):
+        if stock_cache not in STOCK_CACHE_MODES:
+            raise ValueError(f"Modo de estoque desconhecido: '{stock_cache}'. Use um de {list(STOCK_CACHE_MODES)}.")
+        self.r = traced_client(redis_client)
+        self.order_transport = order_transport
+        self.replenishment = check_replenishment_mode(replenishment)
         self.line_id = str(line_id)
         self.factory_id = str(factory_id)
         self.entity_name = f'line-{self.factory_id}-{self.line_id}'
+        self.tracer = Tracer(self.entity_name, redis_client)
+        self.channel = f"channel:line:{self.factory_id}:{self.line_id}"
+        self.location = f"line:{self.factory_id}:{self.line_id}"
+        # Um line_host.py passa o mesmo storage para todas as suas linhas
+        self.storage = stock if stock is not None else make_stock_storage(self.r)
+        # Fora do modo 'redis' a linha lê e escreve o estoque em memória (mesma interface do storage)
+        self.stock_cache = stock_cache
+        self.stock = self.storage if stock_cache == 'redis' else LocationStockCache(self.storage, self.location)
+        # Uma gravação do estoque em memória por vez (ver flush_stock)
+        self.flush_lock = threading.Lock()
+        # Registro da linha para o agregador de fotos do dashboard
+        self.r.sadd(LINES_REGISTRY_KEY, self.location)
         self.is_waiting_for_parts = False
-        self.products_necessary_parts = self._read_products_necessary_parts()
+        self.line_stops = 0
+        if PRODUCTS_AND_PARTS_FILE not in LineRedis._products_cache:
+            products = self._read_products_necessary_parts()
+            # Peças do kit completo (base + variação, 0-indexadas) de cada produto
+            kits = [list(range(BASE_KIT_SIZE)) + [p - 1 for p in parts] for parts in products]
+            LineRedis._products_cache[PRODUCTS_AND_PARTS_FILE] = (products, kits, build_consumption_matrix(products))
+        self.products_necessary_parts, self.kit_parts, bom = LineRedis._products_cache[PRODUCTS_AND_PARTS_FILE]
+        self.forecast = DemandForecast(1, bom)
 
     def _read_products_necessary_parts(self):
         try:
-            with open("products_and_parts.txt", "r") as f:
+            with open(PRODUCTS_AND_PARTS_FILE, "r") as f:
                 return [string_to_list(line.strip()) for line in f.readlines()]
         except FileNotFoundError:
-            print_update(f"ERRO CRÍTICO: Arquivo 'products_and_parts.txt' não encontrado!", self.entity_name)
+            print_update(f"ERRO CRÍTICO: Arquivo 'products_and_parts.txt' não encontrado!", self.entity_name, ERROR)
             sys.exit(1)
 
     def _get_part_stock(self, part_id):
-        key = f"line:{self.factory_id}:{self.line_id}:part:{part_id}"
-        return int(self.r.get(key) or 0)
+        return self.stock.get(self.location, part_id)
 
     def _increment_part_stock(self, part_id, qty):
-        key = f"line:{self.factory_id}:{self.line_id}:part:{part_id}"
-        self.r.incrby(key, qty)
+        self.stock.incr(self.location, part_id, qty)
 
     def _decrement_part_stock(self, part_id, qty):
-        key = f"line:{self.factory_id}:{self.line_id}:part:{part_id}"
-        self.r.decrby(key, qty)
+        self.stock.incr(self.location, part_id, -qty)
     
     def receive_parts_from_warehouse(self, parts_received):
         print_update("Recebendo lote de peças do Almoxarifado.", self.entity_name)
-        for i, amount in enumerate(parts_received):
-            if amount > 0:
-                self._increment_part_stock(i, amount)
+        self.stock.add(self.location, parts_received)
+        if self.stock_cache == 'redis':
+            publish_dense_change(self.r, self.location, parts_received)
+        elif self.stock_cache == 'write_through':
+            self.flush_stock()
         self.is_waiting_for_parts = False
         print_update("Estoque da linha reabastecido.", self.entity_name)
 
+    def flush_stock(self, pipe=None):
+        """
+        Grava no Redis as peças que mudaram em memória e as anuncia no feed de
+        mudanças, em um round trip. Com o `pipe` de um host com várias linhas,
+        devolve (peças, valores) para o host confirmar com stock.mark_flushed
+        depois de executá-lo; até lá as peças continuam pendentes.
+        """
+        if self.stock_cache == 'redis':
+            return None
+        if pipe is not None:
+            part_ids, deltas, values = self.stock.flush(pipe)
+            if not part_ids:
+                return None
+            publish_stock_change(pipe, self.location, part_ids, deltas)
+            return part_ids, values
+        # Duas gravações ao mesmo tempo (ex.: ouvinte e rotina diária) anunciariam os mesmos deltas
+        with self.flush_lock:
+            pipe = self.r.pipeline(transaction=False)
+            part_ids, deltas, values = self.stock.flush(pipe)
+            if not part_ids:
+                return None
+            publish_stock_change(pipe, self.location, part_ids, deltas)
+            pipe.execute()
+            self.stock.mark_flushed(part_ids, values)
+        return None
+
     def check_and_order_parts(self):
+        # Chamado uma vez por dia: as ordens do dia entram na previsão de consumo
+        self.forecast.close_day()
+        self.flush_stock()
         if self.is_waiting_for_parts:
             print_update("Aguardando peças do Almoxarifado.", self.entity_name)
             return
 
-        all_stocks = [self._get_part_stock(i) for i in range(NUM_PARTS)]
-        min_stock = min(all_stocks)
+        if self.replenishment == 'demanda':
+            self._request_parts_by_demand()
+            return
+
+        # Com o índice de níveis (STOCK_LEVEL_INDEX) é uma consulta só, independente de NUM_PARTS
+        min_stock = self.stock.min_stock(self.location)
 
         if min_stock < YELLOW_ALERT_LINE:
             print_update(f"Estoque baixo detectado (peça com menor estoque: {min_stock}). Pedindo reposição.", self.entity_name)
             
             self.is_waiting_for_parts = True
             parts_to_order_flags = [1] * NUM_PARTS
-            payload = list_to_string(parts_to_order_flags)
-            msg = f"{self.line_id}/{self.factory_id}/send_parts/{payload}"
-            self.r.publish("channel:warehouse", msg)
+            msg = encode_message("send_parts", self.line_id, self.factory_id, parts=parts_to_order_flags)
+            send_order(self.r, self.order_transport, WAREHOUSE_ORDERS_STREAM, "channel:warehouse", msg)
         else:
             print_update(f"Status do buffer de peças: VERDE (mínimo: {min_stock}).", self.entity_name)
 
+    def _request_parts_by_demand(self):
+        """Pede só as peças abaixo do ponto de pedido, na quantidade prevista pelo consumo dos produtos da linha."""
+        stock = self.stock.get_all(self.location)
+        quantities = replenishment_quantities([stock], self.forecast.part_rates())[0]
+        n_parts = int(np.count_nonzero(quantities))
+        if not n_parts:
+            print_update("Status do buffer de peças: VERDE (nenhuma peça abaixo do ponto de pedido).", self.entity_name)
+            return
+
+        print_update(f"{n_parts} peças abaixo do ponto de pedido. Pedindo {int(quantities.sum())} unidades.", self.entity_name)
+        self.is_waiting_for_parts = True
+        msg = encode_message("request_parts", self.line_id, self.factory_id, parts=quantities.tolist())
+        send_order(self.r, self.order_transport, WAREHOUSE_ORDERS_STREAM, "channel:warehouse", msg)
+
     def execute_production_order(self, product_idx_str, qty_str):
         product_idx = int(product_idx_str)
         qty = int(qty_str)
+        self.forecast.record(0, product_idx, qty)
         print_update(f"Recebida ordem para produzir {qty} unids do produto {product_idx + 1}.", self.entity_name)
 
-        parts_for_this_product = self.products_necessary_parts[product_idx]
-        
-        pipe = self.r.pipeline()
-        for i in range(BASE_KIT_SIZE):
-            pipe.get(f"line:{self.factory_id}:{self.line_id}:part:{i}")
-        for part_id in parts_for_this_product:
-            pipe.get(f"line:{self.factory_id}:{self.line_id}:part:{part_id - 1}")
-        
-        stocks = pipe.execute()
-        
-        for stock in stocks:
-            if int(stock or 0) < qty:
-                print_update(f"QUEBRA DE LINHA! Estoque insuficiente para lote de {qty}.", self.entity_name)
-                return
-
-        pipe = self.r.pipeline()
-        for i in range(BASE_KIT_SIZE):
-            pipe.decrby(f"line:{self.factory_id}:{self.line_id}:part:{i}", qty)
-        for part_id in parts_for_this_product:
-            pipe.decrby(f"line:{self.factory_id}:{self.line_id}:part:{part_id - 1}", qty)
-        pipe.execute()
-
-        msg = f"receive_products/{product_idx}/{self.line_id}/{self.factory_id}/{qty}"
+        # Checagem e consumo do kit inteiro em uma única operação atômica (no Redis ou em memória)
+        if not self.stock.consume_kit(self.location, self.kit_parts[product_idx], qty):
+            self.line_stops += 1
+            print_update(f"QUEBRA DE LINHA! Estoque insuficiente para lote de {qty}.", self.entity_name, WARNING)
+            return
+        if self.stock_cache == 'redis':
+            publish_stock_change(self.r, self.location, self.kit_parts[product_idx], -qty)
+        elif self.stock_cache == 'write_through':
+            self.flush_stock()
+
+        msg = encode_message("receive_products", product_idx, self.line_id, self.factory_id, qty)
         self.r.publish("channel:product_stock", msg)
         print_update(f"SUCESSO: Produziu {qty} unids do produto {product_idx + 1}.", self.entity_name)
 
+    def get_state(self):
+        """
+        Estado em memória para um checkpoint (ver checkpoint.py). O estoque vai
+        pelas chaves do Redis: as mudanças pendentes em memória são gravadas antes.
+        """
+        self.flush_stock()
+        return {
+            'is_waiting_for_parts': self.is_waiting_for_parts,
+            'line_stops': self.line_stops,
+            'forecast': self.forecast.get_state(),
+        }
+
+    def set_state(self, state):
+        self.is_waiting_for_parts = state['is_waiting_for_parts']
+        self.line_stops = state['line_stops']
+        self.forecast.set_state(state['forecast'])
+        if self.stock_cache != 'redis':
+            self.stock.reload()
+
+    def metrics(self):
+        """Amostras para o endpoint de métricas (ver metrics.py): (nome, rótulos, valor)."""
+        return [
+            ('plant_line_stops_total', {}, self.line_stops),
+            ('plant_waiting_for_parts', {}, int(self.is_waiting_for_parts)),
+        ]
+
+    def handle_message(self, data):
+        """Trata uma mensagem recebida no canal exclusivo da linha."""
+        msg = decode_message(data)
+        
+        with self.tracer.span(msg.command, msg.trace):
+            if msg.command == "receive_parts":
+                self.receive_parts_from_warehouse(msg.parts)
+            
+            elif msg.command == "receive_order":
+                prod_idx, qty = msg.args
+                self.execute_production_order(prod_idx, qty)
+
+    def subscriptions(self):
+        """Canais da linha: o exclusivo e, com gravação adiada, o de pedidos de gravação."""
+        if self.stock_cache == 'write_behind':
+            return [self.channel, STOCK_FLUSH_CHANNEL]
+        return [self.channel]
+
+    def dispatch(self, channel, data):
+        if channel in (STOCK_FLUSH_CHANNEL, STOCK_FLUSH_CHANNEL.encode()):
+            self.flush_stock()
+        else:
+            self.handle_message(data)
+
     def listen(self):
-        my_channel = f"channel:line:{self.factory_id}:{self.line_id}"
         pubsub = self.r.pubsub()
-        pubsub.subscribe(my_channel)
-        print_update(f"Ouvindo o canal exclusivo '{my_channel}'...", self.entity_name)
+        pubsub.subscribe(*self.subscriptions())
+        print_update(f"Ouvindo o canal exclusivo '{self.channel}'...", self.entity_name)
 
         for message in pubsub.listen():
             if message["type"] != "message":
                 continue
-
-            data = message["data"]
-            parts = data.split("/")
-            command = parts[0]
-            
-            if command == "receive_parts":
-                payload = parts[1]
-                parts_to_receive = string_to_list(payload)
-                self.receive_parts_from_warehouse(parts_to_receive)
-            
-            elif command == "receive_order":
-                prod_idx, qty = parts[1], parts[2]
-                self.execute_production_order(prod_idx, qty)
+            self.dispatch(message["channel"], message["data"])
 
 def main():
     if len(sys.argv) != 3:
@@ -137,13 +253,23 @@ def main():
     line_id, factory_id = sys.argv[1], sys.argv[2]
     
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        # Com mensagens binárias (ver codec.py) as respostas ficam em bytes
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=(WIRE_FORMAT == 'text'))
         r.ping()
     except redis.exceptions.ConnectionError as e:
         print(f"ERRO CRÍTICO (Linha {factory_id}-{line_id}): Não foi possível conectar ao Redis. Detalhes: {e}")
         return
 
     line = LineRedis(line_id, factory_id, r)
+    if load_entity_states(r, [line]):
+        print_update("Estado restaurado do checkpoint.", line.entity_name)
+    start_metrics_server([line], r)
+
+    if DAY_CLOCK == 'lockstep':
+        # O coordenador só começa com todos registrados: não há sinal de prontidão a esperar
+        run_lockstep(r, line.entity_name, {'line': line.check_and_order_parts},
+                     line.dispatch, channels=line.subscriptions(), entities=[line])
+        return
     
     listener_thread = threading.Thread(target=line.listen, daemon=True)
     listener_thread.start()
@@ -152,10 +278,12 @@ def main():
     print_update("Aguardando sinal de prontidão do almoxarifado...", line.entity_name)
     pubsub = r.pubsub()
     pubsub.subscribe("control:warehouse_ready")
-    for message in pubsub.listen():
-        if message['type'] == 'message' and message['data'] == "READY":
-            print_update("Sinal recebido! Iniciando ciclo de operações.", line.entity_name)
-            break 
+    # O almoxarifado também deixa o sinal gravado, para linhas iniciadas depois dele
+    if r.get("control:warehouse_ready") is None:
+        for message in pubsub.listen():
+            if message['type'] == 'message' and message['data'] in ("READY", b"READY"):
+                break
+    print_update("Sinal recebido! Iniciando ciclo de operações.", line.entity_name)
     pubsub.unsubscribe()
     # <<< FIM DA CORREÇÃO >>>
 
@@ -0,0 +1,138 @@
+# lua_scripts.py
+
+# Scripts Lua executados no servidor Redis. Cada chamada é atômica: nenhum outro
+# comando (ex.: um INCRBY de reabastecimento) consegue se intercalar entre a
+# checagem de estoque e o débito, e a operação inteira custa um único round trip.
+
+# Consome `qty` unidades de cada peça do kit, ou nada se alguma faltar.
+# KEYS: chaves das peças do kit; ARGV[1]: quantidade do lote.
+# Retorna 1 em caso de sucesso e 0 se faltar alguma peça.
+CONSUME_KIT_LUA = """
+local qty = tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+    if tonumber(redis.call('GET', key) or '0') < qty then
+        return 0
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call('DECRBY', key, qty)
+end
+return 1
+"""
+
+# Debita uma remessa inteira (quantidade própria por peça), ou nada se alguma faltar.
+# KEYS: chaves das peças de origem; ARGV[i]: quantidade a debitar de KEYS[i].
+# Retorna 0 em caso de sucesso, ou a posição (1-indexada) da primeira peça em falta.
+TRANSFER_PARTS_LUA = """
+for i, key in ipairs(KEYS) do
+    if tonumber(redis.call('GET', key) or '0') < tonumber(ARGV[i]) then
+        return i
+    end
+end
+for i, key in ipairs(KEYS) do
+    redis.call('DECRBY', key, tonumber(ARGV[i]))
+end
+return 0
+"""
+
+# Versões para o layout em hash (um hash por local, campo = id da peça).
+# KEYS[2] (opcional) é o índice de níveis do local, um sorted set peça -> estoque
+# (ver HashStockStorage), atualizado no mesmo script para nunca divergir do hash.
+# KEYS[1]: hash do local; ARGV[1]: quantidade do lote; ARGV[2..]: campos do kit.
+CONSUME_KIT_HASH_LUA = """
+local qty = tonumber(ARGV[1])
+local stocks = redis.call('HMGET', KEYS[1], unpack(ARGV, 2))
+for _, stock in ipairs(stocks) do
+    if tonumber(stock or '0') < qty then
+        return 0
+    end
+end
+for i = 2, #ARGV do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], -qty)
+    if KEYS[2] then
+        redis.call('ZINCRBY', KEYS[2], -qty, ARGV[i])
+    end
+end
+return 1
+"""
+
+# KEYS[1]: hash do local; KEYS[2] (opcional): índice de níveis; ARGV: pares (campo, quantidade).
+# Retorna 0 em caso de sucesso, ou a posição (1-indexada) do primeiro par em falta.
+TRANSFER_PARTS_HASH_LUA = """
+for i = 1, #ARGV, 2 do
+    if tonumber(redis.call('HGET', KEYS[1], ARGV[i]) or '0') < tonumber(ARGV[i + 1]) then
+        return (i + 1) / 2
+    end
+end
+for i = 1, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+    if KEYS[2] then
+        redis.call('ZINCRBY', KEYS[2], -tonumber(ARGV[i + 1]), ARGV[i])
+    end
+end
+return 0
+"""
+
+# Anuncia uma mudança de estoque no change feed com o próximo número de sequência do feed.
+# O INCR e o PUBLISH no mesmo script: as mensagens chegam na ordem das sequências, sem buracos.
+# KEYS[1]: contador do feed; ARGV[1]: canal; ARGV[2]: mensagem (objeto JSON) sem o campo "seq".
+# Retorna a sequência atribuída.
+PUBLISH_CHANGE_LUA = """
+local seq = redis.call('INCR', KEYS[1])
+redis.call('PUBLISH', ARGV[1], '{"seq":' .. seq .. ',' .. string.sub(ARGV[2], 2))
+return seq
+"""
+
+
+def _consume_kit(r, keys, args):
+    qty = int(args[0])
+    if any(int(r.get(key) or 0) < qty for key in keys):
+        return 0
+    for key in keys:
+        r.decrby(key, qty)
+    return 1
+
+def _transfer_parts(r, keys, args):
+    amounts = [int(a) for a in args]
+    for i, (key, amount) in enumerate(zip(keys, amounts)):
+        if int(r.get(key) or 0) < amount:
+            return i + 1
+    for key, amount in zip(keys, amounts):
+        r.decrby(key, amount)
+    return 0
+
+def _consume_kit_hash(r, keys, args):
+    name, qty, fields = keys[0], int(args[0]), args[1:]
+    if any(int(stock or 0) < qty for stock in r.hmget(name, fields)):
+        return 0
+    for field in fields:
+        r.hincrby(name, field, -qty)
+        if len(keys) > 1:
+            r.zincrby(keys[1], -qty, field)
+    return 1
+
+def _transfer_parts_hash(r, keys, args):
+    name = keys[0]
+    pairs = [(args[i], int(args[i + 1])) for i in range(0, len(args), 2)]
+    for i, (field, amount) in enumerate(pairs):
+        if int(r.hget(name, field) or 0) < amount:
+            return i + 1
+    for field, amount in pairs:
+        r.hincrby(name, field, -amount)
+        if len(keys) > 1:
+            r.zincrby(keys[1], -amount, field)
+    return 0
+
+def _publish_change(r, keys, args):
+    seq = r.incrby(keys[0])
+    r.publish(args[0], f'{{"seq":{seq},{args[1][1:]}')
+    return seq
+
+# Equivalentes em Python de cada script, usados pelo InMemoryRedis (sem servidor Lua).
+PYTHON_EQUIVALENTS = {
+    CONSUME_KIT_LUA: _consume_kit,
+    TRANSFER_PARTS_LUA: _transfer_parts,
+    CONSUME_KIT_HASH_LUA: _consume_kit_hash,
+    TRANSFER_PARTS_HASH_LUA: _transfer_parts_hash,
+    PUBLISH_CHANGE_LUA: _publish_change,
+}
@@ -0,0 +1,205 @@
+# memory_redis.py
+
+import copy
+import pickle
+from fnmatch import fnmatchcase
+from lua_scripts import PYTHON_EQUIVALENTS
+
+
+class InMemoryPipeline:
+    """Acumula comandos e os executa de uma vez, como o pipeline do redis-py."""
+
+    def __init__(self, client):
+        self._client = client
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._commands = []
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        return [method(*args, **kwargs) for method, args, kwargs in commands]
+
+
+class InMemoryRedis:
+    """
+    Substituto em memória do cliente Redis, com o subconjunto de comandos usado
+    pelas entidades. Os contadores são guardados como inteiros; o `publish` não
+    vai para a rede, e sim para o `broker` informado (ex.: o motor de simulação).
+    """
+
+    def __init__(self, broker=None):
+        self._data = {}
+        self._broker = broker
+
+    def ping(self):
+        return True
+
+    def flushdb(self):
+        self._data.clear()
+        return True
+
+    def keys(self, pattern='*'):
+        return [k for k in self._data if fnmatchcase(k, pattern)]
+
+    def scan_iter(self, match='*', count=None):
+        return iter(self.keys(match))
+
+    def copy(self, source, destination, replace=False):
+        if source not in self._data or (destination in self._data and not replace):
+            return False
+        # Hashes, sets e sorted sets só guardam valores imutáveis: a cópia rasa basta
+        self._data[destination] = copy.copy(self._data[source])
+        return True
+
+    def dump(self, name):
+        """Valor serializado da chave (pickle; só este cliente o lê de volta), ou None."""
+        if name not in self._data:
+            return None
+        return pickle.dumps(self._data[name], protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, name, ttl, value, replace=False):
+        # pickle.loads executa o que o valor mandar: só valores de checkpoints confiáveis
+        if name in self._data and not replace:
+            raise ValueError(f"BUSYKEY: a chave '{name}' já existe.")
+        self._data[name] = pickle.loads(value)
+        return True
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def set(self, key, value):
+        self._data[key] = value
+        return True
+
+    def mget(self, keys, *args):
+        if isinstance(keys, str):
+            keys = [keys, *args]
+        return [self._data.get(k) for k in keys]
+
+    def mset(self, mapping):
+        self._data.update(mapping)
+        return True
+
+    def incrby(self, key, amount=1):
+        value = int(self._data.get(key) or 0) + amount
+        self._data[key] = value
+        return value
+
+    def decrby(self, key, amount=1):
+        return self.incrby(key, -amount)
+
+    def hget(self, name, key):
+        return self._data.get(name, {}).get(str(key))
+
+    def hmget(self, name, keys, *args):
+        if isinstance(keys, (str, int)):
+            keys = [keys, *args]
+        fields = self._data.get(name, {})
+        return [fields.get(str(k)) for k in keys]
+
+    def hgetall(self, name):
+        return dict(self._data.get(name, {}))
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        fields = self._data.setdefault(name, {})
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        added = sum(1 for k in items if str(k) not in fields)
+        fields.update((str(k), v) for k, v in items.items())
+        return added
+
+    def hincrby(self, name, key, amount=1):
+        fields = self._data.setdefault(name, {})
+        value = int(fields.get(str(key)) or 0) + amount
+        fields[str(key)] = value
+        return value
+
+    def sadd(self, name, *values):
+        members = self._data.setdefault(name, set())
+        added = sum(1 for v in values if v not in members)
+        members.update(values)
+        return added
+
+    def smembers(self, name):
+        return set(self._data.get(name, ()))
+
+    def zadd(self, name, mapping):
+        members = self._data.setdefault(name, {})
+        added = sum(1 for m in mapping if str(m) not in members)
+        members.update((str(m), s) for m, s in mapping.items())
+        return added
+
+    def zincrby(self, name, amount, value):
+        members = self._data.setdefault(name, {})
+        score = members.get(str(value), 0) + amount
+        members[str(value)] = score
+        return score
+
+    def zscore(self, name, value):
+        return self._data.get(name, {}).get(str(value))
+
+    @staticmethod
+    def _by_score(item):
+        return item[1], item[0]
+
+    def zrange(self, name, start, end, withscores=False):
+        members = self._data.get(name, {})
+        if start == 0 and end == 0:
+            # Caso comum (menor score): min() em vez de ordenar tudo
+            items = [min(members.items(), key=self._by_score)] if members else []
+        else:
+            items = sorted(members.items(), key=self._by_score)
+            items = items[start:] if end == -1 else items[start:end + 1]
+        return items if withscores else [m for m, _ in items]
+
+    @staticmethod
+    def _score_bound(value):
+        """Limite de ZRANGEBYSCORE: número, '-inf'/'+inf' ou '(n' (exclusivo)."""
+        value = str(value)
+        if value.startswith('('):
+            return float(value[1:]), True
+        return float(value), False
+
+    def zrangebyscore(self, name, min, max, start=None, num=None, withscores=False):
+        (low, low_open), (high, high_open) = self._score_bound(min), self._score_bound(max)
+        items = sorted(((m, s) for m, s in self._data.get(name, {}).items()
+                        if (s > low if low_open else s >= low) and (s < high if high_open else s <= high)),
+                       key=self._by_score)
+        if start is not None:
+            items = items[start:start + num] if num is not None and num >= 0 else items[start:]
+        return items if withscores else [m for m, _ in items]
+
+    def delete(self, *keys):
+        return sum(1 for k in keys if self._data.pop(k, None) is not None)
+
+    def pipeline(self, transaction=True):
+        return InMemoryPipeline(self)
+
+    def register_script(self, script):
+        """Devolve um chamável com a mesma assinatura de redis.commands.core.Script."""
+        implementation = PYTHON_EQUIVALENTS[script]
+
+        def run(keys=(), args=(), client=None):
+            return implementation(self, list(keys), list(args))
+        return run
+
+    def eval(self, script, numkeys, *keys_and_args):
+        return PYTHON_EQUIVALENTS[script](self, list(keys_and_args[:numkeys]), list(keys_and_args[numkeys:]))
+
+    def publish(self, channel, message):
+        if self._broker is None:
+            return 0
+        return self._broker(channel, message)
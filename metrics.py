@@ -0,0 +1,209 @@
+# metrics.py
+
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import redis
+from utils import (
+    print_update,
+    WARNING,
+    REDIS_HOST,
+    REDIS_PORT,
+    METRICS_HOST,
+    METRICS_PORT,
+    METRICS_TARGET_TTL
+)
+
+# Métricas exportadas: nome -> (tipo, descrição). Os contadores por mensagem vêm dos spans
+# do tracing.py (com ou sem TRACING); os demais são lidos das próprias entidades (método metrics()) a cada coleta.
+METRICS = {
+    'plant_messages_handled_total': ('counter', 'Mensagens tratadas, por comando.'),
+    'plant_handler_seconds_total': ('counter', 'Tempo gasto tratando mensagens, por comando.'),
+    'plant_redis_round_trips_total': ('counter', 'Round trips ao Redis durante o tratamento, por comando.'),
+    'plant_queue_depth': ('gauge', 'Pedidos das linhas aguardando no almoxarifado (entradas, pendentes e lag).'),
+    'plant_stockouts_total': ('counter', 'Remessas do almoxarifado que não puderam ser atendidas por completo.'),
+    'plant_line_stops_total': ('counter', 'Ordens de produção não executadas por falta de peças.'),
+    'plant_waiting_for_parts': ('gauge', '1 enquanto a entidade aguarda uma reposição pedida.'),
+    'plant_units_sold_total': ('counter', 'Unidades vendidas a clientes.'),
+    'plant_failed_orders_total': ('counter', 'Pedidos de clientes recusados por falta de estoque.'),
+    'plant_lost_sales_total': ('counter', 'Unidades de pedidos de clientes recusados.'),
+    'plant_orders_sent_total': ('counter', 'Ordens de produção enviadas às linhas.'),
+    'plant_process_cpu_seconds_total': ('counter', 'Tempo de CPU do processo.'),
+}
+
+# Endereço ('host:porta') de cada endpoint ativo; a chave expira se o processo parar de renová-la
+METRICS_TARGET_PREFIX = "metrics:target:"
+
+USAGE = "Uso: python3 metrics.py alvos [arquivo.json]"
+
+# Desligado pelo motor em processo (simulation_engine.py), onde ninguém coleta as métricas
+METRICS_ENABLED = METRICS_PORT is not None
+
+def set_metrics_enabled(enabled):
+    """Liga ou desliga a contagem por mensagem para todo o processo."""
+    global METRICS_ENABLED
+    METRICS_ENABLED = enabled
+
+
+class ThreadCounters:
+    """
+    Contadores somados sem lock no caminho quente: cada thread incrementa o
+    próprio dict e a coleta soma os dicts de todas as threads. O lock só é
+    usado quando uma thread nova registra seu dict e na coleta.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._tables = []
+        self._lock = threading.Lock()
+
+    def _table(self):
+        table = getattr(self._local, 'table', None)
+        if table is None:
+            table = self._local.table = {}
+            with self._lock:
+                self._tables.append(table)
+        return table
+
+    def add(self, key, amount=1):
+        table = self._table()
+        table[key] = table.get(key, 0) + amount
+
+    def totals(self):
+        with self._lock:
+            tables = list(self._tables)
+        totals = {}
+        for table in tables:
+            # Cópia: a thread dona pode estar inserindo uma chave nova durante a coleta
+            for key, value in table.copy().items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+# Contadores por mensagem de todas as entidades do processo: (métrica, entidade, comando) -> valor
+COUNTERS = ThreadCounters()
+
+def count_message(entity_name, command, seconds, round_trips):
+    COUNTERS.add(('plant_messages_handled_total', entity_name, command))
+    COUNTERS.add(('plant_handler_seconds_total', entity_name, command), seconds)
+    COUNTERS.add(('plant_redis_round_trips_total', entity_name, command), round_trips)
+
+
+def _labels(labels):
+    return ','.join(f'{name}="{value}"' for name, value in labels.items())
+
+def render(entities):
+    """Texto no formato de exposição do Prometheus com os contadores e as métricas de cada entidade."""
+    samples = {name: [] for name in METRICS}
+    for (name, entity_name, command), value in sorted(COUNTERS.totals().items()):
+        samples[name].append(({'entity': entity_name, 'command': command}, value))
+    for entity in entities:
+        for name, labels, value in entity.metrics():
+            samples[name].append(({'entity': entity.entity_name, **labels}, value))
+    samples['plant_process_cpu_seconds_total'].append(({}, time.process_time()))
+
+    lines = []
+    for name, values in samples.items():
+        if not values:
+            continue
+        kind, description = METRICS[name]
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in values:
+            lines.append(f"{name}{{{_labels(labels)}}} {value}" if labels else f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    entities = ()
+
+    def do_GET(self):
+        if self.path not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render(self.entities).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Cada coleta geraria uma linha no console; o Prometheus coleta a cada poucos segundos
+        pass
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def _register_target(redis_client, address, label):
+    """Mantém o endereço no registro enquanto o processo vive: renova a chave a cada terço do TTL."""
+    key = f"{METRICS_TARGET_PREFIX}{address}"
+    while True:
+        try:
+            redis_client.set(key, label, ex=METRICS_TARGET_TTL)
+        except redis.exceptions.ConnectionError:
+            pass
+        time.sleep(METRICS_TARGET_TTL / 3)
+
+def metrics_targets(r):
+    """Endpoints registrados: {'host:porta': entidade (ou número de entidades do processo)}."""
+    keys = sorted(_text(key) for key in r.scan_iter(match=f"{METRICS_TARGET_PREFIX}*"))
+    if not keys:
+        return {}
+    return {key[len(METRICS_TARGET_PREFIX):]: _text(label)
+            for key, label in zip(keys, r.mget(keys)) if label is not None}
+
+def start_metrics_server(entities, redis_client=None, host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serve /metrics das entidades do processo em uma thread própria. Com
+    METRICS_PORT = 0 o sistema operacional escolhe uma porta livre, então
+    qualquer número de processos cabe em uma máquina; com `redis_client`, o
+    endereço fica registrado no Redis (ver metrics_targets) enquanto o
+    processo vive. Devolve a porta usada (None se desligado ou indisponível).
+    """
+    if port is None:
+        return None
+    entity_name = entities[0].entity_name if len(entities) == 1 else 'metrics'
+    handler = type('MetricsHandler', (_MetricsHandler,), {'entities': tuple(entities)})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        print_update(f"Porta {port} indisponível ({e}); métricas desligadas.", entity_name, WARNING)
+        return None
+    server.daemon_threads = True
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    address = f"{socket.gethostname()}:{port}"
+    if redis_client is not None:
+        label = entity_name if len(entities) == 1 else f"{len(entities)} entidades"
+        threading.Thread(target=_register_target, args=(redis_client, address, label),
+                         name='metrics-registry', daemon=True).start()
+    print_update(f"Métricas em http://{address}/metrics", entity_name)
+    return port
+
+
+def main():
+    if len(sys.argv) not in (2, 3) or sys.argv[1] != 'alvos':
+        print(USAGE)
+        sys.exit(1)
+    try:
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+
+    targets = metrics_targets(r)
+    if len(sys.argv) == 2:
+        for address, label in targets.items():
+            print(f"{address:<32} {label}")
+        return
+    # Formato file_sd do Prometheus: aponte file_sd_configs para este arquivo
+    with open(sys.argv[2], 'w') as f:
+        json.dump([{'targets': [address], 'labels': {'process': label}} for address, label in targets.items()], f, indent=2)
+    print(f"{len(targets)} alvos gravados em {sys.argv[2]}.")
+
+if __name__ == "__main__":
+    main()
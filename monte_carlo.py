@@ -0,0 +1,133 @@
+# monte_carlo.py
+
+import csv
+import math
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from simulation_engine import SimulationEngine
+from utils import print_update, set_output_enabled, DAYS_MAX, PLANT_FACTORIES
+
+# Variantes de política comparadas: o tipo de cada fábrica, aplicado em ordem às fábricas
+# da planta ('mista' alterna empurrada e puxada). Ids e número de linhas não mudam.
+POLICY_TYPES = {
+    'empurrada': ['empurrada'],
+    'puxada': ['puxada'],
+    'mista': ['empurrada', 'puxada'],
+}
+
+def policy_factories(policy, factories=PLANT_FACTORIES):
+    """Fábricas da planta (utils.PLANT_FACTORIES ou o topology.toml) com a regra de order_daily_batch da política."""
+    types = POLICY_TYPES[policy]
+    return [(types[i % len(types)], factory_id, lines_n) for i, (_, factory_id, lines_n) in enumerate(factories)]
+
+POLICIES = {policy: policy_factories(policy) for policy in POLICY_TYPES}
+
+# Métricas de cada replicação que entram na tabela de resultados
+METRICS = [
+    'failed_orders',
+    'lost_sales',
+    'units_sold',
+    'line_stops',
+    'warehouse_stockouts',
+    'warehouse_inventory_mean',
+    'warehouse_inventory_min',
+    'line_inventory_mean',
+    'line_inventory_max',
+    'product_inventory_mean',
+]
+
+# Valores críticos t de Student bicaudais a 95% para 1..30 graus de liberdade;
+# acima disso a aproximação normal (1.96) é suficiente.
+T_CRITICAL_95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+
+def _init_worker():
+    # Os workers não escrevem banners: com milhares de dias isso dominaria o tempo.
+    set_output_enabled(False)
+
+def run_replication(job):
+    """Roda uma replicação isolada (cliente em memória próprio) e devolve suas métricas."""
+    policy, seed, days, vectorized = job
+    summary = SimulationEngine(POLICIES[policy], seed=seed, vectorized_lines=vectorized).run(days)
+    return policy, seed, {name: summary[name] for name in METRICS}
+
+def confidence_interval(values):
+    """Média e meia-largura do intervalo de confiança de 95%."""
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, 0.0
+    df = len(values) - 1
+    t = T_CRITICAL_95[df - 1] if df <= len(T_CRITICAL_95) else 1.96
+    return mean, t * statistics.stdev(values) / math.sqrt(len(values))
+
+def run_batch(policies, replications, days=DAYS_MAX, workers=None, base_seed=0, vectorized=True):
+    """
+    Distribui `replications` x `policies` simulações pelos núcleos disponíveis.
+    A replicação i usa a seed base_seed + i em todas as políticas (números
+    aleatórios comuns), o que reduz a variância da comparação entre elas.
+    """
+    jobs = [(policy, base_seed + i, days, vectorized) for policy in policies for i in range(replications)]
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(jobs) // (workers * 4))
+
+    results = {policy: [] for policy in policies}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        for policy, _, metrics in pool.map(run_replication, jobs, chunksize=chunksize):
+            results[policy].append(metrics)
+    return results
+
+def summarize(results):
+    """Agrega as replicações em linhas (política, métrica, n, média, ic95, mínimo, máximo)."""
+    rows = []
+    for policy, replications in results.items():
+        for name in METRICS:
+            values = [r[name] for r in replications]
+            mean, half_width = confidence_interval(values)
+            rows.append((policy, name, len(values), mean, half_width, min(values), max(values)))
+    return rows
+
+def write_csv(rows, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['policy', 'metric', 'n', 'mean', 'ci95', 'min', 'max'])
+        writer.writerows(rows)
+
+def format_table(rows):
+    header = f"{'política':<10} {'métrica':<26} {'n':>4} {'média':>14} {'± ic95':>12} {'mín':>12} {'máx':>12}"
+    lines = [header, '-' * len(header)]
+    for policy, name, n, mean, half_width, low, high in rows:
+        lines.append(f"{policy:<10} {name:<26} {n:>4} {mean:>14.1f} {half_width:>12.1f} {low:>12.1f} {high:>12.1f}")
+    return "\n".join(lines)
+
+def main():
+    if len(sys.argv) > 5:
+        print("Uso: python3 monte_carlo.py [replicacoes] [dias] [workers] [arquivo_csv]")
+        sys.exit(1)
+
+    replications = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    csv_path = sys.argv[4] if len(sys.argv) > 4 else None
+
+    start = time.perf_counter()
+    results = run_batch(list(POLICIES), replications, days, workers)
+    rows = summarize(results)
+    elapsed = time.perf_counter() - start
+
+    print(format_table(rows))
+    if csv_path:
+        write_csv(rows, csv_path)
+    print_update(
+        f"{replications} replicações x {len(POLICIES)} políticas de {days} dias em {elapsed:.1f}s.",
+        'monte-carlo'
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# order_allocator.py
+
+import numpy as np
+
+# Políticas de divisão de peças escassas entre os pedidos do lote:
+#   fifo: na ordem de chegada, cada pedido leva a quantidade inteira enquanto houver estoque
+#   fair: se a peça não dá para todos, divisão max-min justa: partes iguais entre quem a pediu,
+#         e o que um pedido menor não usa é redividido entre os que ainda faltam
+#   red:  linhas em alerta vermelho primeiro, depois fifo
+ALLOCATION_POLICIES = ('fifo', 'fair', 'red')
+
+
+def allocate(stock, demand, policy='fifo', red_rows=None):
+    """
+    Divide o estoque do almoxarifado entre os pedidos pendentes.
+
+    stock:    estoque por peça (NUM_PARTS)
+    demand:   matriz (n_pedidos x NUM_PARTS) com a quantidade pedida, na ordem de chegada
+    red_rows: máscara (n_pedidos) das linhas em alerta vermelho (política 'red')
+
+    Devolve a matriz de remessas, do mesmo formato de `demand`, cuja soma por
+    peça nunca passa do estoque.
+    """
+    if policy not in ALLOCATION_POLICIES:
+        raise ValueError(f"Política de alocação desconhecida: '{policy}'. Use uma de {list(ALLOCATION_POLICIES)}.")
+
+    stock = np.maximum(np.asarray(stock, dtype=np.int64), 0)
+    demand = np.asarray(demand, dtype=np.int64)
+    if demand.shape[0] == 0:
+        return demand.copy()
+
+    order = np.arange(demand.shape[0])
+    if policy == 'red' and red_rows is not None:
+        # Ordenação estável: entre linhas do mesmo grupo vale a ordem de chegada
+        order = np.argsort(~np.asarray(red_rows, dtype=bool), kind='stable')
+    ranked = demand[order]
+
+    if policy == 'fair':
+        shipped = _fair_share(stock, ranked)
+    else:
+        # Quanto sobra para cada pedido depois dos que vieram antes dele
+        before = np.cumsum(ranked, axis=0) - ranked
+        shipped = np.clip(stock - before, 0, ranked)
+
+    result = np.empty_like(shipped)
+    result[order] = shipped
+    return result
+
+def _fair_share(stock, demand):
+    """
+    Divisão max-min justa (water-filling), peça a peça: o estoque é dividido
+    igualmente entre quem ainda não foi atendido por inteiro, e a parte que
+    um pedido menor não usa volta a ser dividida entre os demais, até acabar
+    o estoque ou a demanda. Peças que dão para todos saem inteiras.
+    """
+    shipped = np.zeros_like(demand)
+    left = stock.copy()
+    while True:
+        need = demand - shipped
+        waiting = need > 0
+        n_waiting = waiting.sum(axis=0)
+        active = (left > 0) & (n_waiting > 0)
+        if not active.any():
+            return shipped
+        share = np.zeros_like(left)
+        np.floor_divide(left, n_waiting, out=share, where=active)
+        grant = np.minimum(need, share) * waiting
+        # Menos de uma unidade por pedido: a sobra vai, uma unidade cada, para os primeiros que esperam
+        rank = np.cumsum(waiting, axis=0)
+        grant = np.where(active & (share == 0), waiting & (rank <= left), grant)
+        shipped += grant
+        left -= grant.sum(axis=0)
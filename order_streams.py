@@ -0,0 +1,145 @@
+# order_streams.py
+
+import sys
+import redis
+from utils import REDIS_HOST, REDIS_PORT
+
+# Pedidos linha -> almoxarifado e almoxarifado -> fornecedor (ORDER_TRANSPORT = 'stream').
+# Diferente do publish, uma entrada no stream continua lá até um consumidor do
+# grupo confirmá-la (XACK), mesmo que o almoxarifado esteja fora do ar quando ela chega.
+WAREHOUSE_ORDERS_STREAM = "stream:warehouse:orders"
+WAREHOUSE_GROUP = "warehouse-workers"
+SUPPLIER_ORDERS_STREAM = "stream:supplier:orders"
+SUPPLIER_GROUP = "suppliers"
+
+# Limite aproximado de entradas mantidas em cada stream (XADD MAXLEN ~)
+STREAM_MAXLEN = 10000
+# Pedidos pendentes há mais tempo do que isso com outro consumidor são reassumidos (XAUTOCLAIM)
+CLAIM_IDLE_MS = 60000
+# Máximo de pedidos lidos de uma vez pelo atendimento em lote do almoxarifado
+BATCH_READ_COUNT = 1000
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def _entry_data(fields):
+    """Extrai o payload 'data' de uma entrada, com chaves em str ou bytes."""
+    if not fields:
+        return None
+    return fields.get('data', fields.get(b'data'))
+
+def ensure_group(r, stream, group):
+    """Cria o grupo de consumidores (e o stream) se ainda não existirem."""
+    try:
+        r.xgroup_create(stream, group, id='0', mkstream=True)
+    except redis.exceptions.ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+
+
+class OrderStream:
+    """Fila durável de pedidos sobre um Redis Stream, consumida por um grupo com confirmação."""
+
+    def __init__(self, redis_client, stream, group, consumer):
+        self.r = redis_client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self._recovered = False
+        ensure_group(self.r, stream, group)
+
+    def read(self, count=1, block=None, retry_pending=False):
+        """
+        Devolve até `count` pedidos como pares (entry_id, payload). Antes dos
+        pedidos novos, reentrega os que este consumidor leu e não confirmou
+        (ex.: caiu no meio do processamento) e reassume os de consumidores parados.
+        Com `retry_pending`, os não confirmados deste consumidor voltam em toda
+        leitura, e não só na primeira: quem deixa um pedido sem confirmação para
+        tentar de novo (o almoxarifado sem estoque) não espera CLAIM_IDLE_MS.
+        """
+        if retry_pending or not self._recovered:
+            entries = self._entries(self.r.xreadgroup(self.group, self.consumer, {self.stream: '0'}, count=count))
+            if entries:
+                return entries
+            self._recovered = True
+
+        claimed = self.r.xautoclaim(self.stream, self.group, self.consumer, CLAIM_IDLE_MS, start_id='0-0', count=count)
+        entries = [(_text(entry_id), _entry_data(fields)) for entry_id, fields in claimed[1] if fields]
+        if entries:
+            return entries
+
+        return self._entries(self.r.xreadgroup(self.group, self.consumer, {self.stream: '>'}, count=count, block=block))
+
+    def read_backlog(self, count=BATCH_READ_COUNT):
+        """
+        Todos os pedidos que este consumidor tem para atender: os que ele já leu
+        e ainda não confirmou (ex.: sem estoque no lote anterior), os reassumidos
+        de consumidores parados e os novos, até `count` no total.
+        """
+        entries = self._entries(self.r.xreadgroup(self.group, self.consumer, {self.stream: '0'}, count=count))
+        self._recovered = True
+        if len(entries) < count:
+            claimed = self.r.xautoclaim(self.stream, self.group, self.consumer, CLAIM_IDLE_MS, start_id='0-0', count=count - len(entries))
+            # O XAUTOCLAIM também devolve pendentes antigos do próprio consumidor, já lidos acima
+            seen = {entry_id for entry_id, _ in entries}
+            entries += [(_text(entry_id), _entry_data(fields)) for entry_id, fields in claimed[1]
+                        if fields and _text(entry_id) not in seen]
+        if len(entries) < count:
+            entries += self._entries(self.r.xreadgroup(self.group, self.consumer, {self.stream: '>'}, count=count - len(entries)))
+        return entries
+
+    def _entries(self, response):
+        entries = []
+        for _, stream_entries in response or []:
+            for entry_id, fields in stream_entries:
+                if fields:
+                    entries.append((_text(entry_id), _entry_data(fields)))
+        return entries
+
+    def ack(self, *entry_ids):
+        self.r.xack(self.stream, self.group, *entry_ids)
+
+    def stats(self):
+        return stream_stats(self.r, self.stream, self.group)
+
+
+def send_order(r, transport, stream, channel, msg):
+    """Envia um pedido pelo transporte configurado: XADD no stream ou PUBLISH no canal."""
+    if transport == 'stream':
+        r.xadd(stream, {'data': msg}, maxlen=STREAM_MAXLEN, approximate=True)
+    else:
+        r.publish(channel, msg)
+
+def stream_stats(r, stream, group):
+    """
+    Profundidade e atraso de um stream de pedidos:
+      length:  entradas no stream
+      pending: entregues a algum consumidor e ainda não confirmadas
+      lag:     entradas ainda não entregues ao grupo (Redis 7+)
+    """
+    stats = {'stream': stream, 'length': r.xlen(stream), 'pending': 0, 'lag': None, 'consumers': 0}
+    if not r.exists(stream):
+        return stats
+    for info in r.xinfo_groups(stream):
+        info = {_text(k): v for k, v in info.items()}
+        if _text(info['name']) == group:
+            stats.update(pending=info['pending'], lag=info.get('lag'), consumers=info['consumers'])
+    return stats
+
+
+def main():
+    """Mostra a profundidade e o atraso das filas de pedidos."""
+    try:
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        sys.exit(1)
+
+    for stream, group in [(WAREHOUSE_ORDERS_STREAM, WAREHOUSE_GROUP), (SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP)]:
+        s = stream_stats(r, stream, group)
+        print(f"{stream:<26} entradas={s['length']:<6} pendentes={s['pending']:<6} lag={s['lag']} consumidores={s['consumers']}")
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,15 @@ import redis
 import threading
 import time
 import random
+from codec import encode_message, decode_message
+from change_feed import publish_stock_change, publish_dense_change, PRODUCTS_LOCATION
+from tracing import Tracer, traced_client
+from metrics import start_metrics_server
+from tick_coordinator import run_lockstep
+from checkpoint import load_entity_states
 from utils import (
-    list_to_string,
     print_update,
+    WARNING,
     TIME_SLEEP,
     DAYS_MAX,
     RED_ALERT_PRODUCT_STOCK,
@@ -14,14 +20,24 @@ from utils import (
     MAX_ORDERED_AMOUNT,
     NUM_PRODUCTS,
     REDIS_HOST,
-    REDIS_PORT
+    REDIS_PORT,
+    WIRE_FORMAT,
+    DAY_CLOCK
 )
 
 class ProductStockRedis:
 
-    def __init__(self, redis_client):
-        self.r = redis_client
+    def __init__(self, redis_client, rng=None):
+        self.r = traced_client(redis_client)
         self.entity_name = 'product-stock'
+        self.tracer = Tracer(self.entity_name, redis_client)
+        self.channel = "channel:product_stock"
+        # Gerador da demanda; um random.Random com seed torna a execução reprodutível.
+        self.rng = rng if rng is not None else random
+        # Contadores de vendas para análise das execuções
+        self.units_sold = 0
+        self.failed_orders = 0
+        self.lost_sales = 0
 
     def receive_products(self, product_index_str, line_id, factory_id, qty_str):
         """Recebe um lote de produtos acabados de uma linha de produção e o adiciona ao estoque."""
@@ -30,6 +46,7 @@ class ProductStockRedis:
         
         key = f"product:{product_index}"
         self.r.incrby(key, qty)
+        publish_stock_change(self.r, PRODUCTS_LOCATION, [product_index], qty)
         
         print_update(f"Recebeu {qty} unids do produto {product_index + 1} da linha {factory_id}-{line_id}.", self.entity_name)
 
@@ -43,7 +60,7 @@ class ProductStockRedis:
         sent_orders = [0] * NUM_PRODUCTS
         for i in range(NUM_PRODUCTS):
             # Gera uma quantidade de pedido aleatória
-            order_amount = random.randint(MIN_ORDERED_AMOUNT, MAX_ORDERED_AMOUNT)
+            order_amount = self.rng.randint(MIN_ORDERED_AMOUNT, MAX_ORDERED_AMOUNT)
             key = f"product:{i}"
             
             # Pega o estoque atual do Redis
@@ -51,12 +68,17 @@ class ProductStockRedis:
             
             # Verifica se há estoque suficiente para atender ao pedido
             if current_stock < order_amount:
-                print_update(f"FALHA DE VENDA: Pedido de {order_amount} unids para o produto {i + 1} falhou. Estoque: {current_stock}", self.entity_name)
+                self.failed_orders += 1
+                self.lost_sales += order_amount
+                print_update(f"FALHA DE VENDA: Pedido de {order_amount} unids para o produto {i + 1} falhou. Estoque: {current_stock}", self.entity_name, WARNING)
             else:
                 self.r.decrby(key, order_amount)
                 sent_orders[i] = order_amount
+                self.units_sold += order_amount
                 print_update(f"VENDA: Pedido de {order_amount} unids para o produto {i + 1} atendido com sucesso.", self.entity_name)
 
+        publish_dense_change(self.r, PRODUCTS_LOCATION, sent_orders, sign=-1)
+
         # Após simular todas as vendas, informa às fábricas o novo status do estoque.
         self.publish_stock_status_to_factories()
         
@@ -66,30 +88,59 @@ class ProductStockRedis:
         current_stock_buffer = [int(self.r.get(f"product:{i}") or 0) for i in range(NUM_PRODUCTS)]
         
         # Formata a mensagem e publica no canal da fábrica.
-        payload = list_to_string(current_stock_buffer)
-        msg = f"update_factory/{payload}"
+        msg = encode_message("update_factory", parts=current_stock_buffer)
         
         self.r.publish("channel:factory", msg)
         print_update(f"Enviando atualização de estoque para fábricas: {current_stock_buffer}", self.entity_name)
 
 
+    def get_state(self):
+        """Estado em memória para um checkpoint (ver checkpoint.py), inclusive o gerador da demanda."""
+        return {
+            'rng': self.rng.getstate(),
+            'units_sold': self.units_sold,
+            'failed_orders': self.failed_orders,
+            'lost_sales': self.lost_sales,
+        }
+
+    def set_state(self, state):
+        version, internal, gauss_next = state['rng']
+        self.rng.setstate((version, tuple(internal), gauss_next))
+        self.units_sold = state['units_sold']
+        self.failed_orders = state['failed_orders']
+        self.lost_sales = state['lost_sales']
+
+    def metrics(self):
+        """Amostras para o endpoint de métricas (ver metrics.py): (nome, rótulos, valor)."""
+        return [
+            ('plant_units_sold_total', {}, self.units_sold),
+            ('plant_failed_orders_total', {}, self.failed_orders),
+            ('plant_lost_sales_total', {}, self.lost_sales),
+        ]
+
+    def handle_message(self, data):
+        """Trata uma mensagem recebida no canal do estoque de produtos."""
+        msg = decode_message(data)
+        # Argumentos esperados: (product_idx, line_id, factory_id, qty)
+        with self.tracer.span(msg.command, msg.trace):
+            if msg.command == "receive_products":
+                self.receive_products(*msg.args)
+
     def listen(self):
         """Ouve o canal 'channel:product_stock' por notificações de novas produções."""
         pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:product_stock")
-        print_update("Ouvindo o canal 'channel:product_stock' por novos produtos...", self.entity_name)
+        pubsub.subscribe(self.channel)
+        print_update(f"Ouvindo o canal '{self.channel}' por novos produtos...", self.entity_name)
         
         for message in pubsub.listen():
             if message['type'] == 'message':
-                parts = message['data'].split("/")
-                # Formato esperado: "receive_products/{product_idx}/{line_id}/{factory_id}/{qty}"
-                if parts[0] == "receive_products":
-                    self.receive_products(parts[1], parts[2], parts[3], parts[4])
+                self.handle_message(message['data'])
 
 def main():
     """Função principal para iniciar o processo de estoque de produtos."""
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        # Com mensagens binárias (ver codec.py) as respostas ficam em bytes
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=(WIRE_FORMAT == 'text'))
         r.ping()
         print_update("Conexão com Redis bem-sucedida.", 'product-stock-main')
     except redis.exceptions.ConnectionError as e:
@@ -97,6 +148,14 @@ def main():
         return
 
     ps = ProductStockRedis(r)
+    if load_entity_states(r, [ps]):
+        print_update("Estado restaurado do checkpoint.", ps.entity_name)
+    start_metrics_server([ps], r)
+
+    if DAY_CLOCK == 'lockstep':
+        run_lockstep(r, ps.entity_name, {'product_stock': ps.simulate_daily_customer_orders},
+                     lambda channel, data: ps.handle_message(data), channels=[ps.channel], entities=[ps])
+        return
     
     listener_thread = threading.Thread(target=ps.listen, daemon=True)
     listener_thread.start()
@@ -1,31 +1,37 @@
 import random
+from utils import NUM_PRODUCTS, NUM_PARTS, BASE_KIT_SIZE, PRODUCTS_AND_PARTS_FILE
 
+# Peças de variação de cada produto; com mais de 5 produtos a lista se repete
 parts_number_by_product = [20, 22, 25, 30, 33]
 
 def make_parts_list():
 
     parts = []
 
-    for i in range(44, 101):
+    # Peças de variação (1-indexadas): as que vêm depois do kit base
+    for i in range(BASE_KIT_SIZE + 1, NUM_PARTS + 1):
         parts.append(i)
 
     return parts
 
-with open("products_and_parts.txt", "w") as file:
-
-    for i, parts_number in enumerate(parts_number_by_product):
-        string = ""
-        # file.write('product ' + str(i) + ' with ' + str(parts_number) + ' parts' + '\n')
-        parts = make_parts_list()
-        random.shuffle(parts)
-        for i in range(parts_number):
-            random_pos = parts.pop()
-            # file.write(str(random_pos)) + " "
-            string += str(random_pos) + ";"
-
-        string = string[:-1]
-        # string[-1] = "]"
-        file.write(string)
-        file.write('\n')
-
-
+def generate_products_and_parts(path=PRODUCTS_AND_PARTS_FILE):
+    with open(path, "w") as file:
+
+        for i in range(NUM_PRODUCTS):
+            parts_number = parts_number_by_product[i % len(parts_number_by_product)]
+            string = ""
+            # file.write('product ' + str(i) + ' with ' + str(parts_number) + ' parts' + '\n')
+            parts = make_parts_list()
+            random.shuffle(parts)
+            for i in range(min(parts_number, len(parts))):
+                random_pos = parts.pop()
+                # file.write(str(random_pos)) + " "
+                string += str(random_pos) + ";"
+
+            string = string[:-1]
+            # string[-1] = "]"
+            file.write(string)
+            file.write('\n')
+
+if __name__ == "__main__":
+    generate_products_and_parts()
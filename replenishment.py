@@ -0,0 +1,88 @@
+# replenishment.py
+
+import threading
+import numpy as np
+from utils import (
+    BATCH_SIZE,
+    PARTS_TO_SEND_AMOUNT_WAREHOUSE,
+    LINE_REORDER_DAYS,
+    LINE_TARGET_DAYS,
+    DEMAND_SMOOTHING,
+    DEMAND_MIN_DAILY
+)
+
+# Modos de reposição das linhas (utils.LINE_REPLENISHMENT)
+REPLENISHMENT_MODES = ('demanda', 'kanban')
+
+
+def check_replenishment_mode(mode):
+    if mode not in REPLENISHMENT_MODES:
+        raise ValueError(f"Modo de reposição desconhecido: '{mode}'. Use um de {list(REPLENISHMENT_MODES)}.")
+    return mode
+
+
+class DemandForecast:
+    """
+    Consumo previsto de uma ou mais linhas: média móvel exponencial das
+    unidades ordenadas por dia de cada produto (n_linhas x NUM_PRODUCTS).
+    Antes das primeiras ordens a previsão é de um lote por dia dividido
+    igualmente entre os produtos, para a linha começar com peças de todos.
+    """
+
+    def __init__(self, n_lines, bom, smoothing=DEMAND_SMOOTHING):
+        # bom: matriz de incidência produto x peça (ver vector_stock.build_consumption_matrix)
+        self.bom = np.asarray(bom, dtype=np.int64)
+        self.smoothing = smoothing
+        self.daily = np.full((n_lines, self.bom.shape[0]), BATCH_SIZE / self.bom.shape[0])
+        self.today = np.zeros_like(self.daily)
+        # No modo relogio as ordens chegam no listener da linha e o dia fecha na rotina diária
+        self.lock = threading.Lock()
+
+    def record(self, row, product_idx, qty):
+        """Soma uma ordem recebida hoje pela linha `row`."""
+        with self.lock:
+            self.today[row, product_idx] += qty
+
+    def close_day(self):
+        """Fecha o dia: incorpora as ordens de hoje à média e zera o acumulado."""
+        with self.lock:
+            self.daily += self.smoothing * (self.today - self.daily)
+            self.today[:] = 0
+
+    def get_state(self):
+        with self.lock:
+            return {'daily': self.daily.tolist(), 'today': self.today.tolist()}
+
+    def set_state(self, state):
+        with self.lock:
+            self.daily[:] = state['daily']
+            self.today[:] = state['today']
+
+    def part_rates(self):
+        """Consumo previsto de cada peça por dia (n_linhas x NUM_PARTS)."""
+        with self.lock:
+            daily = np.where(self.daily >= DEMAND_MIN_DAILY, self.daily, 0.0)
+        # Soma explícita em vez de @: o resultado de uma linha não depende de quantas são calculadas juntas
+        return (daily[:, :, None] * self.bom[None, :, :]).sum(axis=1)
+
+
+def replenishment_quantities(stock, rates, reorder_days=LINE_REORDER_DAYS, target_days=LINE_TARGET_DAYS):
+    """
+    Quantidade a pedir de cada peça (mesmo formato de `stock`): só as peças
+    abaixo do ponto de pedido, o suficiente para voltarem ao nível-alvo.
+    Peças sem consumo previsto nunca são pedidas.
+    """
+    stock = np.asarray(stock, dtype=np.int64)
+    reorder_point = np.ceil(rates * reorder_days).astype(np.int64)
+    target = np.ceil(rates * target_days).astype(np.int64)
+    return np.where(stock < reorder_point, np.maximum(target - stock, 0), 0)
+
+def requested_quantities(msg):
+    """
+    Quantidade pedida de cada peça em um pedido de linha: 'request_parts' já
+    traz as quantidades; 'send_parts' (modo 'kanban') traz flags, e cada peça
+    marcada vale PARTS_TO_SEND_AMOUNT_WAREHOUSE.
+    """
+    if msg.command == 'request_parts':
+        return list(msg.parts)
+    return [PARTS_TO_SEND_AMOUNT_WAREHOUSE if flag else 0 for flag in msg.parts]
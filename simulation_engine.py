@@ -0,0 +1,334 @@
+# simulation_engine.py
+
+import heapq
+import itertools
+import random
+import sys
+import time
+from factory_redis import FactoryRedis
+from line_redis import LineRedis
+from warehouse_redis import WarehouseRedis
+from product_stock_redis import ProductStockRedis
+from supplier_redis import SupplierRedis
+from init_redis import populate_initial_stock
+from memory_redis import InMemoryRedis
+from stock_storage import make_stock_storage
+from vector_stock import VectorizedLines
+from checkpoint import save_entity_states, load_entity_states, write_checkpoint, restore_checkpoint, restore_products_file
+from event_log import EventRecorder, RecordingRedis
+from change_feed import set_change_feed_enabled
+from tracing import set_tracing_enabled
+from metrics import set_metrics_enabled
+from utils import (
+    print_update,
+    set_output_enabled,
+    DAYS_MAX,
+    NUM_PRODUCTS,
+    WIRE_FORMAT,
+    PLANT_FACTORIES
+)
+
+# Topologia padrão: a do arquivo de topologia (ver topology.py), ou a planta original sem ele.
+# Cada item é (tipo_de_fabrica, factory_id, numero_de_linhas).
+DEFAULT_FACTORIES = PLANT_FACTORIES
+
+# Ordem dos eventos dentro de um mesmo instante do relógio virtual:
+# mensagens pendentes primeiro e depois as rotinas diárias na ordem da planta.
+PRIORITY_MESSAGE = 0
+PRIORITY_PRODUCT_STOCK = 1
+PRIORITY_FACTORY = 2
+PRIORITY_LINE = 3
+PRIORITY_WAREHOUSE = 4
+PRIORITY_SAMPLE = 5
+
+
+class EventScheduler:
+    """Fila de prioridade de eventos com um relógio virtual medido em dias."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.processed = 0
+        self._queue = []
+        self._seq = itertools.count()
+
+    def schedule(self, at, priority, callback, *args):
+        """Agenda `callback(*args)` para o instante `at`; empates saem por prioridade e ordem de chegada."""
+        heapq.heappush(self._queue, (at, priority, next(self._seq), callback, args))
+
+    def run(self, until=None):
+        """Processa eventos em ordem até a fila esvaziar ou o relógio passar de `until`."""
+        queue = self._queue
+        while queue:
+            if until is not None and queue[0][0] > until:
+                break
+            at, _, _, callback, args = heapq.heappop(queue)
+            self.now = at
+            callback(*args)
+            self.processed += 1
+
+
+class SimulationEngine:
+    """
+    Roda a planta inteira em um único processo, sem Redis e sem sleeps.
+    As classes de entidade são as mesmas dos processos distribuídos; o que muda
+    é o cliente (InMemoryRedis) e a entrega das mensagens, que vira evento agendado.
+    """
+
+    def __init__(self, factories=DEFAULT_FACTORIES, seed=None, message_latency=0.0, vectorized_lines=False,
+                 stock_profile='uniforme', event_log=None):
+        self.scheduler = EventScheduler()
+        # Nenhum dashboard escuta o broker em memória; as mensagens do change feed só custariam tempo
+        set_change_feed_enabled(False)
+        # O tempo do motor é simulado: latências de relógio real não diriam nada
+        set_tracing_enabled(False)
+        # Nem métricas: nenhum endpoint é servido pelo motor
+        set_metrics_enabled(False)
+        if event_log is not None and message_latency:
+            # O log guarda as mensagens na ordem de publicação, que só é a de entrega sem latência
+            raise ValueError("A gravação do log de eventos exige message_latency = 0.")
+        self.message_latency = message_latency
+        self.entity_name = 'simulation-engine'
+        # Dias já simulados (de execuções anteriores ou de um checkpoint restaurado)
+        self.day = 0
+        self.messages = 0
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.subscribers = {}
+        # Totais de estoque amostrados ao fim de cada dia: (armazém, linhas, produtos)
+        self.daily_inventory = []
+        self.r = InMemoryRedis(broker=self.publish)
+        self.storage = make_stock_storage(self.r)
+        # Perfil do estoque inicial (ver init_redis.stock_plan): 'uniforme' ou 'regime'
+        self.stock_profile = stock_profile
+        populate_initial_stock(self.r, stock_profile, factories)
+        self.factory_specs = factories
+        # Log de eventos (ver event_log.py): cada entidade publica por um cliente que grava em seu nome
+        self.recorder = EventRecorder(event_log, lambda: self.scheduler.now) if event_log is not None else None
+        self.checkpoint_path = None
+
+        self.supplier = self._entity(SupplierRedis)
+        # O broker em memória só entrega publish; os pedidos usam o transporte pub/sub.
+        self.warehouse = self._entity(lambda r: WarehouseRedis(r, order_transport='pubsub'))
+        self.product_stock = self._entity(lambda r: ProductStockRedis(r, rng=self.rng))
+        self.factories = [self._entity(lambda r, kind=kind, f_id=f_id, n=n: FactoryRedis(kind, f_id, n, r))
+                          for kind, f_id, n in factories]
+        line_keys = [(f_id, line_id) for _, f_id, n in factories for line_id in range(1, n + 1)]
+
+        # Linhas: uma instância de LineRedis por linha, ou todas em uma única matriz NumPy.
+        self.lines = []
+        self.vector_lines = None
+        if vectorized_lines:
+            self.vector_lines = self._entity(lambda r: VectorizedLines(line_keys, r, self._schedule_after_messages))
+            # Estoque inicial das linhas, se o perfil o gravou
+            self.vector_lines.matrix.load(self.storage)
+            for channel in self.vector_lines.channels:
+                self.subscribe(channel, self.vector_lines.handler_for(channel))
+        else:
+            self.lines = [self._entity(lambda r, f_id=f_id, line_id=line_id: LineRedis(line_id, f_id, r, order_transport='pubsub'))
+                          for f_id, line_id in line_keys]
+        self._line_locations = [f"line:{f}:{l}" for f, l in line_keys]
+
+        for entity in [self.supplier, self.warehouse, self.product_stock, *self.factories, *self.lines]:
+            self.subscribe(entity.channel, entity.handle_message)
+
+    def _entity(self, create):
+        """Cria uma entidade com `create(cliente)`; com o log de eventos, o cliente grava em nome dela."""
+        if self.recorder is None:
+            return create(self.r)
+        client = RecordingRedis(self.r, self.recorder)
+        entity = create(client)
+        client.sender = entity.entity_name
+        return entity
+
+    def _daily_step(self, entity, phase, step):
+        """O passo diário da entidade; com o log de eventos, gravado antes de rodar (ver event_log.replay)."""
+        if self.recorder is None:
+            return step
+        def recorded_step():
+            self.recorder.step(entity.entity_name, phase)
+            step()
+        return recorded_step
+
+    def subscribe(self, channel, handler):
+        self.subscribers.setdefault(channel, []).append(handler)
+
+    def publish(self, channel, message):
+        """Entrega a mensagem a cada assinante como um evento no relógio virtual."""
+        handlers = self.subscribers.get(channel, ())
+        at = self.scheduler.now + self.message_latency
+        for handler in handlers:
+            self.scheduler.schedule(at, PRIORITY_MESSAGE, handler, message)
+        self.messages += 1
+        return len(handlers)
+
+    def _schedule_after_messages(self, callback):
+        """Agenda o callback para o instante atual, depois das mensagens já enfileiradas."""
+        self.scheduler.schedule(self.scheduler.now, PRIORITY_MESSAGE, callback)
+
+    def _every_day(self, first, last, priority, step):
+        """Agenda `step` para rodar uma vez por dia, do dia `first` até `last`."""
+        def tick():
+            step()
+            if self.scheduler.now + 1 <= last:
+                self.scheduler.schedule(self.scheduler.now + 1, priority, tick)
+        self.scheduler.schedule(first, priority, tick)
+
+    def _warehouse_day(self):
+        self.warehouse.process_order_queue()
+        self.warehouse.check_and_order_parts_from_supplier()
+
+    def _sample_inventory(self):
+        """Registra os totais de estoque ao fim do dia."""
+        if self.vector_lines is not None:
+            line_total = int(self.vector_lines.matrix.stock.sum())
+        else:
+            # Linhas com estoque em memória gravam as mudanças do dia antes da leitura
+            for line in self.lines:
+                line.flush_stock()
+            line_total = sum(map(sum, self.storage.get_all_many(self._line_locations)))
+        self.daily_inventory.append((
+            sum(self.storage.get_all('warehouse')),
+            line_total,
+            sum(int(v or 0) for v in self.r.mget([f"product:{i}" for i in range(NUM_PRODUCTS)])),
+        ))
+
+    def _stateful_entities(self):
+        entities = [self, self.warehouse, self.product_stock, *self.factories, *self.lines]
+        return entities + [self.vector_lines] if self.vector_lines is not None else entities
+
+    def get_state(self):
+        return {
+            'day': self.day,
+            'vectorized': self.vector_lines is not None,
+            'messages': self.messages,
+            'events': self.scheduler.processed,
+            'daily_inventory': self.daily_inventory,
+        }
+
+    def set_state(self, state):
+        if state['vectorized'] != (self.vector_lines is not None):
+            mode = 'vetorizado' if state['vectorized'] else 'linhas'
+            raise ValueError(f"Checkpoint do modo '{mode}': continue a simulação no mesmo modo.")
+        self.day = state['day']
+        self.scheduler.now = float(self.day)
+        self.messages = state['messages']
+        self.scheduler.processed = state['events']
+        self.daily_inventory = [tuple(totals) for totals in state['daily_inventory']]
+
+    def save_checkpoint(self, path):
+        """Grava o estado da planta ao fim do último dia simulado (ver checkpoint.py)."""
+        if self.scheduler._queue:
+            raise ValueError("Checkpoint só entre dois dias, sem eventos pendentes.")
+        save_entity_states(self.r, self._stateful_entities())
+        return write_checkpoint(self.r, path, self.day)
+
+    def restore_checkpoint(self, path):
+        """Substitui o estado da planta pelo do checkpoint; run() continua do dia seguinte."""
+        if restore_products_file(path):
+            # As linhas deste motor já leram o arquivo antigo
+            raise ValueError(f"{path} tinha outro arquivo de produtos, agora restaurado: crie o motor de novo.")
+        day = restore_checkpoint(self.r, path)
+        load_entity_states(self.r, self._stateful_entities())
+        self.checkpoint_path = path
+        return day
+
+    def run(self, days=DAYS_MAX):
+        """Simula mais `days` dias e devolve um resumo da execução (acumulado desde o dia 1)."""
+        first, last = self.day + 1, self.day + days
+        if self.recorder is not None:
+            self.recorder.meta({
+                'seed': self.seed,
+                'factories': [list(factory) for factory in self.factory_specs],
+                'vectorized': self.vector_lines is not None,
+                'stock_profile': self.stock_profile,
+                'checkpoint': self.checkpoint_path,
+                'wire_format': WIRE_FORMAT,
+                'first_day': first,
+            })
+        step = self._daily_step
+        self._every_day(first, last, PRIORITY_PRODUCT_STOCK,
+                        step(self.product_stock, 'product_stock', self.product_stock.simulate_daily_customer_orders))
+        for factory in self.factories:
+            self._every_day(first, last, PRIORITY_FACTORY, step(factory, 'factory', factory.order_daily_batch))
+        for line in self.lines:
+            self._every_day(first, last, PRIORITY_LINE, step(line, 'line', line.check_and_order_parts))
+        if self.vector_lines is not None:
+            self._every_day(first, last, PRIORITY_LINE,
+                            step(self.vector_lines, 'line', self.vector_lines.check_and_order_parts))
+        self._every_day(first, last, PRIORITY_WAREHOUSE, step(self.warehouse, 'warehouse', self._warehouse_day))
+        self._every_day(first, last, PRIORITY_SAMPLE, self._sample_inventory)
+
+        start = time.perf_counter()
+        self.scheduler.run()
+        elapsed = time.perf_counter() - start
+        self.day = last
+        if self.recorder is not None:
+            self.recorder.flush()
+
+        warehouse_totals, line_totals, product_totals = zip(*self.daily_inventory) if self.daily_inventory else ((0,), (0,), (0,))
+        line_stops = self.vector_lines.line_stops if self.vector_lines is not None else sum(l.line_stops for l in self.lines)
+        return {
+            'days': self.day,
+            'events': self.scheduler.processed,
+            'messages': self.messages,
+            'wall_seconds': elapsed,
+            'product_stock': [int(self.r.get(f"product:{i}") or 0) for i in range(NUM_PRODUCTS)],
+            'units_sold': self.product_stock.units_sold,
+            'failed_orders': self.product_stock.failed_orders,
+            'lost_sales': self.product_stock.lost_sales,
+            'line_stops': line_stops,
+            'warehouse_stockouts': self.warehouse.stockouts,
+            'warehouse_inventory_mean': sum(warehouse_totals) / len(warehouse_totals),
+            'warehouse_inventory_min': min(warehouse_totals),
+            'line_inventory_mean': sum(line_totals) / len(line_totals),
+            'line_inventory_max': max(line_totals),
+            'product_inventory_mean': sum(product_totals) / len(product_totals),
+        }
+
+
+def main():
+    # Opções depois dos posicionais: carregar:arquivo e salvar:arquivo (checkpoint.py) e gravar:arquivo (event_log.py)
+    options = dict(arg.split(':', 1) for arg in sys.argv[1:] if ':' in arg)
+    args = [arg for arg in sys.argv[1:] if ':' not in arg]
+    if (len(args) > 3 or (len(args) == 3 and args[2] not in ('linhas', 'vetorizado'))
+            or set(options) - {'carregar', 'salvar', 'gravar'}):
+        print("Uso: python3 simulation_engine.py [dias] [seed] [linhas|vetorizado] "
+              "[carregar:arquivo.ckpt] [salvar:arquivo.ckpt] [gravar:arquivo.evlog]")
+        sys.exit(1)
+
+    days = int(args[0]) if len(args) > 0 else DAYS_MAX
+    seed = int(args[1]) if len(args) > 1 else None
+    vectorized = len(args) == 3 and args[2] == 'vetorizado'
+
+    # Sem isso, cada dia simulado gravaria dezenas de banners em output/*.txt.
+    set_output_enabled(False)
+    try:
+        if 'carregar' in options:
+            # O arquivo de produtos do checkpoint precisa estar no lugar antes de as linhas o lerem
+            restore_products_file(options['carregar'])
+        engine = SimulationEngine(seed=seed, vectorized_lines=vectorized, event_log=options.get('gravar'))
+        if 'carregar' in options:
+            # A demanda continua do gerador gravado no checkpoint; a seed não é usada
+            engine.restore_checkpoint(options['carregar'])
+        summary = engine.run(days)
+        if 'salvar' in options:
+            engine.save_checkpoint(options['salvar'])
+    except (OSError, ValueError) as e:
+        set_output_enabled(True)
+        print(f"ERRO: {e}")
+        sys.exit(1)
+    set_output_enabled(True)
+    if engine.recorder is not None:
+        engine.recorder.close()
+        print_update(f"Log de eventos gravado em {options['gravar']}: {engine.recorder.events} eventos.",
+                     'simulation-engine')
+
+    print_update(
+        f"Simulação de {summary['days']} dias concluída em {summary['wall_seconds']:.2f}s "
+        f"({summary['events']} eventos, {summary['messages']} mensagens). "
+        f"Estoque final de produtos: {summary['product_stock']}",
+        'simulation-engine'
+    )
+
+if __name__ == "__main__":
+    main()
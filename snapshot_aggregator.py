@@ -0,0 +1,142 @@
+# snapshot_aggregator.py
+
+import json
+import sys
+import time
+import redis
+from stock_storage import make_stock_storage
+from utils import (
+    print_update,
+    REDIS_HOST,
+    REDIS_PORT,
+    NUM_PARTS,
+    NUM_PRODUCTS,
+    SNAPSHOT_INTERVAL,
+    RED_ALERT_LINE,
+    YELLOW_ALERT_LINE,
+    RED_ALERT_WAREHOUSE,
+    YELLOW_ALERT_WAREHOUSE,
+    RED_ALERT_PRODUCT_STOCK
+)
+
+# Pedido para as linhas com estoque em memória (LINE_STOCK_CACHE = 'write_behind') gravarem as
+# mudanças pendentes; publicado a cada foto, para a seguinte refletir o estoque atual
+STOCK_FLUSH_CHANNEL = "control:stock_flush"
+
+# Conjunto com o local de estoque ('line:{f}:{l}') de cada linha ativa; cada LineRedis se registra nele
+LINES_REGISTRY_KEY = "plant:lines"
+# Foto da planta inteira (JSON compacto) e seu número de versão
+SNAPSHOT_KEY = "dashboard:snapshot"
+SNAPSHOT_VERSION_KEY = "dashboard:snapshot:version"
+# Versão do formato da foto; mude ao alterar os campos
+SNAPSHOT_SCHEMA = 2
+# Contador do change feed (change_feed.py): cada mudança anunciada leva o próximo número,
+# e a foto guarda o último já gravado quando foi montada
+CHANGE_FEED_SEQ_KEY = "dashboard:changes:seq"
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def _line_sort_key(location):
+    _, factory_id, line_id = location.split(':')
+    return int(factory_id), int(line_id)
+
+def registered_lines(r):
+    """Locais de estoque das linhas registradas, ordenados por fábrica e linha."""
+    return sorted((_text(m) for m in r.smembers(LINES_REGISTRY_KEY)), key=_line_sort_key)
+
+def read_snapshot(r):
+    """Devolve a última foto publicada (dict) ou None se o agregador ainda não rodou."""
+    data = r.get(SNAPSHOT_KEY)
+    return json.loads(data) if data else None
+
+def read_snapshot_version(r):
+    return int(r.get(SNAPSHOT_VERSION_KEY) or 0)
+
+def read_feed_seq(r):
+    """Sequência da última mudança anunciada no change feed (0: nenhuma)."""
+    return int(r.get(CHANGE_FEED_SEQ_KEY) or 0)
+
+
+class SnapshotAggregator:
+    """
+    Monta, a cada intervalo, uma única foto compacta da planta (almoxarifado,
+    produtos acabados e todas as linhas registradas) com três round trips de
+    leitura, qualquer que seja o número de linhas, e a publica com um número
+    de versão e a posição do change feed em que foi tirada. O dashboard
+    (change_feed.LivePlantState) parte dessa foto e volta a ela
+    periodicamente, reaplicando por cima os deltas mais novos que ela; entre
+    as fotos, aplica os deltas do change feed. O custo no Redis não cresce com
+    o número de sessões abertas.
+    """
+
+    def __init__(self, redis_client):
+        self.r = redis_client
+        self.entity_name = 'snapshot-aggregator'
+        self.stock = make_stock_storage(self.r)
+        self._last_payload = None
+
+    def build_snapshot(self):
+        # Lida antes dos estoques: toda mudança até essa sequência já está gravada (as entidades
+        # gravam e depois anunciam). Uma gravada entre as duas leituras entra na foto e também
+        # é reaplicada por cima dela, até a foto seguinte.
+        feed_seq = read_feed_seq(self.r)
+        lines = registered_lines(self.r)
+        products = [int(v or 0) for v in self.r.mget([f"product:{i}" for i in range(NUM_PRODUCTS)])]
+        warehouse, *line_stocks = self.stock.get_all_many(['warehouse', *lines])
+        return {
+            'schema': SNAPSHOT_SCHEMA,
+            'num_parts': NUM_PARTS,
+            'limits': {
+                'warehouse': [RED_ALERT_WAREHOUSE, YELLOW_ALERT_WAREHOUSE],
+                'line': [RED_ALERT_LINE, YELLOW_ALERT_LINE],
+                'product': [RED_ALERT_PRODUCT_STOCK, RED_ALERT_PRODUCT_STOCK * 2],
+            },
+            'warehouse': warehouse,
+            'products': products,
+            'lines': lines,
+            'line_stocks': line_stocks,
+            'feed_seq': feed_seq,
+        }
+
+    def publish_snapshot(self):
+        """Publica uma nova versão só se algo mudou desde a última; devolve a versão atual."""
+        snapshot = self.build_snapshot()
+        payload = json.dumps(snapshot, separators=(',', ':'))
+        if payload == self._last_payload:
+            return read_snapshot_version(self.r)
+
+        # Foto e versão gravadas juntas (MULTI): quem lê a versão nova sempre encontra a foto nova
+        version = read_snapshot_version(self.r) + 1
+        snapshot['ts'] = time.time()
+        snapshot['version'] = version
+        pipe = self.r.pipeline(transaction=True)
+        pipe.set(SNAPSHOT_KEY, json.dumps(snapshot, separators=(',', ':')))
+        pipe.set(SNAPSHOT_VERSION_KEY, version)
+        pipe.execute()
+        self._last_payload = payload
+        return version
+
+    def run(self, interval=SNAPSHOT_INTERVAL):
+        print_update(f"Publicando a foto da planta em '{SNAPSHOT_KEY}' a cada {interval}s.", self.entity_name)
+        while True:
+            self.publish_snapshot()
+            # As linhas com estoque em memória gravam até a próxima foto
+            self.r.publish(STOCK_FLUSH_CHANNEL, "FLUSH")
+            time.sleep(interval)
+
+def main():
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else SNAPSHOT_INTERVAL
+    try:
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        r.ping()
+        print_update("Conexão com Redis bem-sucedida.", 'snapshot-aggregator-main')
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+
+    SnapshotAggregator(r).run(interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+# stock_history.py
+
+import csv
+import struct
+import os
+import sys
+import numpy as np
+import redis
+from stock_storage import make_stock_storage
+from snapshot_aggregator import registered_lines
+from change_feed import PRODUCTS_LOCATION
+from tick_coordinator import (
+    tick_channel,
+    register_participant,
+    ack_tick,
+    parse_tick,
+    DAY_CHANNEL,
+    TICK_SAVE,
+    TICK_REGISTER
+)
+from utils import (
+    print_update,
+    REDIS_HOST,
+    REDIS_PORT,
+    NUM_PARTS,
+    NUM_PRODUCTS,
+    DAY_CLOCK,
+    HISTORY_TIERS
+)
+
+# Histórico diário do estoque de cada local ('warehouse', 'line:{f}:{l}' e PRODUCTS_LOCATION),
+# guardado em buffers circulares de tamanho fixo, um por nível de resolução (HISTORY_TIERS).
+#   history:{local}:{nível}  string com `slots` fatias de int32, uma por dia/balde
+#   history:day              último dia registrado
+# O nível k guarda a média de cada `passo_k` dias, calculada dos últimos baldes do nível k-1
+# quando o balde fecha; a memória não depende de quantos dias a simulação roda.
+HISTORY_DAY_KEY = "history:day"
+
+
+def _slot_format(width):
+    return struct.Struct(f'!{width}i')
+
+
+class StockHistory:
+    """Buffers circulares multirresolução do estoque por local, guardados no Redis."""
+
+    def __init__(self, redis_client, tiers=HISTORY_TIERS):
+        for (step, _), (next_step, _) in zip(tiers, tiers[1:]):
+            if next_step % step:
+                raise ValueError(f"O passo {next_step} não é múltiplo do passo {step} em HISTORY_TIERS.")
+        for (step, slots), (next_step, _) in zip(tiers, tiers[1:]):
+            if slots < next_step // step:
+                raise ValueError(f"O nível de passo {step} precisa de pelo menos {next_step // step} baldes.")
+        self.r = redis_client
+        self.tiers = tiers
+
+    def _key(self, location, tier):
+        return f"history:{location}:{tier}"
+
+    @staticmethod
+    def _width(location):
+        return NUM_PRODUCTS if location == PRODUCTS_LOCATION else NUM_PARTS
+
+    def last_day(self):
+        return int(self.r.get(HISTORY_DAY_KEY) or 0)
+
+    def record_day(self, day, values_by_location):
+        """
+        Grava o estoque do dia `day` (1, 2, ...) de cada local em um único round
+        trip. Nos dias em que baldes mais grossos fecham, lê os baldes finos que
+        eles cobrem e grava as médias.
+        """
+        pipe = self.r.pipeline(transaction=False)
+        step0, slots0 = self.tiers[0]
+        for location, values in values_by_location.items():
+            if day % step0 == 0:
+                fmt = _slot_format(self._width(location))
+                pipe.setrange(self._key(location, 0), ((day // step0) % slots0) * fmt.size, fmt.pack(*values))
+        pipe.set(HISTORY_DAY_KEY, day)
+        pipe.execute()
+
+        closing = [k for k in range(1, len(self.tiers)) if day % self.tiers[k][0] == 0]
+        if not closing:
+            return
+
+        # Cada balde grosso é a média dos baldes do nível anterior que ele cobre
+        for k in closing:
+            step, slots = self.tiers[k]
+            prev_step, _ = self.tiers[k - 1]
+            first_day = day - step + prev_step
+            pipe = self.r.pipeline(transaction=False)
+            for location in values_by_location:
+                _, rows = self._read_tier(location, k - 1, first_day, day, day)
+                fmt = _slot_format(self._width(location))
+                pipe.setrange(self._key(location, k), ((day // step) % slots) * fmt.size,
+                              fmt.pack(*np.rint(rows.mean(axis=0)).astype(np.int64).tolist()))
+            pipe.execute()
+
+    def _read_tier(self, location, tier, start_day, end_day, last_day):
+        """Dias (fim de cada balde) e matriz de valores do nível `tier` entre start_day e end_day."""
+        step, slots = self.tiers[tier]
+        last = last_day // step
+        first = max(1, -(-start_day // step), last - slots + 1)
+        end = min(end_day // step, last)
+        width = self._width(location)
+        if end < first:
+            return [], np.zeros((0, width), dtype=np.int64)
+
+        # Intervalo contíguo de baldes; no máximo duas leituras se der a volta no anel
+        fmt = _slot_format(width)
+        key = self._key(location, tier)
+        pipe = self.r.pipeline(transaction=False)
+        bucket = first
+        while bucket <= end:
+            slot = bucket % slots
+            count = min(end - bucket + 1, slots - slot)
+            pipe.getrange(key, slot * fmt.size, (slot + count) * fmt.size - 1)
+            bucket += count
+        data = b"".join(pipe.execute())
+
+        values = np.zeros((end - first + 1, width), dtype=np.int64)
+        if data:
+            flat = np.frombuffer(data, dtype='>i4').astype(np.int64)
+            values.flat[:len(flat)] = flat
+        days = [b * step for b in range(first, end + 1)]
+        return days, values
+
+    def query(self, location, start_day=1, end_day=None, max_points=None):
+        """
+        Histórico de um local entre dois dias: (dias, matriz dias x peças). Usa o
+        nível mais fino que ainda guarda start_day e que cabe em `max_points`.
+        """
+        last = self.last_day()
+        end_day = last if end_day is None else min(end_day, last)
+        for tier, (step, slots) in enumerate(self.tiers):
+            coarsest = tier == len(self.tiers) - 1
+            still_kept = -(-start_day // step) >= last // step - slots + 1
+            points = (end_day - start_day) // step + 1
+            if coarsest or (still_kept and (max_points is None or points <= max_points)):
+                return self._read_tier(location, tier, start_day, end_day, last)
+
+    def query_totals(self, locations, start_day=1, end_day=None, max_points=None):
+        """Estoque total (soma das peças) de cada local: {local: (dias, totais)}."""
+        result = {}
+        for location in locations:
+            days, values = self.query(location, start_day, end_day, max_points)
+            result[location] = (days, values.sum(axis=1).tolist())
+        return result
+
+    def export_csv(self, path, locations, start_day=1, end_day=None):
+        """
+        Exporta o histórico (dia, local, uma coluna por item) para CSV. Peças e
+        produtos têm larguras diferentes: os locais de peças vão para `path` e
+        os produtos acabados para `{path}_produtos.csv`. Devolve os arquivos gravados.
+        """
+        root, ext = os.path.splitext(path)
+        groups = {
+            path: ('item', [loc for loc in locations if loc != PRODUCTS_LOCATION]),
+            f"{root}_produtos{ext or '.csv'}": ('produto', [loc for loc in locations if loc == PRODUCTS_LOCATION]),
+        }
+        written = []
+        for group_path, (column, group) in groups.items():
+            if not group:
+                continue
+            with open(group_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['dia', 'local', *(f'{column}_{i + 1}' for i in range(self._width(group[0])))])
+                for location in group:
+                    days, values = self.query(location, start_day, end_day)
+                    for day, row in zip(days, values.tolist()):
+                        writer.writerow([day, location, *row])
+            written.append(group_path)
+        return written
+
+    def memory_bytes(self, locations):
+        """Tamanho máximo ocupado pelo histórico desses locais, fixo para qualquer duração."""
+        return sum(slots * _slot_format(self._width(loc)).size for loc in locations for _, slots in self.tiers)
+
+
+def plant_locations(r):
+    return ['warehouse', PRODUCTS_LOCATION, *registered_lines(r)]
+
+def read_plant(r, storage, locations):
+    """Estoque atual de todos os locais, em dois round trips."""
+    products = [int(v or 0) for v in r.mget([f"product:{i}" for i in range(NUM_PRODUCTS)])]
+    part_locations = [loc for loc in locations if loc != PRODUCTS_LOCATION]
+    values = dict(zip(part_locations, storage.get_all_many(part_locations)))
+    values[PRODUCTS_LOCATION] = products
+    return values
+
+def record_on_days(r):
+    """
+    Registra cada dia simulado assim que ele termina: no relógio lockstep,
+    como participante da fase 'history' do tick_coordinator.py (depois de
+    todas as outras fases do dia); no 'relogio', a cada fim de dia anunciado
+    pelo almoxarifado em DAY_CHANNEL. O dia gravado é o da simulação.
+    """
+    history = StockHistory(r)
+    storage = make_stock_storage(r)
+    entity_name = 'stock-history'
+    pubsub = r.pubsub(ignore_subscribe_messages=True)
+    if DAY_CLOCK == 'lockstep':
+        pubsub.subscribe(tick_channel('history'))
+        # Registrado só depois de assinar: nenhum tick pode chegar antes da assinatura
+        register_participant(r, entity_name, 'history')
+        print_update("Registrando o histórico de estoque na fase 'history' do relógio lockstep.", entity_name)
+    else:
+        pubsub.subscribe(DAY_CHANNEL)
+        print_update(f"Registrando o histórico de estoque a cada fim de dia anunciado em '{DAY_CHANNEL}'.", entity_name)
+
+    for message in pubsub.listen():
+        if message['type'] != 'message':
+            continue
+        data = message['data']
+        if DAY_CLOCK == 'lockstep' and data in (TICK_REGISTER, TICK_REGISTER.encode()):
+            register_participant(r, entity_name, 'history')
+            continue
+        if DAY_CLOCK == 'lockstep' and data in (TICK_SAVE, TICK_SAVE.encode()):
+            # Nenhum estado em memória: o histórico já está no Redis
+            ack_tick(r, entity_name, 'history', TICK_SAVE)
+            continue
+        day = parse_tick(data)
+        if day is None:
+            break
+        history.record_day(day, read_plant(r, storage, plant_locations(r)))
+        if DAY_CLOCK == 'lockstep':
+            ack_tick(r, entity_name, 'history', day)
+    pubsub.close()
+    print_update("Simulação terminada.", entity_name)
+
+USAGE = """Uso: python3 stock_history.py registrar
+       python3 stock_history.py exportar [arquivo.csv] [dia_inicial] [dia_final]"""
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('registrar', 'exportar'):
+        print(USAGE)
+        sys.exit(1)
+
+    try:
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        sys.exit(1)
+
+    if sys.argv[1] == 'registrar':
+        record_on_days(r)
+        return
+
+    path = sys.argv[2] if len(sys.argv) > 2 else 'historico.csv'
+    start_day = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    end_day = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    history = StockHistory(r)
+    written = history.export_csv(path, plant_locations(r), start_day, end_day)
+    print(f"Histórico dos dias {start_day} a {end_day or history.last_day()} exportado para {' e '.join(written)}.")
+
+if __name__ == "__main__":
+    main()
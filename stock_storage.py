@@ -0,0 +1,332 @@
+# stock_storage.py
+
+import threading
+import numpy as np
+from lua_scripts import (
+    CONSUME_KIT_LUA,
+    TRANSFER_PARTS_LUA,
+    CONSUME_KIT_HASH_LUA,
+    TRANSFER_PARTS_HASH_LUA
+)
+from utils import NUM_PARTS, STOCK_LAYOUT, STOCK_LEVEL_INDEX
+
+# Um "local" de estoque é um prefixo: 'warehouse' ou 'line:{factory_id}:{line_id}'.
+
+# Modos do estoque em memória das linhas (utils.LINE_STOCK_CACHE, ver LocationStockCache)
+STOCK_CACHE_MODES = ('redis', 'write_through', 'write_behind')
+
+class StringStockStorage:
+    """Layout original: uma chave string por peça, '{local}:part:{i}'."""
+
+    layout = 'string'
+
+    def __init__(self, redis_client):
+        self.r = redis_client
+        self._consume_kit = self.r.register_script(CONSUME_KIT_LUA)
+        self._transfer = self.r.register_script(TRANSFER_PARTS_LUA)
+        self._keys_cache = {}
+
+    def _keys(self, location, num_parts=NUM_PARTS):
+        keys = self._keys_cache.get((location, num_parts))
+        if keys is None:
+            keys = [f"{location}:part:{i}" for i in range(num_parts)]
+            self._keys_cache[(location, num_parts)] = keys
+        return keys
+
+    def get(self, location, part_id):
+        return int(self.r.get(f"{location}:part:{part_id}") or 0)
+
+    def incr(self, location, part_id, qty):
+        return self.r.incrby(f"{location}:part:{part_id}", qty)
+
+    def get_all(self, location, num_parts=NUM_PARTS):
+        """Estoque de todas as peças do local com um único MGET."""
+        return [int(v or 0) for v in self.r.mget(self._keys(location, num_parts))]
+
+    def get_all_many(self, locations, num_parts=NUM_PARTS):
+        """Estoque de vários locais em um único round trip (pipeline de MGETs)."""
+        pipe = self.r.pipeline(transaction=False)
+        for location in locations:
+            pipe.mget(self._keys(location, num_parts))
+        return [[int(v or 0) for v in values] for values in pipe.execute()]
+
+    def set_all(self, location, values, pipe=None):
+        keys = self._keys(location, len(values))
+        (pipe or self.r).mset(dict(zip(keys, values)))
+
+    def set_parts(self, location, part_ids, values, pipe=None):
+        """Grava o estoque só das peças indicadas."""
+        keys = self._keys(location)
+        (pipe or self.r).mset({keys[i]: v for i, v in zip(part_ids, values)})
+
+    def copy_location(self, source, destination, pipe=None, num_parts=NUM_PARTS):
+        """Copia o estoque de um local para outro no próprio Redis (COPY); devolve o número de comandos."""
+        target = pipe or self.r
+        for source_key, destination_key in zip(self._keys(source, num_parts), self._keys(destination, num_parts)):
+            target.copy(source_key, destination_key, replace=True)
+        return num_parts
+
+    def add(self, location, amounts):
+        """Soma as quantidades não nulas (lista densa por peça) em um único round trip."""
+        keys = self._keys(location, len(amounts))
+        pipe = self.r.pipeline(transaction=False)
+        for key, amount in zip(keys, amounts):
+            if amount:
+                pipe.incrby(key, amount)
+        pipe.execute()
+
+    def consume_kit(self, location, part_ids, qty):
+        """Consome `qty` de cada peça do kit atomicamente; False se faltar alguma."""
+        keys = self._keys(location)
+        return bool(self._consume_kit(keys=[keys[i] for i in part_ids], args=[qty]))
+
+    def debit(self, location, part_ids, amounts):
+        """Debita a remessa atomicamente; 0 ou a posição (1-indexada) da primeira peça em falta."""
+        keys = self._keys(location)
+        return self._transfer(keys=[keys[i] for i in part_ids], args=list(amounts))
+
+    # Sem índice de níveis neste layout: as consultas Kanban releem todas as peças.
+
+    def parts_below(self, location, threshold, num_parts=NUM_PARTS):
+        """Peças (0-indexadas) com estoque abaixo de `threshold`."""
+        return [i for i, stock in enumerate(self.get_all(location, num_parts)) if stock < threshold]
+
+    def min_stock(self, location, num_parts=NUM_PARTS):
+        return min(self.get_all(location, num_parts))
+
+
+class HashStockStorage:
+    """
+    Layout compacto: um único hash por local, '{local}:parts', com um campo por
+    peça. Ler o estoque de um local é um único HMGET, e até
+    hash-max-listpack-entries campos o Redis guarda o hash como listpack,
+    bem menor do que uma chave (com seu overhead) por peça.
+
+    Com `level_index`, cada local tem também o sorted set '{local}:levels'
+    (membro = peça, score = estoque), atualizado junto com o hash em toda
+    escrita. As peças abaixo de um limite Kanban saem de um ZRANGEBYSCORE e
+    o menor estoque de um ZRANGE 0 0, sem depender do número de peças.
+    """
+
+    layout = 'hash'
+
+    def __init__(self, redis_client, level_index=STOCK_LEVEL_INDEX):
+        self.r = redis_client
+        self.level_index = level_index
+        self._consume_kit = self.r.register_script(CONSUME_KIT_HASH_LUA)
+        self._transfer = self.r.register_script(TRANSFER_PARTS_HASH_LUA)
+        self._fields = [str(i) for i in range(NUM_PARTS)]
+
+    def _fields_for(self, num_parts):
+        if num_parts == NUM_PARTS:
+            return self._fields
+        return [str(i) for i in range(num_parts)]
+
+    def key(self, location):
+        return f"{location}:parts"
+
+    def levels_key(self, location):
+        return f"{location}:levels"
+
+    def _script_keys(self, location):
+        if self.level_index:
+            return [self.key(location), self.levels_key(location)]
+        return [self.key(location)]
+
+    def get(self, location, part_id):
+        return int(self.r.hget(self.key(location), part_id) or 0)
+
+    def incr(self, location, part_id, qty):
+        if not self.level_index:
+            return self.r.hincrby(self.key(location), part_id, qty)
+        pipe = self.r.pipeline(transaction=True)
+        pipe.hincrby(self.key(location), part_id, qty)
+        pipe.zincrby(self.levels_key(location), qty, part_id)
+        return pipe.execute()[0]
+
+    def get_all(self, location, num_parts=NUM_PARTS):
+        """Estoque de todas as peças do local com um único HMGET."""
+        return [int(v or 0) for v in self.r.hmget(self.key(location), self._fields_for(num_parts))]
+
+    def get_all_many(self, locations, num_parts=NUM_PARTS):
+        """Estoque de vários locais em um único round trip (pipeline de HMGETs)."""
+        fields = self._fields_for(num_parts)
+        pipe = self.r.pipeline(transaction=False)
+        for location in locations:
+            pipe.hmget(self.key(location), fields)
+        return [[int(v or 0) for v in values] for values in pipe.execute()]
+
+    def set_all(self, location, values, pipe=None):
+        self.set_parts(location, range(len(values)), values, pipe)
+
+    def set_parts(self, location, part_ids, values, pipe=None):
+        """Grava o estoque só das peças indicadas (hash e índice juntos)."""
+        mapping = {str(i): v for i, v in zip(part_ids, values)}
+        target = pipe or self.r
+        target.hset(self.key(location), mapping=mapping)
+        if self.level_index:
+            target.zadd(self.levels_key(location), mapping)
+
+    def copy_location(self, source, destination, pipe=None, num_parts=NUM_PARTS):
+        """
+        Copia o estoque de um local para outro no próprio Redis (COPY do hash e
+        do índice): dois comandos em vez de reenviar todas as peças. Devolve o
+        número de comandos.
+        """
+        target = pipe or self.r
+        target.copy(self.key(source), self.key(destination), replace=True)
+        if not self.level_index:
+            return 1
+        target.copy(self.levels_key(source), self.levels_key(destination), replace=True)
+        return 2
+
+    def add(self, location, amounts):
+        """Soma as quantidades não nulas com HINCRBYs (e ZINCRBYs no índice) em um único round trip."""
+        key, levels_key = self.key(location), self.levels_key(location)
+        # MULTI/EXEC: quem consulta o índice nunca vê o hash e o sorted set divergentes
+        pipe = self.r.pipeline(transaction=self.level_index)
+        for part_id, amount in enumerate(amounts):
+            if amount:
+                pipe.hincrby(key, part_id, amount)
+                if self.level_index:
+                    pipe.zincrby(levels_key, amount, part_id)
+        pipe.execute()
+
+    def consume_kit(self, location, part_ids, qty):
+        """Consome `qty` de cada peça do kit atomicamente; False se faltar alguma."""
+        return bool(self._consume_kit(keys=self._script_keys(location), args=[qty, *part_ids]))
+
+    def debit(self, location, part_ids, amounts):
+        """Debita a remessa atomicamente; 0 ou a posição (1-indexada) da primeira peça em falta."""
+        args = []
+        for part_id, amount in zip(part_ids, amounts):
+            args += [part_id, amount]
+        return self._transfer(keys=self._script_keys(location), args=args)
+
+    def parts_below(self, location, threshold, num_parts=NUM_PARTS):
+        """Peças (0-indexadas) com estoque abaixo de `threshold`; com o índice, custa O(log N + peças devolvidas)."""
+        if not self.level_index:
+            return [i for i, stock in enumerate(self.get_all(location, num_parts)) if stock < threshold]
+        return sorted(int(part_id) for part_id in self.r.zrangebyscore(self.levels_key(location), '-inf', f'({threshold}'))
+
+    def min_stock(self, location, num_parts=NUM_PARTS):
+        """Menor estoque entre as peças do local; com o índice, um único ZRANGE 0 0."""
+        if not self.level_index:
+            return min(self.get_all(location, num_parts))
+        lowest = self.r.zrange(self.levels_key(location), 0, 0, withscores=True)
+        return int(lowest[0][1]) if lowest else 0
+
+    def rebuild_level_index(self, location, num_parts=NUM_PARTS):
+        """Recria o índice a partir do hash (ex.: dados gravados antes de o índice existir)."""
+        values = self.get_all(location, num_parts)
+        pipe = self.r.pipeline(transaction=True)
+        pipe.delete(self.levels_key(location))
+        pipe.zadd(self.levels_key(location), dict(zip(self._fields_for(num_parts), values)))
+        pipe.execute()
+
+
+class LocationStockCache:
+    """
+    Estoque de um local mantido em memória pelo seu único escritor (uma
+    linha), com a mesma interface de leitura e escrita dos storages acima.
+    Checagens de kit e consultas Kanban são operações sobre um array, sem ir
+    ao Redis. As peças que mudaram desde a última gravação são escritas por
+    flush() de uma vez, no layout do storage. Leituras feitas por outros
+    processos (dashboard, histórico, política 'red' do almoxarifado) veem o
+    estoque da última gravação.
+    """
+
+    def __init__(self, storage, location, num_parts=NUM_PARTS):
+        self.storage = storage
+        self.location = location
+        # Estado inicial: o que estiver no Redis (ex.: a linha foi reiniciada)
+        self.values = np.array(storage.get_all(location, num_parts), dtype=np.int64)
+        self.flushed = self.values.copy()
+        # O listener e a rotina diária da linha podem rodar em threads diferentes
+        self.lock = threading.Lock()
+
+    def _check(self, location):
+        if location != self.location:
+            raise ValueError(f"Cache do local '{self.location}' não guarda '{location}'.")
+
+    def get(self, location, part_id):
+        self._check(location)
+        return int(self.values[part_id])
+
+    def incr(self, location, part_id, qty):
+        self._check(location)
+        with self.lock:
+            self.values[part_id] += qty
+            return int(self.values[part_id])
+
+    def get_all(self, location, num_parts=NUM_PARTS):
+        self._check(location)
+        return self.values[:num_parts].tolist()
+
+    def add(self, location, amounts):
+        self._check(location)
+        with self.lock:
+            self.values[:len(amounts)] += np.asarray(amounts, dtype=np.int64)
+
+    def consume_kit(self, location, part_ids, qty):
+        """Consome `qty` de cada peça do kit; False (sem consumir nada) se faltar alguma."""
+        self._check(location)
+        with self.lock:
+            if self.values[part_ids].min(initial=qty) < qty:
+                return False
+            self.values[part_ids] -= qty
+            return True
+
+    def parts_below(self, location, threshold, num_parts=NUM_PARTS):
+        self._check(location)
+        return np.flatnonzero(self.values[:num_parts] < threshold).tolist()
+
+    def min_stock(self, location, num_parts=NUM_PARTS):
+        self._check(location)
+        return int(self.values[:num_parts].min())
+
+    def dirty_parts(self):
+        return np.flatnonzero(self.values != self.flushed)
+
+    def reload(self):
+        """Descarta o estado em memória e relê o local do Redis (ex.: depois de restaurar um checkpoint)."""
+        with self.lock:
+            self.values[:] = self.storage.get_all(self.location, len(self.values))
+            self.flushed[:] = self.values
+
+    def flush(self, pipe=None):
+        """
+        Grava as peças que mudaram desde a última gravação e devolve (peças,
+        variações, valores gravados) para o feed de mudanças. Sem `pipe` a
+        gravação é imediata e as peças deixam de estar pendentes; com `pipe`
+        elas só deixam depois que ele executar, com mark_flushed(peças,
+        valores): se o pipeline falhar, a próxima gravação as repete.
+        """
+        with self.lock:
+            part_ids = self.dirty_parts()
+            if not part_ids.size:
+                return [], [], []
+            values = self.values[part_ids]
+            deltas = (values - self.flushed[part_ids]).tolist()
+        part_ids, values = part_ids.tolist(), values.tolist()
+        self.storage.set_parts(self.location, part_ids, values, pipe)
+        if pipe is None:
+            self.mark_flushed(part_ids, values)
+        return part_ids, deltas, values
+
+    def mark_flushed(self, part_ids, values):
+        """Registra como gravados no Redis os valores devolvidos por flush."""
+        with self.lock:
+            self.flushed[part_ids] = values
+
+
+STORAGE_LAYOUTS = {
+    'string': StringStockStorage,
+    'hash': HashStockStorage,
+}
+
+def make_stock_storage(redis_client, layout=STOCK_LAYOUT):
+    """Cria o armazenamento de estoque de peças no layout configurado em utils.STOCK_LAYOUT."""
+    if layout not in STORAGE_LAYOUTS:
+        raise ValueError(f"Layout de estoque desconhecido: '{layout}'. Use um de {list(STORAGE_LAYOUTS)}.")
+    return STORAGE_LAYOUTS[layout](redis_client)
@@ -14,8 +14,12 @@ echo "================================================="
 echo "Parando o processo do Streamlit (kanban_visualizer)..."
 pkill -f "streamlit run kanban_visualizer.py"
 
-echo "Parando todos os processos da simulação (*_redis.py)..."
+echo "Parando o launcher e todos os processos da simulação (*_redis.py, async_host.py)..."
+pkill -f "launcher.py iniciar"
 pkill -f "_redis.py"
+pkill -f "async_host.py"
+pkill -f "line_host.py"
+pkill -f "tick_coordinator.py"
 
 sleep 1
 echo "✅ Todos os processos da simulação foram encerrados."
@@ -3,60 +3,103 @@
 import redis
 import threading
 import time
+from codec import encode_message, decode_message
+from order_streams import OrderStream, SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP
+from tracing import Tracer, traced_client
+from metrics import start_metrics_server
+from tick_coordinator import run_lockstep
 from utils import (
-    list_to_string,
-    string_to_list,
     print_update,
     PARTS_TO_SEND_AMOUNT_SUPPLIER,
+    NUM_PARTS,
     TIME_SLEEP,
     DAYS_MAX,
     REDIS_HOST,
-    REDIS_PORT
+    REDIS_PORT,
+    WIRE_FORMAT,
+    ORDER_TRANSPORT,
+    DAY_CLOCK
 )
 
 class SupplierRedis:
 
     def __init__(self, redis_client):
-        self.r = redis_client
+        self.r = traced_client(redis_client)
         self.entity_name = 'supplier'
+        self.tracer = Tracer(self.entity_name, redis_client)
+        self.channel = "channel:supplier"
+        self.orders = None
 
     def send_parts(self, parts_ordered):
         """
         Prepara e envia um lote de peças para o almoxarifado com base no pedido recebido.
         """
-        # <<< NOTA: O número total de peças diferentes é 100 (de 0 a 99)
-        parts_to_send = [0] * 100
+        parts_to_send = [0] * NUM_PARTS
         for idx, needs_part in enumerate(parts_ordered):
             # Se a posição na lista for 1, significa que aquela peça precisa ser enviada.
             if needs_part:
                 parts_to_send[idx] = PARTS_TO_SEND_AMOUNT_SUPPLIER
 
-        # <<< NOTA: A mensagem é simples: "comando/payload"
         # O almoxarifado (warehouse) vai ouvir por "receive_parts"
-        payload = list_to_string(parts_to_send)
-        msg = f"receive_parts/{payload}"
+        msg = encode_message("receive_parts", parts=parts_to_send)
         
         print_update(f"Recebeu pedido. Enviando peças para o Almoxarifado.", self.entity_name)
         self.r.publish("channel:warehouse", msg)
 
+    def metrics(self):
+        """O fornecedor só tem os contadores por mensagem (ver metrics.py)."""
+        return []
+
+    def handle_message(self, data):
+        """Trata uma mensagem recebida no canal do fornecedor."""
+        msg = decode_message(data)
+        
+        # O comando esperado é "send_parts" vindo do almoxarifado
+        with self.tracer.span(msg.command, msg.trace):
+            if msg.command == "send_parts":
+                self.send_parts(msg.parts)
+
     def listen(self):
         """
         Ouve continuamente o canal 'channel:supplier' por novas mensagens.
         """
         pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:supplier")
-        print_update("Ouvindo o canal 'channel:supplier' por pedidos do almoxarifado...", self.entity_name)
+        pubsub.subscribe(self.channel)
+        print_update(f"Ouvindo o canal '{self.channel}' por pedidos do almoxarifado...", self.entity_name)
         
         for message in pubsub.listen():
             if message['type'] == 'message':
-                payload = message['data']
-                parts = payload.split("/")
-                
-                # O comando esperado é "send_parts" vindo do almoxarifado
-                if parts[0] == "send_parts":
-                    ordered_list_str = parts[1]
-                    ordered_list = string_to_list(ordered_list_str)
-                    self.send_parts(ordered_list)
+                self.handle_message(message['data'])
+
+    def consume_orders(self):
+        """
+        Consome continuamente o stream de pedidos do almoxarifado (ORDER_TRANSPORT = 'stream'),
+        confirmando cada pedido só depois de enviar as peças.
+        """
+        orders = self._order_stream()
+        print_update(f"Consumindo o stream '{SUPPLIER_ORDERS_STREAM}' por pedidos do almoxarifado...", self.entity_name)
+
+        while True:
+            for entry_id, data in orders.read(count=10, block=1000):
+                self.handle_message(data)
+                orders.ack(entry_id)
+
+    def process_order_backlog(self):
+        """
+        Atende de uma vez todos os pedidos pendentes no stream. É o passo do
+        dia no relógio lockstep, em que o fornecedor não fica bloqueado no stream.
+        """
+        orders = self._order_stream()
+        entries = orders.read_backlog()
+        for _, data in entries:
+            self.handle_message(data)
+        if entries:
+            orders.ack(*(entry_id for entry_id, _ in entries))
+
+    def _order_stream(self):
+        if self.orders is None:
+            self.orders = OrderStream(self.r, SUPPLIER_ORDERS_STREAM, SUPPLIER_GROUP, self.entity_name)
+        return self.orders
 
 def main():
     """
@@ -65,7 +108,8 @@ def main():
     try:
         # <<< MELHORIA: A conexão com o Redis é feita aqui e passada para a classe.
         # Isso torna o código mais limpo e fácil de testar.
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        # Com mensagens binárias (ver codec.py) as respostas ficam em bytes
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=(WIRE_FORMAT == 'text'))
         r.ping()
         print_update("Conexão com Redis bem-sucedida.", 'supplier-main')
     except redis.exceptions.ConnectionError as e:
@@ -73,9 +117,20 @@ def main():
         return
 
     sup = SupplierRedis(r)
+    start_metrics_server([sup], r)
+
+    if DAY_CLOCK == 'lockstep':
+        # Última fase do dia: com pubsub os pedidos já chegaram pelo canal antes do tick
+        if ORDER_TRANSPORT == 'stream':
+            run_lockstep(r, sup.entity_name, {'supplier': sup.process_order_backlog}, None)
+        else:
+            run_lockstep(r, sup.entity_name, {'supplier': lambda: None},
+                         lambda channel, data: sup.handle_message(data), channels=[sup.channel])
+        return
     
     # Inicia o listener em uma thread separada para não bloquear o loop principal.
-    listener_thread = threading.Thread(target=sup.listen, daemon=True)
+    consume = sup.consume_orders if ORDER_TRANSPORT == 'stream' else sup.listen
+    listener_thread = threading.Thread(target=consume, daemon=True)
     listener_thread.start()
 
     # Este processo não precisa de um loop de "dias", pois ele é reativo.
@@ -0,0 +1,243 @@
+# tick_coordinator.py
+
+import os
+import socket
+import sys
+import time
+import redis
+from topology import DEFAULT_HOSTING, tick_participants
+from checkpoint import save_entity_states, write_checkpoint, checkpoint_day, discard_entity_states
+from utils import (
+    print_update,
+    WARNING,
+    DAYS_MAX,
+    REDIS_HOST,
+    REDIS_PORT,
+    TOPOLOGY,
+    PLANT_FACTORIES
+)
+
+# Relógio lockstep (DAY_CLOCK = 'lockstep'): em vez de cada processo dormir TIME_SLEEP entre os
+# dias, o coordenador publica cada dia fase por fase, na mesma ordem do simulation_engine.py, e
+# espera todos os participantes da fase confirmarem antes de passar à seguinte. O tick chega pela
+# mesma conexão pubsub das mensagens da entidade, então tudo o que as fases anteriores publicaram
+# já foi tratado quando o passo do dia roda. A última fase, 'history', é o registro do histórico
+# de estoque (stock_history.py), com o dia inteiro já fechado.
+PHASES = ('product_stock', 'factory', 'line', 'warehouse', 'supplier', 'history')
+
+TICK_CHANNEL_PREFIX = "control:tick:"
+TICK_PARTICIPANTS_KEY = "tick:participants"   # SET de "{fase}:{participante}"
+TICK_ACKS_KEY = "tick:acks"                   # LIST de "{dia}:{fase}:{participante}"
+TICK_END = "FIM"
+# Pedido de checkpoint entre dois dias: cada participante grava o estado das suas entidades
+TICK_SAVE = "SALVAR"
+# Chamada de registro antes do primeiro dia: só os participantes vivos (ouvindo o tick) respondem
+TICK_REGISTER = "REGISTRO"
+
+# Segundos sem confirmação de uma fase até avisar quem está faltando (a espera continua)
+TICK_ACK_TIMEOUT = 30
+# Intervalo entre as checagens de participantes registrados antes do primeiro dia
+REGISTRATION_POLL = 0.2
+
+# No relógio 'relogio' não há ticks: o almoxarifado anuncia aqui o fim de cada dia seu
+DAY_CHANNEL = "control:day"
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def tick_channel(phase):
+    return f"{TICK_CHANNEL_PREFIX}{phase}"
+
+def process_participant_name(prefix):
+    """Nome único de um processo que hospeda várias entidades (ex.: async_host.py)."""
+    return f"{prefix}-{socket.gethostname()}-{os.getpid()}"
+
+def register_participant(redis_client, name, phase):
+    redis_client.sadd(TICK_PARTICIPANTS_KEY, f"{phase}:{name}")
+
+def ack_tick(redis_client, name, phase, day):
+    redis_client.rpush(TICK_ACKS_KEY, f"{day}:{phase}:{name}")
+
+def announce_day(redis_client, day):
+    redis_client.publish(DAY_CHANNEL, str(day))
+
+def parse_tick(data):
+    """Dia de um tick, ou None para o fim da simulação."""
+    data = _text(data)
+    return None if data == TICK_END else int(data)
+
+
+def run_lockstep(redis_client, name, steps, handle_message, channels=(), patterns=(), entities=()):
+    """
+    Laço de dias de um processo no relógio lockstep, no lugar da thread
+    ouvinte e do while com time.sleep. Uma única conexão pubsub recebe as
+    mensagens da entidade (`channels`/`patterns`, entregues a
+    handle_message(canal, dados)) e os ticks das fases em `steps`
+    ({fase: função do dia}); cada tick roda o passo e confirma ao coordenador.
+    Um pedido de checkpoint grava o estado de `entities` (ver checkpoint.py).
+    Volta quando o coordenador encerra a simulação.
+    """
+    tick_channels = {tick_channel(phase): phase for phase in steps}
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    if patterns:
+        pubsub.psubscribe(*patterns)
+    pubsub.subscribe(*tick_channels, *channels)
+    # Registrado só depois de assinar: nenhum tick pode chegar antes da assinatura
+    for phase in steps:
+        register_participant(redis_client, name, phase)
+    print_update(f"Participante do relógio lockstep nas fases {list(steps)}; aguardando o coordenador...", name)
+
+    for message in pubsub.listen():
+        if message['type'] not in ('message', 'pmessage'):
+            continue
+        channel = _text(message['channel'])
+        phase = tick_channels.get(channel)
+        if phase is None:
+            handle_message(channel, message['data'])
+            continue
+        if _text(message['data']) == TICK_REGISTER:
+            register_participant(redis_client, name, phase)
+            continue
+        if _text(message['data']) == TICK_SAVE:
+            save_entity_states(redis_client, entities)
+            ack_tick(redis_client, name, phase, TICK_SAVE)
+            continue
+        day = parse_tick(message['data'])
+        if day is None:
+            break
+        steps[phase]()
+        ack_tick(redis_client, name, phase, day)
+
+    pubsub.close()
+    print_update("Simulação terminada.", name)
+
+
+class TickCoordinator:
+    """
+    Avança os dias da planta distribuída: espera os participantes esperados
+    se registrarem e, a cada dia, publica o tick de cada fase e espera todas
+    as confirmações (barreira). Sem `day_seconds` os dias andam tão rápido
+    quanto o participante mais lento; com ele, cada dia dura pelo menos isso
+    (modo de demonstração). Depois de um checkpoint restaurado, continua do
+    dia seguinte ao dele; com `checkpoint_path`, grava um novo ao fim do último dia.
+    """
+
+    def __init__(self, redis_client, expected, day_seconds=0.0, timeout=TICK_ACK_TIMEOUT, checkpoint_path=None):
+        self.r = redis_client
+        self.expected = expected
+        self.day_seconds = day_seconds
+        self.timeout = timeout
+        self.checkpoint_path = checkpoint_path
+        self.entity_name = 'tick-coordinator'
+        self.participants = {phase: set() for phase in PHASES}
+        self.phase_seconds = {phase: 0.0 for phase in PHASES}
+
+    def wait_for_participants(self):
+        """
+        Espera `expected` participantes vivos. Registros deixados por processos
+        que caíram ou reiniciaram (com outro pid no nome) não podem completar a
+        conta: o conjunto é apagado e, a cada checagem, um TICK_REGISTER em todas
+        as fases faz quem está ouvindo se registrar de novo.
+        """
+        self.r.delete(TICK_PARTICIPANTS_KEY)
+        registered = set()
+        while len(registered) < self.expected:
+            for phase in PHASES:
+                self.r.publish(tick_channel(phase), TICK_REGISTER)
+            time.sleep(REGISTRATION_POLL)
+            current = {_text(member) for member in self.r.smembers(TICK_PARTICIPANTS_KEY)}
+            if len(current) != len(registered):
+                print_update(f"{len(current)}/{self.expected} participantes registrados.", self.entity_name)
+            registered = current
+        if len(registered) > self.expected:
+            print_update(f"{len(registered)} participantes registrados, {self.expected} esperados: "
+                         f"todos entram nas barreiras.", self.entity_name, WARNING)
+
+        for member in registered:
+            phase, _, name = member.partition(':')
+            if phase in self.participants:
+                self.participants[phase].add(name)
+        # Confirmações de uma execução anterior não podem completar as barreiras desta
+        self.r.delete(TICK_ACKS_KEY)
+
+    def run_phase(self, day, phase):
+        """Publica o tick (o dia, ou TICK_SAVE) da fase e espera todas as confirmações."""
+        waiting = set(self.participants[phase])
+        if not waiting:
+            return 0.0
+        start = time.perf_counter()
+        self.r.publish(tick_channel(phase), str(day))
+        prefix = f"{day}:{phase}:"
+        while waiting:
+            item = self.r.blpop(TICK_ACKS_KEY, timeout=self.timeout)
+            if item is None:
+                print_update(f"Dia {day}, fase {phase}: sem confirmação de {sorted(waiting)} há {self.timeout}s.",
+                             self.entity_name, WARNING)
+                continue
+            ack = _text(item[1])
+            if ack.startswith(prefix):
+                waiting.discard(ack[len(prefix):])
+        return time.perf_counter() - start
+
+    def save_checkpoint(self, day):
+        """Com todos parados entre dois dias: estados das entidades no Redis e o banco inteiro no arquivo."""
+        start = time.perf_counter()
+        for phase in PHASES:
+            self.run_phase(TICK_SAVE, phase)
+        n_keys = write_checkpoint(self.r, self.checkpoint_path, day, exclude=(TICK_PARTICIPANTS_KEY, TICK_ACKS_KEY))
+        print_update(f"Checkpoint do dia {day} gravado em {self.checkpoint_path}: {n_keys} chaves "
+                     f"em {time.perf_counter() - start:.2f}s.", self.entity_name)
+
+    def run(self, days=DAYS_MAX):
+        self.wait_for_participants()
+        # Cada participante carrega o estado do checkpoint antes de se registrar: daqui em diante
+        # ele não vale mais, e quem reiniciar no meio da execução não volta ao dia do checkpoint
+        discard_entity_states(self.r)
+        first = checkpoint_day(self.r) + 1
+        print_update(f"Iniciando {days} dias (do dia {first}) com {self.expected} participantes"
+                     f"{f' ({self.day_seconds}s por dia)' if self.day_seconds else ''}.", self.entity_name)
+
+        start = time.perf_counter()
+        for day in range(first, first + days):
+            day_start = time.perf_counter()
+            print_update(f"--- Dia {day} ---", self.entity_name)
+            for phase in PHASES:
+                self.phase_seconds[phase] += self.run_phase(day, phase)
+            if self.day_seconds:
+                time.sleep(max(0.0, self.day_seconds - (time.perf_counter() - day_start)))
+        elapsed = time.perf_counter() - start
+
+        if self.checkpoint_path:
+            self.save_checkpoint(first + days - 1)
+        for phase in PHASES:
+            self.r.publish(tick_channel(phase), TICK_END)
+        per_phase = ", ".join(f"{phase} {self.phase_seconds[phase] / days * 1000:.1f}ms"
+                              for phase in PHASES if self.participants[phase])
+        print_update(f"{days} dias em {elapsed:.2f}s ({days / elapsed:.1f} dias/s). Média por dia: {per_phase}.",
+                     self.entity_name)
+        return elapsed
+
+
+def main():
+    if len(sys.argv) > 5:
+        print("Uso: python3 tick_coordinator.py [dias] [segundos_por_dia] [participantes] [checkpoint.ckpt]")
+        sys.exit(1)
+
+    hosting = TOPOLOGY.hosting if TOPOLOGY is not None else DEFAULT_HOSTING
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else DAYS_MAX
+    day_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else hosting['day_seconds']
+    expected = int(sys.argv[3]) if len(sys.argv) > 3 else tick_participants(PLANT_FACTORIES, hosting)
+    checkpoint_path = sys.argv[4] if len(sys.argv) > 4 else hosting['checkpoint']
+
+    try:
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO (Coordenador): Não foi possível conectar ao Redis. Detalhes: {e}")
+        return
+
+    TickCoordinator(r, expected, day_seconds, checkpoint_path=checkpoint_path or None).run(days)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# topology.py
+
+import os
+import tomllib
+from collections import namedtuple
+
+# Arquivo com o formato da planta (fábricas, linhas, hospedagem e constantes de utils.py).
+# Todos os processos leem o mesmo arquivo: o launcher.py passa o caminho em PLANT_TOPOLOGY.
+DEFAULT_TOPOLOGY_FILE = "topology.toml"
+TOPOLOGY_ENV = "PLANT_TOPOLOGY"
+
+FABRIC_TYPES = ('empurrada', 'puxada')
+HOSTING_MODES = ('processos', 'async', 'line_hosts')
+CLOCK_MODES = ('relogio', 'lockstep')
+SERVICES = ('snapshot_aggregator', 'stock_history')
+
+Topology = namedtuple('Topology', 'path factories settings hosting')
+
+DEFAULT_HOSTING = {
+    'mode': 'processos',
+    'lines_per_process': 100,
+    'line_shards': 4,
+    'warehouse_workers': 1,
+    'services': list(SERVICES),
+    'dashboard': True,
+    'clock': 'relogio',
+    'day_seconds': 0.0,
+    'checkpoint': '',
+    'restore': '',
+}
+
+
+def topology_path():
+    return os.environ.get(TOPOLOGY_ENV, DEFAULT_TOPOLOGY_FILE)
+
+def load_topology(path=None):
+    """
+    Lê e valida o arquivo de topologia. Sem `path`, usa PLANT_TOPOLOGY ou
+    topology.toml e devolve None se o arquivo não existir (valem os padrões
+    de utils.py).
+    """
+    if path is None:
+        path = topology_path()
+        if not os.path.exists(path):
+            return None
+    with open(path, 'rb') as f:
+        data = tomllib.load(f)
+
+    factories = []
+    for factory in data.get('factories', []):
+        fabric_type = factory.get('policy')
+        if fabric_type not in FABRIC_TYPES:
+            raise ValueError(f"{path}: política de fábrica inválida {fabric_type!r} (use {' ou '.join(FABRIC_TYPES)}).")
+        factory_id, lines = factory.get('id'), factory.get('lines')
+        if not isinstance(factory_id, int) or not isinstance(lines, int) or lines < 1:
+            raise ValueError(f"{path}: cada fábrica precisa de 'id' e 'lines' inteiros (lines >= 1).")
+        factories.append((fabric_type, factory_id, lines))
+    if len({factory_id for _, factory_id, _ in factories}) != len(factories):
+        raise ValueError(f"{path}: ids de fábrica repetidos.")
+
+    hosting = {**DEFAULT_HOSTING, **data.get('hosting', {})}
+    if hosting['mode'] not in HOSTING_MODES:
+        raise ValueError(f"{path}: hosting.mode deve ser {' ou '.join(HOSTING_MODES)}.")
+    if hosting['clock'] not in CLOCK_MODES:
+        raise ValueError(f"{path}: hosting.clock deve ser {' ou '.join(CLOCK_MODES)}.")
+    if hosting['checkpoint'] and hosting['clock'] != 'lockstep':
+        raise ValueError(f"{path}: hosting.checkpoint exige clock = \"lockstep\" (o checkpoint é feito entre dois dias).")
+    unknown = set(hosting['services']) - set(SERVICES)
+    if unknown:
+        raise ValueError(f"{path}: serviços desconhecidos em hosting.services: {sorted(unknown)}.")
+
+    return Topology(os.path.abspath(path), factories, data.get('settings', {}), hosting)
+
+def apply_settings(namespace, settings, path):
+    """Sobrescreve as constantes de `namespace` (os globals de utils.py) com a tabela [settings]."""
+    for name, value in settings.items():
+        if name not in namespace or not name.isupper():
+            raise ValueError(f"{path}: [settings] {name} não é uma constante de utils.py.")
+        current = namespace[name]
+        compatible = (current is None or value is None or isinstance(value, type(current))
+                      or (isinstance(current, float) and isinstance(value, int)))
+        if not compatible or (isinstance(current, int) and isinstance(value, bool) != isinstance(current, bool)):
+            raise ValueError(f"{path}: [settings] {name} deve ser do tipo {type(current).__name__}.")
+        namespace[name] = value
+
+def line_ranges(factories, lines_per_process):
+    """
+    Divide as linhas de todas as fábricas em grupos de até `lines_per_process`:
+    uma lista de grupos, cada um com (factory_id, primeira, última).
+    """
+    groups, current, size = [], [], 0
+    for _, factory_id, lines in factories:
+        first = 1
+        while first <= lines:
+            last = min(lines, first + lines_per_process - size - 1)
+            current.append((factory_id, first, last))
+            size += last - first + 1
+            first = last + 1
+            if size == lines_per_process:
+                groups.append(current)
+                current, size = [], 0
+    if current:
+        groups.append(current)
+    return groups
+
+def tick_participants(factories, hosting):
+    """
+    Participantes que o coordenador do relógio lockstep (tick_coordinator.py)
+    espera: um por processo e fase. Com processos separados, cada entidade; com
+    line_hosts, cada shard no lugar das linhas; com async, cada host de linhas
+    mais as quatro fases do host da planta. O stock_history, quando está entre
+    os serviços, participa da fase 'history'.
+    """
+    history = 1 if 'stock_history' in hosting['services'] else 0
+    workers = hosting['warehouse_workers']
+    if hosting['mode'] == 'async':
+        return len(line_ranges(factories, hosting['lines_per_process'])) + 4 + history
+    lines = hosting['line_shards'] if hosting['mode'] == 'line_hosts' else sum(n for _, _, n in factories)
+    # product_stock e fornecedor, mais fábricas, linhas e workers do almoxarifado
+    return 2 + len(factories) + lines + workers + history
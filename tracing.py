@@ -0,0 +1,388 @@
+# tracing.py
+
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+import redis
+import metrics
+import utils
+from metrics import count_message
+from utils import (
+    REDIS_HOST,
+    REDIS_PORT,
+    TRACING,
+    TRACE_FLUSH_INTERVAL
+)
+
+# Rastreio de uma mensagem, levado no cabeçalho de cada mensagem do codec.py:
+#   trace_id:   id de correlação, o mesmo em todos os saltos de uma ordem (ex.: fábrica -> linha -> depósito)
+#   started_at: instante (time.time()) em que a primeira mensagem da cadeia foi enviada
+#   sent_at:    instante em que esta mensagem foi enviada
+Trace = namedtuple('Trace', 'trace_id started_at sent_at')
+
+# Histogramas gravados no Redis por cada entidade; o relatório junta todos
+TRACE_ENTITIES_KEY = "trace:entities"
+
+# Histogramas log-lineares: BUCKETS_PER_OCTAVE baldes por potência de 2 a partir de
+# HISTOGRAM_MIN (erro relativo < 9%), de 1 µs a ~134 s
+HISTOGRAM_MIN = 1e-6
+BUCKETS_PER_OCTAVE = 8
+HISTOGRAM_BUCKETS = 27 * BUCKETS_PER_OCTAVE
+
+# Desligado pelo motor em processo (simulation_engine.py), onde o tempo é simulado
+TRACING_ENABLED = TRACING
+
+def set_tracing_enabled(enabled):
+    """Liga ou desliga o rastreio para todo o processo."""
+    global TRACING_ENABLED
+    TRACING_ENABLED = enabled
+
+def tracing_key(entity_name):
+    return f"trace:{entity_name}"
+
+_ids = random.Random()
+# Por thread: o rastreio da mensagem em tratamento (propagado às mensagens enviadas) e o span aberto
+_local = threading.local()
+
+
+def outgoing_trace():
+    """
+    Rastreio de uma mensagem prestes a ser enviada: continua a cadeia da
+    mensagem em tratamento nesta thread ou começa uma nova. None se desligado.
+    """
+    if not TRACING_ENABLED:
+        return None
+    now = time.time()
+    current = getattr(_local, 'trace', None)
+    if current is not None:
+        return Trace(current.trace_id, current.started_at, now)
+    return Trace(_ids.getrandbits(63), now, now)
+
+@contextmanager
+def trace_context(trace):
+    """As mensagens enviadas dentro do bloco continuam a cadeia de `trace`."""
+    previous = getattr(_local, 'trace', None)
+    _local.trace = trace
+    try:
+        yield
+    finally:
+        _local.trace = previous
+
+
+class LatencyHistogram:
+    """Histograma de latências (em segundos) com baldes de largura proporcional ao valor."""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        # Relógios de processos diferentes podem divergir um pouco: negativos contam como zero
+        seconds = max(seconds, 0.0)
+        index = 0
+        if seconds > HISTOGRAM_MIN:
+            index = min(int(math.log2(seconds / HISTOGRAM_MIN) * BUCKETS_PER_OCTAVE), HISTOGRAM_BUCKETS - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """Limite superior do balde que contém o percentil p (0-100), sem passar do máximo visto."""
+        if not self.count:
+            return 0.0
+        target = p / 100 * self.count
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= target:
+                return min(HISTOGRAM_MIN * 2 ** ((index + 1) / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def merge(self, other):
+        for index, n in enumerate(other.counts):
+            self.counts[index] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def to_json(self):
+        return json.dumps({'buckets': {i: n for i, n in enumerate(self.counts) if n},
+                           'count': self.count, 'total': self.total, 'max': self.max}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data):
+        fields = json.loads(data)
+        histogram = cls()
+        for index, n in fields['buckets'].items():
+            histogram.counts[int(index)] = n
+        histogram.count = fields['count']
+        histogram.total = fields['total']
+        histogram.max = fields['max']
+        return histogram
+
+
+class _Span:
+    __slots__ = ('redis', 'round_trips', 'logging')
+
+    def __init__(self):
+        self.redis = 0.0
+        self.round_trips = 0
+        self.logging = 0.0
+
+def _add_logging_time(seconds):
+    span = getattr(_local, 'span', None)
+    if span is not None:
+        span.logging += seconds
+
+
+class Tracer:
+    """
+    Histogramas de latência de uma entidade, em memória. Para cada mensagem
+    tratada (span) registra:
+      hop:{cmd}      envio -> recebimento desta mensagem
+      e2e:{cmd}      início da cadeia -> recebimento (só quando a cadeia tem mais de um salto)
+      handler:{cmd}  tempo de tratamento, dividido em
+      redis:{cmd}    ... tempo esperando o Redis (ver traced_client) e
+      logging:{cmd}  ... tempo em print_update
+    e o total de round trips ao Redis por comando. A cada TRACE_FLUSH_INTERVAL
+    segundos os histogramas são gravados em trace:{entidade} para o relatório.
+    Os mesmos números alimentam os contadores do endpoint de métricas (metrics.py).
+    """
+
+    def __init__(self, entity_name, redis_client):
+        self.entity_name = entity_name
+        self.r = redis_client
+        self.histograms = {}
+        self.round_trips = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        if TRACING_ENABLED:
+            utils.set_log_timer(_add_logging_time)
+
+    def record(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def received(self, name, trace):
+        """Registra o salto (e a cadeia) de uma mensagem recebida agora."""
+        if trace is None:
+            return
+        now = time.time()
+        self.record(f"hop:{name}", now - trace.sent_at)
+        if trace.started_at < trace.sent_at:
+            self.record(f"e2e:{name}", now - trace.started_at)
+
+    @contextmanager
+    def span(self, name, trace=None):
+        """
+        Mede o tratamento de uma mensagem; as mensagens enviadas dentro do bloco
+        continuam a cadeia de `trace`. Sem rastreio, só alimenta os contadores
+        do endpoint de métricas.
+        """
+        tracing = TRACING_ENABLED
+        if not tracing and not metrics.METRICS_ENABLED:
+            yield
+            return
+        if tracing:
+            self.received(name, trace)
+        outer = getattr(_local, 'span', None)
+        span = _local.span = _Span()
+        start = time.perf_counter()
+        try:
+            with trace_context(trace if tracing else None):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            _local.span = outer
+            if outer is not None:
+                outer.redis += span.redis
+                outer.round_trips += span.round_trips
+                outer.logging += span.logging
+            count_message(self.entity_name, name, elapsed, span.round_trips)
+            if tracing:
+                self.record(f"handler:{name}", elapsed)
+                self.record(f"redis:{name}", span.redis)
+                self.record(f"logging:{name}", span.logging)
+                with self._lock:
+                    self.round_trips[name] = self.round_trips.get(name, 0) + span.round_trips
+                if time.time() - self._last_flush >= TRACE_FLUSH_INTERVAL:
+                    self.flush()
+
+    def flush(self):
+        """Grava os histogramas no Redis (um round trip), substituindo os anteriores desta entidade."""
+        with self._lock:
+            mapping = {name: histogram.to_json() for name, histogram in self.histograms.items()}
+            mapping.update({f"round_trips:{name}": n for name, n in self.round_trips.items()})
+            self._last_flush = time.time()
+        if not mapping:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        pipe.sadd(TRACE_ENTITIES_KEY, self.entity_name)
+        pipe.hset(tracing_key(self.entity_name), mapping=mapping)
+        pipe.execute()
+
+
+class _TracedPipeline:
+    def __init__(self, pipe):
+        self._pipe = pipe
+
+    def __getattr__(self, name):
+        return getattr(self._pipe, name)
+
+    def execute(self, *args, **kwargs):
+        with _redis_time():
+            return self._pipe.execute(*args, **kwargs)
+
+@contextmanager
+def _redis_time():
+    span = getattr(_local, 'span', None)
+    if span is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        span.redis += time.perf_counter() - start
+        span.round_trips += 1
+
+class TracedRedis:
+    """Cliente Redis que soma o tempo de cada round trip (comando, pipeline ou script) ao span aberto na thread."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name == 'pubsub':
+            return attr
+        if name == 'pipeline':
+            return lambda *args, **kwargs: _TracedPipeline(attr(*args, **kwargs))
+        if name == 'register_script':
+            def register_script(script):
+                run = attr(script)
+
+                def call(*args, **kwargs):
+                    with _redis_time():
+                        return run(*args, **kwargs)
+                return call
+            return register_script
+
+        def call(*args, **kwargs):
+            with _redis_time():
+                return attr(*args, **kwargs)
+        return call
+
+def traced_client(redis_client):
+    """Cliente com medição de round trips para as entidades; o próprio cliente se rastreio e métricas estiverem desligados."""
+    if not (TRACING_ENABLED or metrics.METRICS_ENABLED) or isinstance(redis_client, TracedRedis):
+        return redis_client
+    return TracedRedis(redis_client)
+
+# --- Relatório ---
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+def entity_group(entity_name):
+    """'line-1-3' -> 'line', 'warehouse-2' -> 'warehouse', 'factory-1-puxada' -> 'factory'."""
+    return re.sub(r'-\d.*$', '', entity_name)
+
+def load_histograms(r):
+    """Histogramas gravados por todas as entidades, somados por grupo: {grupo: ({nome: hist}, {cmd: round_trips})}."""
+    groups = {}
+    for entity in sorted(_text(e) for e in r.smembers(TRACE_ENTITIES_KEY)):
+        histograms, round_trips = groups.setdefault(entity_group(entity), ({}, {}))
+        for name, value in r.hgetall(tracing_key(entity)).items():
+            name = _text(name)
+            if name.startswith('round_trips:'):
+                command = name.split(':', 1)[1]
+                round_trips[command] = round_trips.get(command, 0) + int(value)
+                continue
+            histogram = LatencyHistogram.from_json(value)
+            if name in histograms:
+                histograms[name].merge(histogram)
+            else:
+                histograms[name] = histogram
+    return groups
+
+def _ms(seconds):
+    return f"{seconds * 1000:9.3f}"
+
+def print_report(groups):
+    """Onde o tempo vai: latência de cada salto, espera na fila do almoxarifado e a divisão do tratamento."""
+    print("Latência por salto (ms): envio -> recebimento e, em cadeias, início -> recebimento")
+    print(f"{'entidade':<14}{'mensagem':<18}{'n':>8}{'p50':>10}{'p95':>10}{'p99':>10}{'máx':>10}{'cadeia p50':>12}{'cadeia p95':>12}")
+    for group, (histograms, _) in groups.items():
+        for name, hop in sorted(histograms.items()):
+            if not name.startswith('hop:'):
+                continue
+            command = name.split(':', 1)[1]
+            e2e = histograms.get(f"e2e:{command}")
+            chain = f"{_ms(e2e.percentile(50)):>12}{_ms(e2e.percentile(95)):>12}" if e2e else ''
+            print(f"{group:<14}{command:<18}{hop.count:>8}{_ms(hop.percentile(50)):>10}{_ms(hop.percentile(95)):>10}"
+                  f"{_ms(hop.percentile(99)):>10}{_ms(hop.max):>10}{chain}")
+        queue_wait = histograms.get('queue_wait')
+        if queue_wait:
+            print(f"{group:<14}{'(fila de pedidos)':<18}{queue_wait.count:>8}{_ms(queue_wait.percentile(50)):>10}"
+                  f"{_ms(queue_wait.percentile(95)):>10}{_ms(queue_wait.percentile(99)):>10}{_ms(queue_wait.max):>10}")
+
+    print("\nTratamento (ms, média por mensagem): total = Redis + logs + processamento local")
+    print(f"{'entidade':<14}{'mensagem':<18}{'n':>8}{'total':>10}{'Redis':>10}{'logs':>10}{'local':>10}{'round trips':>13}")
+    for group, (histograms, round_trips) in groups.items():
+        for name, handler in sorted(histograms.items()):
+            if not name.startswith('handler:'):
+                continue
+            command = name.split(':', 1)[1]
+            redis_s = histograms[f"redis:{command}"].mean()
+            logging_s = histograms[f"logging:{command}"].mean()
+            local_s = max(handler.mean() - redis_s - logging_s, 0.0)
+            print(f"{group:<14}{command:<18}{handler.count:>8}{_ms(handler.mean()):>10}{_ms(redis_s):>10}"
+                  f"{_ms(logging_s):>10}{_ms(local_s):>10}{round_trips.get(command, 0) / handler.count:>13.1f}")
+
+USAGE = """Uso: python3 tracing.py relatorio
+       python3 tracing.py limpar"""
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] not in ('relatorio', 'limpar'):
+        print(USAGE)
+        sys.exit(1)
+
+    try:
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+        r.ping()
+    except redis.exceptions.ConnectionError as e:
+        print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
+        sys.exit(1)
+
+    if sys.argv[1] == 'limpar':
+        entities = [_text(e) for e in r.smembers(TRACE_ENTITIES_KEY)]
+        r.delete(TRACE_ENTITIES_KEY, *(tracing_key(e) for e in entities))
+        print(f"Histogramas de {len(entities)} entidades apagados.")
+        return
+
+    groups = load_histograms(r)
+    if not groups:
+        print("Nenhum histograma gravado ainda (as entidades gravam a cada TRACE_FLUSH_INTERVAL segundos).")
+        return
+    print_report(groups)
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,106 @@
 # utils.py
 
-import os
+import time
+from topology import load_topology, apply_settings
+from async_log import AsyncLogWriter, DEBUG, INFO, WARNING, ERROR
 
 # Configurações de conexão Redis
 REDIS_HOST = 'redis' # <<< O nome do serviço do Redis no docker-compose
 REDIS_PORT = 6379
 
+# Layout das chaves de estoque de peças no Redis (ver stock_storage.py):
+# 'hash' = um hash por local; 'string' = uma chave por peça (layout original)
+STOCK_LAYOUT = 'hash'
+# No layout 'hash', mantém também um sorted set '{local}:levels' (peça -> estoque) para
+# as checagens Kanban consultarem só as peças abaixo do limite, sem reler todas
+STOCK_LEVEL_INDEX = True
+
+# Estoque de peças das linhas (ver stock_storage.LocationStockCache). Cada linha é a única que
+# escreve no próprio estoque, então pode mantê-lo em memória:
+#   'redis':         toda operação vai ao Redis (scripts Lua atômicos), como antes
+#   'write_through': checagens em memória; cada mudança é gravada na hora, em um round trip
+#   'write_behind':  mudanças acumuladas em memória e gravadas uma vez por dia (check_and_order_parts)
+#                    ou quando o agregador de fotos/dashboard pede (STOCK_FLUSH_CHANNEL)
+LINE_STOCK_CACHE = 'write_behind'
+
+# Formato das mensagens pub/sub (ver codec.py): 'binary' (compacto) ou 'text' (legível, para depuração)
+WIRE_FORMAT = 'binary'
+
+# Transporte dos pedidos linha -> almoxarifado -> fornecedor (ver order_streams.py):
+# 'stream' (Redis Streams com grupo de consumidores, durável) ou 'pubsub' (publish, como antes)
+ORDER_TRANSPORT = 'stream'
+
+# Atendimento dos pedidos das linhas pelo almoxarifado (ver order_allocator.py): a cada dia
+# todos os pedidos pendentes são atendidos em lote, dividindo as peças escassas pela
+# política 'fifo', 'fair' ou 'red'. None volta ao atendimento de um pedido por dia.
+WAREHOUSE_ALLOCATION_POLICY = 'fifo'
+
+# Intervalo entre as fotos da planta lidas pelo dashboard (ver snapshot_aggregator.py), em segundos
+SNAPSHOT_INTERVAL = 1
+# De quanto em quanto tempo o dashboard troca o estado montado pelo change feed pela foto mais nova, em segundos
+DASHBOARD_RESYNC_INTERVAL = 10
+# Deltas do change feed guardados pelo dashboard para reaplicar sobre a foto (cobre o intervalo entre fotos)
+DASHBOARD_FEED_BUFFER = 100000
+
+# Níveis do histórico de estoque (ver stock_history.py): (passo em dias, baldes guardados).
+# Cada passo é múltiplo do anterior; o padrão guarda 1 ano diário, 5 anos semanais e 20 anos em 4 semanas.
+HISTORY_TIERS = [(1, 365), (7, 260), (28, 260)]
+
+# Rastreio das mensagens (ver tracing.py): cada mensagem leva um id de correlação e o instante
+# de envio, e cada entidade guarda histogramas de latência por salto, gravados no Redis a cada
+# TRACE_FLUSH_INTERVAL segundos para o relatório (python3 tracing.py relatorio)
+TRACING = True
+TRACE_FLUSH_INTERVAL = 5
+
+# Endpoint HTTP de métricas (formato texto do Prometheus) de cada processo de entidade (ver metrics.py).
+# 0: o sistema operacional escolhe a porta e o endereço é registrado no Redis por METRICS_TARGET_TTL
+# segundos, renovados enquanto o processo vive (python3 metrics.py alvos); None desliga.
+METRICS_HOST = '0.0.0.0'
+METRICS_PORT = 0
+METRICS_TARGET_TTL = 30
+
 # Intervalo de tempo entre "dias" na simulação (em segundos)
 TIME_SLEEP = 5
 
+# Threads do async_host.py que executam os comandos Redis (bloqueantes) das entidades fora do
+# event loop; cada entidade usa uma de cada vez, e as demais seguem em paralelo
+ASYNC_HOST_THREADS = 32
+
+# Relógio dos dias (ver tick_coordinator.py): 'relogio' (cada processo dorme TIME_SLEEP entre os
+# dias) ou 'lockstep' (o coordenador publica cada dia e espera todas as entidades terminarem).
+# O arquivo de topologia o define em [hosting] clock.
+DAY_CLOCK = 'relogio'
+
+# Checkpoints da planta (ver checkpoint.py): as chaves são lidas (DUMP) e restauradas (RESTORE)
+# em pipelines de até CHECKPOINT_CHUNK comandos
+CHECKPOINT_CHUNK = 500
+
 # --- Constantes da Simulação ---
 
 # <<< CORREÇÃO: Renomeado de PRODUCTS_N para NUM_PRODUCTS e adicionado NUM_PARTS
 NUM_PRODUCTS = 5     # O número total de versões do produto
 NUM_PARTS = 100      # O número total de peças diferentes usadas
+BASE_KIT_SIZE = 43   # As peças 0..42 formam o kit base, comum a todos os produtos
+
+# Arquivo gerado por random_parts.py com as peças de variação (1-indexadas) de cada produto
+PRODUCTS_AND_PARTS_FILE = "products_and_parts.txt"
 
 BATCH_SIZE = 48
 DAYS_MAX = 20
 
+# Fábricas da planta: (tipo_de_fabrica, factory_id, numero_de_linhas); o arquivo de topologia as substitui
+PLANT_FACTORIES = [('empurrada', 1, 5), ('puxada', 2, 8)]
+
+# Estoque inicial gravado por init_redis.py
+INITIAL_PRODUCT_STOCK = 1000
+INITIAL_WAREHOUSE_STOCK = BATCH_SIZE * 1000  # Um valor alto para garantir o início
+INITIAL_LINE_STOCK = 0                       # Por peça; com 0 as linhas começam vazias e pedem tudo no 1º dia
+# Perfil do estado inicial (ver init_redis.py): 'uniforme' (os valores acima), 'regime' (estimativa
+# do regime permanente para cada local) ou 'checkpoint' (um arquivo de checkpoint.py)
+INIT_PROFILE = 'uniforme'
+# Campos de estoque por pipeline na carga inicial (MSET/HSET em lotes, um round trip por lote)
+INIT_PIPELINE_FIELDS = 200000
+
 # --- Parâmetros de Estoque e Kanban ---
 
 # Alertas para o estoque de PEÇAS na LINHA DE PRODUÇÃO
@@ -39,10 +122,31 @@ PARTS_TO_SEND_AMOUNT_SUPPLIER = BATCH_SIZE * 1950
 # Quantidade de peças que o Almoxarifado envia para uma linha em um lote
 PARTS_TO_SEND_AMOUNT_WAREHOUSE = BATCH_SIZE * 30
 
+# Reposição das linhas (ver replenishment.py):
+#   'demanda': cada linha pede só as peças abaixo do ponto de pedido, na quantidade que leva o
+#              estoque ao nível-alvo, ambos calculados pelo consumo previsto dos seus produtos
+#   'kanban':  como antes, todas as peças (PARTS_TO_SEND_AMOUNT_WAREHOUSE de cada) quando a
+#              peça de menor estoque cai abaixo de YELLOW_ALERT_LINE
+LINE_REPLENISHMENT = 'demanda'
+LINE_REORDER_DAYS = 6          # Ponto de pedido: dias de consumo previsto (6 lotes = YELLOW_ALERT_LINE)
+LINE_TARGET_DAYS = 30          # Nível-alvo: dias de consumo previsto (30 lotes = PARTS_TO_SEND_AMOUNT_WAREHOUSE)
+DEMAND_SMOOTHING = 0.3         # Peso do dia mais recente na média móvel exponencial das ordens
+DEMAND_MIN_DAILY = 1.0         # Produtos com previsão abaixo disso (unids/dia) não são mais produzidos
+
 # Limites para os pedidos aleatórios de clientes
 MIN_ORDERED_AMOUNT = 50
 MAX_ORDERED_AMOUNT = 250
 
+# --- Parâmetros de Log (ver async_log.py) ---
+
+LOG_LEVEL = INFO               # Registros abaixo deste nível são descartados na origem
+LOG_FORMAT = 'text'            # 'text' (banners em output/*.txt) ou 'json' (JSON lines em output/*.jsonl)
+LOG_DIR = 'output'
+LOG_TO_CONSOLE = True
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Tamanho máximo de cada arquivo antes da rotação
+LOG_BACKUP_COUNT = 3
+LOG_FLUSH_INTERVAL = 0.5       # Segundos que a thread escritora espera antes de gravar um lote
+
 
 def list_to_string(lst):
     """Converte uma lista de números em uma string separada por ponto e vírgula."""
@@ -52,16 +156,58 @@ def string_to_list(string):
     """Converte uma string separada por ponto e vírgula de volta para uma lista de inteiros."""
     return [int(item) for item in string.split(';') if item]
 
-def print_update(msg, entity_name):
-    """Imprime uma mensagem formatada no console e a salva em um arquivo de log."""
-    final_msg = (
-        "\n"
-        "===============================================================================\n"
-        f"[{entity_name.upper()}] {msg}\n"
-        "===============================================================================\n"
-    )
-    print(final_msg)
-    
-    os.makedirs('output', exist_ok=True)
-    with open(f'output/{entity_name}.txt', 'a', encoding='utf-8') as file:
-        file.write(final_msg)
\ No newline at end of file
+# Quando False, print_update não escreve nada (usado pelo motor de simulação em processo).
+OUTPUT_ENABLED = True
+
+def set_output_enabled(enabled):
+    """Liga ou desliga a saída de print_update para todo o processo."""
+    global OUTPUT_ENABLED
+    OUTPUT_ENABLED = enabled
+
+# Chamado com a duração (s) de cada print_update; tracing.py o usa para separar o tempo gasto com logs
+LOG_TIMER = None
+
+def set_log_timer(timer):
+    global LOG_TIMER
+    LOG_TIMER = timer
+
+_log_writer = None
+
+def get_log_writer():
+    """Escritor de logs do processo, criado (com sua thread) no primeiro uso."""
+    global _log_writer
+    if _log_writer is None:
+        _log_writer = AsyncLogWriter(
+            directory=LOG_DIR,
+            fmt=LOG_FORMAT,
+            max_bytes=LOG_MAX_BYTES,
+            backup_count=LOG_BACKUP_COUNT,
+            flush_interval=LOG_FLUSH_INTERVAL,
+            console=LOG_TO_CONSOLE
+        )
+    return _log_writer
+
+def print_update(msg, entity_name, level=INFO):
+    """
+    Registra uma mensagem da entidade no console e em output/{entidade}.txt.
+    A escrita é feita por uma thread em segundo plano; quem chama nunca espera pelo disco.
+    """
+    if not OUTPUT_ENABLED or level < LOG_LEVEL:
+        return
+    if LOG_TIMER is None:
+        get_log_writer().log(entity_name, level, msg)
+        return
+    start = time.perf_counter()
+    get_log_writer().log(entity_name, level, msg)
+    LOG_TIMER(time.perf_counter() - start)
+
+# --- Topologia (ver topology.py) ---
+# O arquivo de topologia (PLANT_TOPOLOGY ou topology.toml) define as fábricas e pode sobrescrever
+# qualquer constante acima na tabela [settings]. Constantes derivadas (ex.: alertas calculados a
+# partir de BATCH_SIZE) não são recalculadas: sobrescreva-as também se mudar a base.
+TOPOLOGY = load_topology()
+if TOPOLOGY is not None:
+    apply_settings(globals(), TOPOLOGY.settings, TOPOLOGY.path)
+    if TOPOLOGY.factories:
+        PLANT_FACTORIES = TOPOLOGY.factories
+    DAY_CLOCK = TOPOLOGY.hosting['clock']
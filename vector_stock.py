@@ -0,0 +1,208 @@
+# vector_stock.py
+
+import numpy as np
+from codec import encode_message, decode_message
+from stock_storage import make_stock_storage
+from replenishment import DemandForecast, replenishment_quantities, check_replenishment_mode
+from utils import (
+    string_to_list,
+    print_update,
+    WARNING,
+    RED_ALERT_LINE,
+    YELLOW_ALERT_LINE,
+    NUM_PARTS,
+    BASE_KIT_SIZE,
+    PRODUCTS_AND_PARTS_FILE,
+    LINE_REPLENISHMENT
+)
+
+# Zonas Kanban devolvidas por LineStockMatrix.kanban_zones
+ZONE_GREEN = 0
+ZONE_YELLOW = 1
+ZONE_RED = 2
+
+
+def load_products_necessary_parts(path=PRODUCTS_AND_PARTS_FILE):
+    """Lê as peças de variação (1-indexadas) de cada produto."""
+    with open(path, "r") as f:
+        return [string_to_list(line.strip()) for line in f.readlines()]
+
+def build_consumption_matrix(products_necessary_parts=None, num_parts=NUM_PARTS):
+    """
+    Monta a matriz de incidência BOM (NUM_PRODUCTS x NUM_PARTS): 1 onde o produto
+    consome a peça. Cada unidade usa o kit base inteiro mais suas peças de variação.
+    """
+    if products_necessary_parts is None:
+        products_necessary_parts = load_products_necessary_parts()
+
+    bom = np.zeros((len(products_necessary_parts), num_parts), dtype=np.int64)
+    bom[:, :BASE_KIT_SIZE] = 1
+    for product_idx, parts in enumerate(products_necessary_parts):
+        bom[product_idx, np.asarray(parts, dtype=np.int64) - 1] = 1
+    return bom
+
+
+class LineStockMatrix:
+    """
+    Estoque de peças de várias linhas em uma única matriz (n_linhas x NUM_PARTS).
+    Checagem de viabilidade, consumo e teste de limites Kanban são, cada um,
+    uma única operação sobre todas as linhas.
+    """
+
+    def __init__(self, line_keys, bom=None):
+        # line_keys: lista de pares (factory_id, line_id), na ordem das linhas da matriz
+        self.line_keys = [(str(f), str(l)) for f, l in line_keys]
+        self.index = {key: i for i, key in enumerate(self.line_keys)}
+        self.bom = build_consumption_matrix() if bom is None else np.asarray(bom, dtype=np.int64)
+        self.stock = np.zeros((len(self.line_keys), self.bom.shape[1]), dtype=np.int64)
+
+    def locations(self):
+        """Locais de estoque (ver stock_storage.py) de todas as linhas, na ordem da matriz."""
+        return [f"line:{f}:{l}" for f, l in self.line_keys]
+
+    def load(self, storage):
+        """Carrega o estoque de todas as linhas em um único round trip."""
+        self.stock[:] = np.array(storage.get_all_many(self.locations(), self.stock.shape[1]), dtype=np.int64)
+
+    def save(self, storage):
+        """Grava o estoque de todas as linhas em um único round trip."""
+        pipe = storage.r.pipeline(transaction=False)
+        for location, row in zip(self.locations(), self.stock.tolist()):
+            storage.set_all(location, row, pipe=pipe)
+        pipe.execute()
+
+    def requirements(self, products, qtys):
+        """Peças exigidas por linha: (n_linhas x NUM_PARTS). Produto -1 significa 'sem ordem'."""
+        products = np.asarray(products, dtype=np.int64)
+        qtys = np.where(products >= 0, np.asarray(qtys, dtype=np.int64), 0)
+        return self.bom[np.maximum(products, 0)] * qtys[:, None]
+
+    def feasible(self, products, qtys):
+        """Vetor booleano: quais linhas têm peças para produzir a ordem recebida."""
+        return np.all(self.stock >= self.requirements(products, qtys), axis=1)
+
+    def consume(self, products, qtys):
+        """Consome as peças das linhas viáveis de uma vez e devolve o vetor de viabilidade."""
+        required = self.requirements(products, qtys)
+        ok = np.all(self.stock >= required, axis=1)
+        self.stock -= required * ok[:, None]
+        return ok
+
+    def receive(self, amounts, rows=None):
+        """Soma um lote de peças às linhas indicadas (ou a todas)."""
+        if rows is None:
+            self.stock += amounts
+        else:
+            self.stock[rows] += amounts
+
+    def kanban_zones(self, red_limit=RED_ALERT_LINE, yellow_limit=YELLOW_ALERT_LINE):
+        """Zona Kanban de cada peça em cada linha (ZONE_GREEN, ZONE_YELLOW ou ZONE_RED)."""
+        return (self.stock < yellow_limit).astype(np.int8) + (self.stock < red_limit)
+
+    def lines_below(self, limit=YELLOW_ALERT_LINE):
+        """Vetor booleano: linhas cuja peça de menor estoque está abaixo do limite."""
+        return self.stock.min(axis=1) < limit
+
+
+class VectorizedLines:
+    """
+    Conjunto de linhas de produção atendido por uma LineStockMatrix, com o mesmo
+    protocolo de mensagens de LineRedis. As ordens que chegam no mesmo instante
+    são acumuladas e executadas em um único consumo vetorizado.
+    """
+
+    def __init__(self, line_keys, redis_client, schedule_flush, replenishment=LINE_REPLENISHMENT):
+        self.r = redis_client
+        self.entity_name = 'vectorized-lines'
+        self.replenishment = check_replenishment_mode(replenishment)
+        self.matrix = LineStockMatrix(line_keys)
+        self.forecast = DemandForecast(len(self.matrix.line_keys), self.matrix.bom)
+        self.channels = {f"channel:line:{f}:{l}": i for i, (f, l) in enumerate(self.matrix.line_keys)}
+        self.is_waiting_for_parts = np.zeros(len(self.matrix.line_keys), dtype=bool)
+        self.pending_products = np.full(len(self.matrix.line_keys), -1, dtype=np.int64)
+        self.pending_qtys = np.zeros(len(self.matrix.line_keys), dtype=np.int64)
+        self.line_stops = 0
+        # schedule_flush(callback) agenda o callback para depois das mensagens do instante atual
+        self._schedule_flush = schedule_flush
+        self._flush_scheduled = False
+
+    def handler_for(self, channel):
+        row = self.channels[channel]
+        return lambda data: self.handle_message(row, data)
+
+    def handle_message(self, row, data):
+        msg = decode_message(data)
+
+        if msg.command == "receive_parts":
+            self.matrix.receive(np.asarray(msg.parts, dtype=np.int64), rows=row)
+            self.is_waiting_for_parts[row] = False
+
+        elif msg.command == "receive_order":
+            if self.pending_products[row] >= 0:
+                # Uma segunda ordem para a mesma linha no mesmo instante: executa a anterior antes.
+                self.execute_pending_orders()
+            self.pending_products[row] = int(msg.args[0])
+            self.pending_qtys[row] = int(msg.args[1])
+            self.forecast.record(row, int(msg.args[0]), int(msg.args[1]))
+            if not self._flush_scheduled:
+                self._flush_scheduled = True
+                self._schedule_flush(self.execute_pending_orders)
+
+    def execute_pending_orders(self):
+        """Executa todas as ordens acumuladas com um único consumo vetorizado."""
+        self._flush_scheduled = False
+        has_order = self.pending_products >= 0
+        if not has_order.any():
+            return
+
+        ok = self.matrix.consume(self.pending_products, self.pending_qtys)
+        self.line_stops += int(np.count_nonzero(has_order & ~ok))
+        for row in np.flatnonzero(has_order):
+            factory_id, line_id = self.matrix.line_keys[row]
+            product_idx, qty = int(self.pending_products[row]), int(self.pending_qtys[row])
+            if ok[row]:
+                msg = encode_message("receive_products", product_idx, line_id, factory_id, qty)
+                self.r.publish("channel:product_stock", msg)
+            else:
+                print_update(f"QUEBRA DE LINHA na linha {factory_id}-{line_id}! Estoque insuficiente para lote de {qty}.", self.entity_name, WARNING)
+
+        self.pending_products[:] = -1
+        self.pending_qtys[:] = 0
+
+    def get_state(self):
+        """
+        Estado em memória para um checkpoint (ver checkpoint.py). O estoque da
+        matriz é gravado antes nas chaves de estoque das linhas.
+        """
+        self.matrix.save(make_stock_storage(self.r))
+        return {
+            'is_waiting_for_parts': self.is_waiting_for_parts.tolist(),
+            'line_stops': self.line_stops,
+            'forecast': self.forecast.get_state(),
+        }
+
+    def set_state(self, state):
+        self.matrix.load(make_stock_storage(self.r))
+        self.is_waiting_for_parts[:] = state['is_waiting_for_parts']
+        self.line_stops = state['line_stops']
+        self.forecast.set_state(state['forecast'])
+
+    def check_and_order_parts(self):
+        """Teste de reposição de todas as linhas de uma vez; só as linhas que precisam pedem peças."""
+        self.forecast.close_day()
+        if self.replenishment == 'demanda':
+            quantities = replenishment_quantities(self.matrix.stock, self.forecast.part_rates())
+            to_order = quantities.any(axis=1) & ~self.is_waiting_for_parts
+            for row in np.flatnonzero(to_order):
+                factory_id, line_id = self.matrix.line_keys[row]
+                msg = encode_message("request_parts", line_id, factory_id, parts=quantities[row].tolist())
+                self.r.publish("channel:warehouse", msg)
+            self.is_waiting_for_parts |= to_order
+            return
+
+        to_order = self.matrix.lines_below(YELLOW_ALERT_LINE) & ~self.is_waiting_for_parts
+        flags = [1] * self.matrix.stock.shape[1]
+        for row in np.flatnonzero(to_order):
+            factory_id, line_id = self.matrix.line_keys[row]
+            self.r.publish("channel:warehouse", encode_message("send_parts", line_id, factory_id, parts=flags))
+        self.is_waiting_for_parts |= to_order
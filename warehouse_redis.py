@@ -1,157 +1,428 @@
 # warehouse_redis.py
 
 import redis
+import sys
 import threading
 import time
+import numpy as np
 from collections import deque
+from stock_storage import make_stock_storage
+from codec import encode_message, decode_message
+from order_allocator import allocate
+from replenishment import requested_quantities
+from change_feed import publish_stock_change, publish_dense_change
+from tracing import Tracer, Trace, traced_client, trace_context
+from metrics import start_metrics_server
+from tick_coordinator import run_lockstep, announce_day
+from checkpoint import load_entity_states, discard_entity_states
+from order_streams import (
+    OrderStream,
+    send_order,
+    WAREHOUSE_ORDERS_STREAM,
+    WAREHOUSE_GROUP,
+    SUPPLIER_ORDERS_STREAM
+)
 from utils import (
-    list_to_string,
-    string_to_list,
     print_update,
-    PARTS_TO_SEND_AMOUNT_WAREHOUSE,
+    INFO,
+    WARNING,
     TIME_SLEEP,
     DAYS_MAX,
     RED_ALERT_WAREHOUSE,
+    RED_ALERT_LINE,
     YELLOW_ALERT_WAREHOUSE,
     REDIS_HOST,
     REDIS_PORT,
-    NUM_PARTS
+    NUM_PARTS,
+    WIRE_FORMAT,
+    ORDER_TRANSPORT,
+    WAREHOUSE_ALLOCATION_POLICY,
+    DAY_CLOCK
 )
 
+# Tentativas de débito do lote quando outro worker mexe no estoque entre a leitura e o débito
+ALLOCATION_RETRIES = 3
+
 class WarehouseRedis:
 
-    def __init__(self, redis_client):
-        self.r = redis_client
-        self.entity_name = 'warehouse'
+    def __init__(self, redis_client, worker_id=0, order_transport=ORDER_TRANSPORT,
+                 allocation_policy=WAREHOUSE_ALLOCATION_POLICY):
+        self.r = traced_client(redis_client)
+        # O worker 0 é o almoxarifado principal (recebe do fornecedor e faz os pedidos a ele);
+        # os demais só atendem pedidos das linhas e só existem com ORDER_TRANSPORT = 'stream'.
+        self.worker_id = int(worker_id)
+        self.entity_name = 'warehouse' if self.worker_id == 0 else f'warehouse-{self.worker_id}'
+        self.tracer = Tracer(self.entity_name, redis_client)
+        self.channel = "channel:warehouse"
+        self.location = 'warehouse'
+        self.stock = make_stock_storage(self.r)
+        self.order_transport = order_transport
+        self.allocation_policy = allocation_policy
         self.waiting_for_supplier_order = False
         self.order_queue = deque()
+        self.line_orders = None
+        if order_transport == 'stream':
+            self.line_orders = OrderStream(self.r, WAREHOUSE_ORDERS_STREAM, WAREHOUSE_GROUP, self.entity_name)
+        self.stockouts = 0
+        # Pedidos do stream já contados em stockouts (ver _count_stockout), até serem confirmados
+        self.short_entries = set()
         self.lock = threading.Lock()
 
     def receive_parts(self, parts_received):
         print_update(f"Recebendo lote de peças do fornecedor.", self.entity_name)
-        for i, amount in enumerate(parts_received):
-            if amount > 0:
-                self.r.incrby(f"warehouse:part:{i}", amount)
+        self.stock.add(self.location, parts_received)
+        publish_dense_change(self.r, self.location, parts_received)
         self.waiting_for_supplier_order = False
         print_update("Estoque do almoxarifado reabastecido.", self.entity_name)
 
-    def send_parts(self, line_id, factory_id, parts_ordered_flags):
-        to_send = [0] * NUM_PARTS
-        
-        for i, needs_part in enumerate(parts_ordered_flags):
-            if needs_part:
-                stock = int(self.r.get(f"warehouse:part:{i}") or 0)
-                if stock < PARTS_TO_SEND_AMOUNT_WAREHOUSE:
-                    print_update(f"QUEBRA DE ESTOQUE! Não há peças '{i}' para a linha {factory_id}-{line_id}.", self.entity_name)
-                    return 
-                to_send[i] = PARTS_TO_SEND_AMOUNT_WAREHOUSE
-
-        for i, amount_to_send in enumerate(to_send):
-            if amount_to_send > 0:
-                self.r.decrby(f"warehouse:part:{i}", amount_to_send)
+    def send_parts(self, line_id, factory_id, quantities, order=None):
+        """
+        Envia à linha o que houver de cada peça pedida, até a quantidade pedida
+        (atendimento parcial). Devolve False se nenhuma peça pôde ser enviada;
+        o pedido então continua pendente. `order` identifica o pedido pendente
+        (ver _count_stockout).
+        """
+        demand = np.asarray([quantities], dtype=np.int64)
+        shipments = self._allocate_and_debit(demand, 'fifo')
+        if shipments is None:
+            return False
+        shipment = shipments[0]
+
+        if (shipment < demand[0]).any():
+            self._count_stockout(order)
+            short = np.flatnonzero(shipment < demand[0]).tolist()
+            print_update(f"QUEBRA DE ESTOQUE! Faltam as peças {short} para a linha {factory_id}-{line_id}; "
+                         f"{'envio parcial' if shipment.any() else 'pedido adiado'}.", self.entity_name, WARNING)
+        if not shipment.any():
+            return False
 
         target_channel = f"channel:line:{factory_id}:{line_id}"
-        payload = list_to_string(to_send)
-        msg = f"receive_parts/{payload}"
+        msg = encode_message("receive_parts", parts=shipment.tolist())
         
         print_update(f"Enviando lote de peças para o canal {target_channel}", self.entity_name)
         self.r.publish(target_channel, msg)
+        return True
+
+    def _count_stockout(self, order):
+        """
+        Conta uma quebra de estoque por pedido, por mais dias que ele fique
+        pendente: `order` é o dict da fila em memória ou o entry_id do stream
+        (None conta sempre).
+        """
+        if isinstance(order, dict):
+            if order.get('short'):
+                return
+            order['short'] = True
+        elif order is not None:
+            if order in self.short_entries:
+                return
+            self.short_entries.add(order)
+        self.stockouts += 1
+
+    def _ack_orders(self, *entry_ids):
+        self.line_orders.ack(*entry_ids)
+        self.short_entries.difference_update(entry_ids)
+
+    def _allocate_and_debit(self, demand, policy, red_rows=None):
+        """
+        Divide o estoque entre os pedidos (ver order_allocator.py), debita o
+        total em uma única chamada atômica e avisa o feed de mudanças. Devolve
+        a matriz de remessas, ou None se o estoque mudou durante a alocação em
+        todas as tentativas.
+        """
+        for _ in range(ALLOCATION_RETRIES):
+            shipments = allocate(self.stock.get_all(self.location), demand, policy, red_rows)
+            totals = shipments.sum(axis=0)
+            part_ids = np.flatnonzero(totals).tolist()
+            # Falha só se outro worker debitou o estoque depois da leitura; relê e aloca de novo
+            if not self.stock.debit(self.location, part_ids, totals[part_ids].tolist()):
+                break
+        else:
+            print_update("Estoque alterado durante a alocação em todas as tentativas; pedidos adiados.", self.entity_name, WARNING)
+            return None
+
+        if part_ids:
+            publish_stock_change(self.r, self.location, part_ids, (-totals[part_ids]).tolist())
+        return shipments
 
     def check_and_order_parts_from_supplier(self):
         if self.waiting_for_supplier_order:
             return
 
+        # Peças em alerta vermelho ou amarelo; com o índice de níveis só essas são lidas
         parts_to_order = [0] * NUM_PARTS
-        is_alert = False
-        
-        for i in range(NUM_PARTS):
-            stock = int(self.r.get(f"warehouse:part:{i}") or 0)
-            if stock < RED_ALERT_WAREHOUSE:
-                parts_to_order[i] = 1
-                is_alert = True
-            elif stock < YELLOW_ALERT_WAREHOUSE:
-                parts_to_order[i] = 1
-                is_alert = True
+        alert_parts = self.stock.parts_below(self.location, YELLOW_ALERT_WAREHOUSE)
+        for i in alert_parts:
+            parts_to_order[i] = 1
+        is_alert = bool(alert_parts)
 
         if is_alert:
             self.waiting_for_supplier_order = True
-            payload = list_to_string(parts_to_order)
-            msg = f"send_parts/{payload}"
+            msg = encode_message("send_parts", parts=parts_to_order)
             print_update("Nível de estoque baixo. Enviando pedido para o Fornecedor.", self.entity_name)
-            self.r.publish("channel:supplier", msg)
+            send_order(self.r, self.order_transport, SUPPLIER_ORDERS_STREAM, "channel:supplier", msg)
         else:
             print_update("Nível de estoque: VERDE.", self.entity_name)
 
     def process_order_queue(self):
-        """Pega um pedido da fila e o processa."""
-        order = None
+        """Pega um pedido da fila e o processa (ou todos eles, com uma política de alocação)."""
+        with self.tracer.span('process_orders'):
+            if self.allocation_policy is not None:
+                self.process_order_batch()
+                return
+
+            if self.line_orders is not None:
+                self._process_stream_order()
+                return
+
+            order = None
+            with self.lock:
+                if self.order_queue:
+                    order = self.order_queue.popleft()
+            
+            if order:
+                print_update(f"Processando pedido da fila para a linha {order['factory_id']}-{order['line_id']}", self.entity_name)
+                with trace_context(order['trace']):
+                    sent = self.send_parts(order['line_id'], order['factory_id'], order['quantities'], order)
+                if sent:
+                    self._record_queue_wait(order['trace'])
+                else:
+                    with self.lock:
+                        self.order_queue.appendleft(order)
+
+    def _record_queue_wait(self, trace):
+        """
+        Espera de um pedido, do envio pela linha até ser despachado (inclui os
+        dias sem estoque); registrada uma vez, quando o pedido sai da fila.
+        """
+        if trace is not None:
+            self.tracer.record('queue_wait', time.time() - trace.sent_at)
+
+    def _process_stream_order(self):
+        """
+        Lê um pedido do stream pelo grupo de consumidores e só o confirma (XACK)
+        depois de processado; se o worker cair antes, o pedido é reentregue.
+        """
+        # Um pedido deixado sem confirmação (sem estoque) é o primeiro do dia seguinte, como na fila em memória
+        for entry_id, data in self.line_orders.read(count=1, retry_pending=True):
+            msg = decode_message(data)
+            line_id, factory_id = msg.args
+            print_update(f"Processando pedido {entry_id} do stream para a linha {factory_id}-{line_id}", self.entity_name)
+            with trace_context(msg.trace):
+                sent = self.send_parts(line_id, factory_id, requested_quantities(msg), entry_id)
+            # Sem nenhuma peça enviada o pedido fica sem confirmação e volta na próxima leitura
+            if sent:
+                self._record_queue_wait(msg.trace)
+                self._ack_orders(entry_id)
+
+    def _take_pending_orders(self):
+        """
+        Pedidos pendentes como (pedido, line_id, factory_id, quantidades, trace):
+        `pedido` é o entry_id no stream e o próprio dict da fila em memória.
+        """
+        if self.line_orders is not None:
+            orders = []
+            for entry_id, data in self.line_orders.read_backlog():
+                msg = decode_message(data)
+                orders.append((entry_id, *msg.args, requested_quantities(msg), msg.trace))
+        else:
+            with self.lock:
+                orders = [(o, o['line_id'], o['factory_id'], o['quantities'], o['trace']) for o in self.order_queue]
+                self.order_queue.clear()
+        return orders
+
+    def _return_pending_orders(self, orders):
+        """Pedidos que ficaram sem nenhuma peça voltam para o início da fila (no stream, basta não confirmar)."""
+        if self.line_orders is not None or not orders:
+            return
+        with self.lock:
+            self.order_queue.extendleft(order for order, *_ in reversed(orders))
+
+    def process_order_batch(self):
+        """
+        Atende todos os pedidos pendentes de uma vez: lê o estoque do almoxarifado
+        uma vez, divide as peças escassas entre as linhas pela política configurada,
+        debita o total do lote em uma única chamada atômica e publica todas as
+        remessas em um único pipeline. Pedidos que não receberam nenhuma peça
+        continuam pendentes para o próximo dia.
+        """
+        orders = self._take_pending_orders()
+        if not orders:
+            return
+
+        demand = np.array([quantities for _, _, _, quantities, _ in orders], dtype=np.int64)
+
+        red_rows = None
+        if self.allocation_policy == 'red':
+            line_stocks = self.stock.get_all_many([f"line:{factory_id}:{line_id}" for _, line_id, factory_id, _, _ in orders])
+            red_rows = np.asarray(line_stocks, dtype=np.int64).min(axis=1) < RED_ALERT_LINE
+
+        shipments = self._allocate_and_debit(demand, self.allocation_policy, red_rows)
+        if shipments is None:
+            self._return_pending_orders(orders)
+            return
+
+        pipe = self.r.pipeline(transaction=False)
+        served, unserved = [], []
+        for order, shipment, wanted in zip(orders, shipments, demand):
+            key, line_id, factory_id, _, trace = order
+            if (shipment < wanted).any():
+                self._count_stockout(key)
+            if not shipment.any():
+                unserved.append(order)
+                continue
+            with trace_context(trace):
+                msg = encode_message("receive_parts", parts=shipment.tolist())
+            pipe.publish(f"channel:line:{factory_id}:{line_id}", msg)
+            served.append(order)
+            self._record_queue_wait(trace)
+        pipe.execute()
+
+        if self.line_orders is not None and served:
+            self._ack_orders(*(entry_id for entry_id, *_ in served))
+        self._return_pending_orders(unserved)
+
+        print_update(f"Lote de {len(orders)} pedidos ({self.allocation_policy}): {len(served)} atendidos, "
+                     f"{len(orders) - len(served)} sem estoque.", self.entity_name, WARNING if unserved else INFO)
+
+    def daily_routine(self):
+        """Rotina de um dia: atende os pedidos e, no worker principal, repõe o estoque com o fornecedor."""
+        self.process_order_queue()
+        if self.worker_id == 0:
+            self.check_and_order_parts_from_supplier()
+        self.log_order_queue_depth()
+
+    def order_queue_depth(self):
+        """Pedidos aguardando atendimento (e, no stream, entregues sem confirmação)."""
+        if self.line_orders is None:
+            with self.lock:
+                return {'length': len(self.order_queue), 'pending': 0, 'lag': None}
+        return self.line_orders.stats()
+
+    def log_order_queue_depth(self):
+        depth = self.order_queue_depth()
+        print_update(f"Fila de pedidos das linhas: {depth['length']} entradas, {depth['pending']} pendentes, lag {depth['lag']}.", self.entity_name)
+
+    def metrics(self):
+        """Amostras para o endpoint de métricas (ver metrics.py): (nome, rótulos, valor)."""
+        depth = self.order_queue_depth()
+        samples = [
+            ('plant_stockouts_total', {}, self.stockouts),
+            ('plant_waiting_for_parts', {}, int(self.waiting_for_supplier_order)),
+        ]
+        samples += [('plant_queue_depth', {'queue': field}, depth[field])
+                    for field in ('length', 'pending', 'lag') if depth[field] is not None]
+        return samples
+
+    def get_state(self):
+        """Estado em memória para um checkpoint (ver checkpoint.py); no stream, os pedidos ficam no próprio stream."""
+        with self.lock:
+            order_queue = [{**order, 'quantities': [int(q) for q in order['quantities']]} for order in self.order_queue]
+        return {
+            'order_queue': order_queue,
+            'waiting_for_supplier_order': self.waiting_for_supplier_order,
+            'stockouts': self.stockouts,
+            'short_entries': sorted(self.short_entries),
+        }
+
+    def set_state(self, state):
         with self.lock:
-            if self.order_queue:
-                order = self.order_queue.popleft()
+            self.order_queue = deque(
+                {**order, 'trace': Trace(*order['trace']) if order['trace'] is not None else None}
+                for order in state['order_queue']
+            )
+        self.waiting_for_supplier_order = state['waiting_for_supplier_order']
+        self.stockouts = state['stockouts']
+        self.short_entries = set(state.get('short_entries', ()))
+
+    def handle_message(self, data):
+        """Trata uma mensagem recebida no canal do almoxarifado."""
+        msg = decode_message(data)
         
-        if order:
-            print_update(f"Processando pedido da fila para a linha {order['factory_id']}-{order['line_id']}", self.entity_name)
-            self.send_parts(order['line_id'], order['factory_id'], order['parts_flags'])
+        with self.tracer.span(msg.command, msg.trace):
+            if msg.command == "receive_parts":
+                self.receive_parts(msg.parts)
+            
+            elif msg.command in ("send_parts", "request_parts") and msg.args:
+                line_id, factory_id = msg.args
+                
+                with self.lock:
+                    self.order_queue.append({
+                        'line_id': line_id,
+                        'factory_id': factory_id,
+                        'quantities': requested_quantities(msg),
+                        'trace': msg.trace
+                    })
+                print_update(f"Pedido da linha {factory_id}-{line_id} adicionado à fila.", self.entity_name)
 
     def listen(self):
         pubsub = self.r.pubsub()
-        pubsub.subscribe("channel:warehouse")
-        print_update("Ouvindo o canal 'channel:warehouse'...", self.entity_name)
+        pubsub.subscribe(self.channel)
+        print_update(f"Ouvindo o canal '{self.channel}'...", self.entity_name)
         
         # <<< CORREÇÃO CRÍTICA: Enviar sinal de que está pronto >>>
+        self.r.set("control:warehouse_ready", "READY")
         self.r.publish("control:warehouse_ready", "READY")
         print_update("Sinal de 'PRONTO' enviado para as linhas.", self.entity_name)
         
         for message in pubsub.listen():
             if message['type'] != 'message':
                 continue
-            
-            data = message['data']
-            parts = data.split("/")
-            
-            if parts[0] == "receive_parts":
-                payload = parts[1]
-                rec = string_to_list(payload)
-                self.receive_parts(rec)
-            
-            elif len(parts) > 2 and parts[2] == "send_parts":
-                line_id = parts[0]
-                factory_id = parts[1]
-                payload = parts[3]
-                parts_to_order_flags = string_to_list(payload)
-                
-                with self.lock:
-                    self.order_queue.append({
-                        'line_id': line_id,
-                        'factory_id': factory_id,
-                        'parts_flags': parts_to_order_flags
-                    })
-                print_update(f"Pedido da linha {factory_id}-{line_id} adicionado à fila.", self.entity_name)
+            self.handle_message(message['data'])
 
 def main():
+    if len(sys.argv) > 2:
+        print("Uso: python3 warehouse_redis.py [worker_id]")
+        sys.exit(1)
+    worker_id = int(sys.argv[1]) if len(sys.argv) == 2 else 0
+    if worker_id > 0 and ORDER_TRANSPORT != 'stream':
+        print("ERRO: workers adicionais do almoxarifado exigem ORDER_TRANSPORT = 'stream' em utils.py.")
+        sys.exit(1)
+
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        # Com mensagens binárias (ver codec.py) as respostas ficam em bytes
+        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=(WIRE_FORMAT == 'text'))
         r.ping()
         print_update("Conexão com Redis bem-sucedida.", 'warehouse-main')
     except redis.exceptions.ConnectionError as e:
         print(f"ERRO CRÍTICO: Não foi possível conectar ao Redis. Detalhes: {e}")
         return
 
-    wh = WarehouseRedis(r)
-    
-    listener_thread = threading.Thread(target=wh.listen, daemon=True)
-    listener_thread.start()
+    wh = WarehouseRedis(r, worker_id)
+    if load_entity_states(r, [wh]):
+        print_update("Estado restaurado do checkpoint.", wh.entity_name)
+    start_metrics_server([wh], r)
+
+    if DAY_CLOCK == 'lockstep':
+        # O tick substitui o sinal de prontidão; os workers extras não ouvem nenhum canal
+        run_lockstep(r, wh.entity_name, {'warehouse': wh.daily_routine},
+                     lambda channel, data: wh.handle_message(data), channels=[wh.channel] if worker_id == 0 else [],
+                     entities=[wh])
+        return
+
+    # Só o worker principal ouve o canal (peças do fornecedor) e avisa as linhas;
+    # os demais apenas consomem o stream de pedidos no mesmo grupo.
+    listener_thread = None
+    if worker_id == 0:
+        listener_thread = threading.Thread(target=wh.listen, daemon=True)
+        listener_thread.start()
 
     days = 0
     while days < DAYS_MAX:
         days += 1
         print_update(f"--- Dia {days} ---", wh.entity_name)
-        wh.process_order_queue()
-        wh.check_and_order_parts_from_supplier()
+        wh.daily_routine()
+        if worker_id == 0:
+            # Fim do dia do almoxarifado: o histórico de estoque registra o dia (ver stock_history.py)
+            announce_day(r, days)
+            if days == 1:
+                # Sem coordenador: passado o primeiro dia, todas já carregaram o estado do checkpoint
+                discard_entity_states(r)
         time.sleep(TIME_SLEEP)
         
     print_update("Simulação terminada.", wh.entity_name)
-    listener_thread.join()
+    if listener_thread is not None:
+        listener_thread.join()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file